@@ -8,6 +8,11 @@ class BlendRange:
     def __init__(self, data: bytes):
         self.black_low, self.black_high, self.white_low, self.white_high = struct.unpack('>4B', data)
 
+    @property
+    def is_default(self) -> bool:
+        """ The default range lets every value through. """
+        return (self.black_low, self.black_high, self.white_low, self.white_high) == (0, 0, 255, 255)
+
 
 class CSDR:
     """ Channel Source-Destination Range """
@@ -15,12 +20,21 @@ class CSDR:
         self.source = source
         self.destination = destination
 
+    @property
+    def is_default(self) -> bool:
+        return self.source.is_default and self.destination.is_default
+
 
 class BlendingRanges:
     def __init__(self, gray_range: CSDR, channel_ranges: List[CSDR]):
         self.gray_range = gray_range
         self.channel_ranges = channel_ranges
 
+    @property
+    def is_default(self) -> bool:
+        """ True if none of the ranges hide anything. """
+        return self.gray_range.is_default and all(r.is_default for r in self.channel_ranges)
+
     @classmethod
     def from_file(cls, file: BinaryIO, section_end: int) -> BlendingRanges:
         gray_blend_src = BlendRange(file.read(4))
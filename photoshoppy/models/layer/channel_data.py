@@ -1,9 +1,12 @@
+import os
 import struct
-from typing import BinaryIO, List
+import zlib
+from typing import BinaryIO, List, Tuple
 
 import numpy as np
 
-from photoshoppy.utilities.packbits import unpack_bits
+from photoshoppy.utilities.packbits import unpack_bits, unpack_bits_with_extent
+from photoshoppy.utilities.rect import Rect
 
 
 COMPRESSION_RAW = 0
@@ -12,67 +15,128 @@ COMPRESSION_ZIP_WITHOUT_PREDICTION = 2
 COMPRESSION_ZIP_PREDICTION = 3
 
 
-def get_channel_data(file: BinaryIO, width: int, height: int, depth: int = 8) -> np.ndarray:
+# Photoshop color depth to the numpy type channel data is stored as. 32-bit documents store floats.
+DEPTH_DTYPES = {8: np.dtype(">u1"), 16: np.dtype(">u2"), 32: np.dtype(">f4")}
+
+
+def get_channel_data(file: BinaryIO, width: int, height: int, depth: int = 8,
+                     data_length: int or None = None) -> np.ndarray:
     """ Read channel data from a chunk of bytes. Returns a numpy array."""
-    # Convert photoshop color depth to c type
-    ps_to_c_depth = {1: "B", 8: "B", 16: "H", 32: "I"}
-    c_data_type = ps_to_c_depth[depth]
+    return get_channel_data_and_bounds(file, width, height, depth, data_length)[0]
 
-    # Convert photoshop color depth to numpy data type
-    ps_to_np_depth = {1: np.bool_, 8: np.uint8, 16: np.uint16, 32: np.uint32}
-    np_data_type = ps_to_np_depth[depth]
 
-    # Initialize empty array
-    image_data = np.zeros((height, width), dtype=np_data_type)
+def get_channel_data_and_bounds(file: BinaryIO, width: int, height: int, depth: int = 8,
+                                data_length: int or None = None) -> Tuple[np.ndarray, Rect or None]:
+    """ Read channel data from a chunk of bytes. Returns a numpy array, and the bounding box of its non-zero pixels in
+    channel coordinates (None if every pixel is zero).
+    For RLE data, the bounding box comes straight from the runs as they're decoded.
+    ZIP data doesn't record its own length, so data_length (including the compression field) is needed to read it.
+    8-bit and 16-bit data is returned as uint8 and uint16, and 32-bit data as float32.
+    """
+    dtype = DEPTH_DTYPES[depth]
+    extents = None
 
     compression = struct.unpack('>H', file.read(2))[0]
     if compression == COMPRESSION_RAW:
-        scanlines = _read_raw(file=file, width=width, height=height, data_format=c_data_type)
+        data = file.read(width * height * dtype.itemsize)
     elif compression == COMPRESSION_RLE:
-        scanlines = _read_rle(file=file, width=width, height=height, data_format=c_data_type)
-    elif compression == COMPRESSION_ZIP_WITHOUT_PREDICTION:
-        raise NotImplementedError("Unsupported compression method: ZIP without prediction")
-    elif compression == COMPRESSION_ZIP_PREDICTION:
-        raise NotImplementedError("Unsupported compression method: ZIP with prediction")
+        data, extents = _read_rle(file=file, height=height)
+    elif compression in [COMPRESSION_ZIP_WITHOUT_PREDICTION, COMPRESSION_ZIP_PREDICTION]:
+        data = _read_zip(file, width, height, dtype, data_length, prediction=compression == COMPRESSION_ZIP_PREDICTION)
     else:
         raise NotImplementedError(f"Unknown compression method: {compression}")
 
-    # Write scanlines into image data
-    row = 0
-    channel = 0
-    for i, scanline in enumerate(scanlines):
-        if row >= height:
-            row -= height
-            channel += 1
-        image_data[row, :] = scanline
-        row += 1
+    image_data = np.frombuffer(data, dtype=dtype).reshape(height, width).astype(dtype.newbyteorder("="))
 
-    return image_data
+    if extents is None:
+        bounds = _array_bounds(image_data)
+    else:
+        bounds = _extents_to_bounds(extents, bytes_per_pixel=dtype.itemsize)
 
+    return image_data, bounds
 
-def _read_raw(file: BinaryIO, width: int, height: int, data_format: str) -> List[int or float]:
-    """ Raw image data. """
-    scanlines = []
-    for row in range(height):
-        data = file.read(width)
-        scanline = struct.unpack(f'>{width}{data_format}', data)
-        scanlines.append(scanline)
-    return scanlines
+
+def get_channel_rows(file: BinaryIO, width: int, height: int, top: int, bottom: int, depth: int = 8,
+                     data_length: int or None = None) -> np.ndarray:
+    """ Read rows top to bottom of channel data, without decoding the rest.
+    RLE data stores the byte count of every row up front, so they're summed up to seek straight to the first row.
+    ZIP data can't be read part way, so all of it is decompressed.
+    """
+    dtype = DEPTH_DTYPES[depth]
+    row_length = width * dtype.itemsize
+    rows = max(0, bottom - top)
+
+    compression = struct.unpack('>H', file.read(2))[0]
+    if compression == COMPRESSION_RAW:
+        file.seek(top * row_length, os.SEEK_CUR)
+        data = file.read(rows * row_length)
+    elif compression == COMPRESSION_RLE:
+        data_lengths = np.frombuffer(file.read(height * 2), dtype=">u2")
+        offsets = np.concatenate([[0], np.cumsum(data_lengths, dtype=np.int64)])
+        file.seek(int(offsets[top]), os.SEEK_CUR)
+        packed = file.read(int(offsets[top + rows] - offsets[top]))
+        row_offsets = offsets[top:top + rows + 1] - offsets[top]
+        data = b"".join(unpack_bits(packed[row_offsets[i]:row_offsets[i + 1]]) for i in range(rows))
+    elif compression in [COMPRESSION_ZIP_WITHOUT_PREDICTION, COMPRESSION_ZIP_PREDICTION]:
+        data = _read_zip(file, width, height, dtype, data_length, prediction=compression == COMPRESSION_ZIP_PREDICTION)
+        data = data[top * row_length:(top + rows) * row_length]
+    else:
+        raise NotImplementedError(f"Unsupported compression method: {compression}")
+
+    return np.frombuffer(data, dtype=dtype).reshape(rows, width).astype(dtype.newbyteorder("="))
 
 
-def _read_rle(file: BinaryIO, width: int, height: int, data_format: str) -> List[int or float]:
-    """ RLE data is stored with the PackBits compression scheme. """
+def _read_rle(file: BinaryIO, height: int) -> Tuple[bytes, List[Tuple[int or None, int or None]]]:
+    """ RLE data is stored with the PackBits compression scheme.
+    Also returns the (first, last + 1) byte offsets of non-zero data in each scanline.
+    """
     # First part of RLE image data stores the lengths of each data segment
-    scanlines = []
-    data_lengths = []
-    for row in range(height):
-        length = struct.unpack('>H', file.read(2))[0]
-        data_lengths.append(length)
+    data_lengths = struct.unpack(f'>{height}H', file.read(2 * height))
 
     # Decompress each scanline
+    scanlines = []
+    extents = []
     for length in data_lengths:
-        data = unpack_bits(file.read(length))
-        scanline = struct.unpack(f'>{width}{data_format}', data)
-        scanlines.append(scanline)
-
-    return scanlines
+        data, first, last = unpack_bits_with_extent(file.read(length))
+        scanlines.append(data)
+        extents.append((first, last))
+
+    return b"".join(scanlines), extents
+
+
+def _read_zip(file: BinaryIO, width: int, height: int, dtype: np.dtype, data_length: int or None,
+              prediction: bool) -> bytes:
+    """ ZIP data is a zlib stream. With prediction, each row stores the difference from the pixel to its left; 32-bit
+    rows are split into planes of each byte of the floats first, and the difference is taken byte by byte.
+    """
+    if data_length is None:
+        raise ValueError("The length of ZIP compressed channel data is needed to read it")
+    data = zlib.decompress(file.read(data_length - 2))
+    if not prediction or not height or not width:
+        return data
+
+    if dtype.itemsize == 4:
+        planes = np.frombuffer(data, dtype=np.uint8).reshape(height, width * 4)
+        planes = np.cumsum(planes, axis=1, dtype=np.uint8)
+        return np.ascontiguousarray(planes.reshape(height, 4, width).transpose(0, 2, 1)).tobytes()
+
+    unsigned = np.dtype(f">u{dtype.itemsize}")
+    deltas = np.frombuffer(data, dtype=unsigned).reshape(height, width).astype(unsigned.newbyteorder("="))
+    return np.cumsum(deltas, axis=1, dtype=deltas.dtype).astype(unsigned).tobytes()
+
+
+def _extents_to_bounds(extents: List[Tuple[int or None, int or None]], bytes_per_pixel: int) -> Rect or None:
+    rows = [row for row, (first, _) in enumerate(extents) if first is not None]
+    if not rows:
+        return None
+    left = min(extents[row][0] for row in rows) // bytes_per_pixel
+    right = -(-max(extents[row][1] for row in rows) // bytes_per_pixel)
+    return Rect(rows[0], left, rows[-1] + 1, right)
+
+
+def _array_bounds(array: np.ndarray) -> Rect or None:
+    rows = np.flatnonzero(array.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(array.any(axis=0))
+    return Rect(int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1)
@@ -1,10 +1,12 @@
 from __future__ import annotations
+import os
 from typing import BinaryIO
 
 import numpy as np
 
 import photoshoppy
-from photoshoppy.models.layer.channel_data import get_channel_data
+from photoshoppy.models.layer.channel_data import get_channel_data, get_channel_data_and_bounds, get_channel_rows
+from photoshoppy.utilities.rect import Rect
 
 CHANNEL_RED = "red"
 CHANNEL_GREEN = "green"
@@ -15,11 +17,17 @@ CHANNEL_REAL_USER_LAYER_MASK = "real user-supplied layer mask"
 
 
 class LayerChannel:
-    def __init__(self, channel_id: int, layer: photoshoppy.models.layer.model.Layer):
+    def __init__(self, channel_id: int, layer: photoshoppy.models.layer.model.Layer, data_length: int = 0):
         self._id = channel_id
         self._channel_data = np.empty(0)
+        self._content_bounds = None
+        self._data_length = data_length
         self._layer = layer
 
+        # Location of channel data that hasn't been decoded yet
+        self._file_path = None
+        self._data_offset = None
+
     @property
     def id(self) -> int:
         return self._id
@@ -36,16 +44,80 @@ class LayerChannel:
         }
         return channel_names.get(self.id)
 
+    @property
+    def is_color(self) -> bool:
+        """ True for the color channels of the document's color mode, like red, green and blue, or cyan, magenta,
+        yellow and black.
+        """
+        return self.id >= 0
+
+    @property
+    def data_length(self) -> int:
+        """ Length of the channel data in the file, in bytes. """
+        return self._data_length
+
     @property
     def channel_data(self) -> np.array:
+        if self._channel_data is None:
+            self._read_deferred_channel_data()
         return self._channel_data
 
+    @property
+    def content_bounds(self) -> Rect or None:
+        """ Bounding box of the non-zero pixels, in channel coordinates. None if every pixel is zero. """
+        if self._channel_data is None:
+            self._read_deferred_channel_data()
+        return self._content_bounds
+
+    @property
+    def is_decoded(self) -> bool:
+        return self._channel_data is not None
+
     @property
     def layer(self) -> photoshoppy.models.layer.model.Layer:
         return self._layer
 
-    def read_channel_data(self, file: BinaryIO) -> np.array:
-        if self.name in [CHANNEL_RED, CHANNEL_GREEN, CHANNEL_BLUE, CHANNEL_TRANSPARENCY_MASK]:
-            self._channel_data = get_channel_data(file, self.layer.width, self.layer.height)
+    def read_channel_data(self, file: BinaryIO, lazy: bool = False):
+        """ Read channel data from the current position in the file.
+        If lazy is True, only remember where the data is; it's decoded the first time channel_data is accessed.
+        """
+        if lazy:
+            self._file_path = file.name
+            self._data_offset = file.tell()
+            self._channel_data = None
+            file.seek(self.data_length, os.SEEK_CUR)
+            return
+
+        # Decoded data is only published once it's complete, since exporters may read deferred channels from
+        # several threads at once.
+        channel_data = np.empty(0)
+        if self.is_color or self.name == CHANNEL_TRANSPARENCY_MASK:
+            channel_data, self._content_bounds = get_channel_data_and_bounds(
+                file, self.layer.width, self.layer.height, self.layer.depth, self.data_length)
         elif self.name in [CHANNEL_USER_LAYER_MASK, CHANNEL_REAL_USER_LAYER_MASK]:
-            self._channel_data = get_channel_data(file, self.layer.layer_mask.width, self.layer.layer_mask.height)
+            channel_data = get_channel_data(file, self.layer.layer_mask.width, self.layer.layer_mask.height,
+                                            self.layer.depth, self.data_length)
+        else:
+            file.seek(self.data_length, os.SEEK_CUR)
+        self._channel_data = channel_data
+        self.layer.invalidate_image_data()
+
+    def read_rows(self, top: int, bottom: int) -> np.array:
+        """ Return rows top to bottom of the channel data. If the channel hasn't been decoded yet, only those rows are
+        decoded, and they aren't kept.
+        """
+        if self._channel_data is not None:
+            return self._channel_data[top:bottom]
+
+        if self.name in [CHANNEL_USER_LAYER_MASK, CHANNEL_REAL_USER_LAYER_MASK]:
+            width, height = self.layer.layer_mask.width, self.layer.layer_mask.height
+        else:
+            width, height = self.layer.width, self.layer.height
+        with open(self._file_path, 'rb') as f:
+            f.seek(self._data_offset, os.SEEK_SET)
+            return get_channel_rows(f, width, height, top, bottom, self.layer.depth, self.data_length)
+
+    def _read_deferred_channel_data(self):
+        with open(self._file_path, 'rb') as f:
+            f.seek(self._data_offset, os.SEEK_SET)
+            self.read_channel_data(f)
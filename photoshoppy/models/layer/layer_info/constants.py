@@ -74,4 +74,5 @@ layer_info_names = {
     'LMsk': "User Mask",
     'FXid': "Filter Effects",
     'FEid': "Filter Effects",
+    'iOpa': "Fill Opacity",
 }
@@ -1 +1,6 @@
 from .section_divider import SectionDivider
+from .fill_opacity import FillOpacity
+from .adjustments import Adjustment, Levels, Curves, Invert, Posterize, Threshold, BrightnessContrast, HueSaturation
+from .fill_layers import FillContent, SolidColor, GradientFill, PatternFill
+from .patterns import Pattern, Patterns
+from .vector_mask import VectorMask, Subpath, PathKnot
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import struct
+from typing import BinaryIO, Dict, List, Tuple
+
+from photoshoppy.models.layer.layer_info.model import LayerInfo
+from photoshoppy.utilities.read_section import ReadSection
+
+
+# Channel indices used by levels and curves. The composite applies to every channel, after the channel's own settings.
+CHANNEL_COMPOSITE = 0
+CHANNEL_RED = 1
+CHANNEL_GREEN = 2
+CHANNEL_BLUE = 3
+
+CURVES_EXTRA_SIGNATURE = b"Crv "
+
+
+class Adjustment(LayerInfo):
+    """ Base class for the layer info blocks of adjustment layers. """
+
+
+class LevelsRecord:
+    def __init__(self, input_floor: int, input_ceiling: int, output_floor: int, output_ceiling: int, gamma: int):
+        self.input_floor = input_floor
+        self.input_ceiling = input_ceiling
+        self.output_floor = output_floor
+        self.output_ceiling = output_ceiling
+        self._gamma = gamma
+
+    @property
+    def gamma(self) -> float:
+        # Stored as 10-999, for 0.1-9.99
+        return self._gamma / 100
+
+    @property
+    def is_default(self) -> bool:
+        return (self.input_floor, self.input_ceiling, self.output_floor, self.output_ceiling, self._gamma) == \
+            (0, 255, 0, 255, 100)
+
+
+class Levels(Adjustment):
+    def __init__(self, records: List[LevelsRecord]):
+        self._records = records
+
+    @property
+    def records(self) -> List[LevelsRecord]:
+        """ The composite record, followed by one for each channel. """
+        return self._records
+
+    @classmethod
+    def key(cls) -> str:
+        return "levl"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Levels"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Levels:
+        with ReadSection(file) as section:
+            file.read(2)  # Version = 2
+            records = []
+            # 29 records; Photoshop CS and later append more in a "Lvls" block, for channels that don't apply to RGB
+            for _ in range(29):
+                if file.tell() + 10 > section.section_end:
+                    break
+                records.append(LevelsRecord(*struct.unpack('>5H', file.read(10))))
+
+        return cls(records)
+
+
+class Curves(Adjustment):
+    def __init__(self, curves: Dict[int, List[Tuple[int, int]]], is_map: bool = False):
+        self._curves = curves
+        self._is_map = is_map
+
+    @property
+    def curves(self) -> Dict[int, List[Tuple[int, int]]]:
+        """ Channel index -> curve. A curve is a list of (input, output) points, or 256 outputs if is_map is True. """
+        return self._curves
+
+    @property
+    def is_map(self) -> bool:
+        """ Curves drawn freehand are stored as a value for every input, instead of as points. """
+        return self._is_map
+
+    @classmethod
+    def key(cls) -> str:
+        return "curv"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Curves"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Curves:
+        with ReadSection(file) as section:
+            is_map, version, curve_map = struct.unpack('>BHI', file.read(7))
+            if version == 1:
+                # A bit is set for each channel that has a curve
+                channels = [i for i in range(32) if curve_map & (1 << i)]
+            else:
+                channels = list(range(curve_map))
+
+            curves = [cls._read_curve(file, is_map) for _ in channels]
+
+            # Version 4 curves, and some version 1 curves, are followed by the same curves with their channel indices
+            if file.tell() + 4 <= section.section_end and file.read(4) == CURVES_EXTRA_SIGNATURE:
+                _, count = struct.unpack('>HI', file.read(6))
+                channels = []
+                curves = []
+                for _ in range(count):
+                    channels.append(struct.unpack('>H', file.read(2))[0])
+                    curves.append(cls._read_curve(file, is_map))
+
+        return cls(dict(zip(channels, curves)), is_map=bool(is_map))
+
+    @staticmethod
+    def _read_curve(file: BinaryIO, is_map: bool) -> List:
+        if is_map:
+            return list(file.read(256))
+        point_count = struct.unpack('>H', file.read(2))[0]
+        points = [struct.unpack('>2H', file.read(4)) for _ in range(point_count)]
+        return [(point_input, point_output) for point_output, point_input in points]
+
+
+class Invert(Adjustment):
+    @classmethod
+    def key(cls) -> str:
+        return "nvrt"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Invert"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Invert:
+        with ReadSection(file):
+            pass
+
+        return cls()
+
+
+class Posterize(Adjustment):
+    def __init__(self, levels: int):
+        self._levels = levels
+
+    @property
+    def levels(self) -> int:
+        # 2-255
+        return self._levels
+
+    @classmethod
+    def key(cls) -> str:
+        return "post"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Posterize"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Posterize:
+        with ReadSection(file):
+            levels = struct.unpack('>H', file.read(2))[0]  # Followed by 2 bytes of padding
+
+        return cls(levels)
+
+
+class Threshold(Adjustment):
+    def __init__(self, level: int):
+        self._level = level
+
+    @property
+    def level(self) -> int:
+        # 1-255; pixels with a gray value at least this bright turn white, and the rest turn black
+        return self._level
+
+    @classmethod
+    def key(cls) -> str:
+        return "thrs"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Threshold"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Threshold:
+        with ReadSection(file):
+            level = struct.unpack('>H', file.read(2))[0]  # Followed by 2 bytes of padding
+
+        return cls(level)
+
+
+class BrightnessContrast(Adjustment):
+    def __init__(self, brightness: int, contrast: int, mean: int, lab_only: bool):
+        self._brightness = brightness
+        self._contrast = contrast
+        self._mean = mean
+        self._lab_only = lab_only
+
+    @property
+    def brightness(self) -> int:
+        # -100-100
+        return self._brightness
+
+    @property
+    def contrast(self) -> int:
+        # -100-100
+        return self._contrast
+
+    @property
+    def mean(self) -> int:
+        return self._mean
+
+    @property
+    def lab_only(self) -> bool:
+        return self._lab_only
+
+    @classmethod
+    def key(cls) -> str:
+        return "brit"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Brightness/Contrast"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> BrightnessContrast:
+        with ReadSection(file):
+            brightness, contrast, mean, lab_only = struct.unpack('>2hHB', file.read(7))
+
+        return cls(brightness, contrast, mean, bool(lab_only))
+
+
+class HueSaturationRange:
+    def __init__(self, range_values: Tuple[int, int, int, int], hue: int, saturation: int, lightness: int):
+        self.range_values = range_values
+        self.hue = hue
+        self.saturation = saturation
+        self.lightness = lightness
+
+
+class HueSaturation(Adjustment):
+    def __init__(self, colorize: bool, colorization: Tuple[int, int, int], master: Tuple[int, int, int],
+                 ranges: List[HueSaturationRange]):
+        self._colorize = colorize
+        self._colorization = colorization
+        self._master = master
+        self._ranges = ranges
+
+    @property
+    def colorize(self) -> bool:
+        return self._colorize
+
+    @property
+    def colorization(self) -> Tuple[int, int, int]:
+        """ Hue (-180-180), saturation (0-100) and lightness (-100-100) used if colorize is True. """
+        return self._colorization
+
+    @property
+    def master(self) -> Tuple[int, int, int]:
+        """ Hue (-180-180), saturation (-100-100) and lightness (-100-100) applied to every color. """
+        return self._master
+
+    @property
+    def ranges(self) -> List[HueSaturationRange]:
+        """ Settings for the reds, yellows, greens, cyans, blues and magentas. """
+        return self._ranges
+
+    @classmethod
+    def key(cls) -> str:
+        return "hue2"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Hue/Saturation"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> HueSaturation:
+        with ReadSection(file):
+            _, colorize, _ = struct.unpack('>HBB', file.read(4))  # Version = 2, then 1 byte of padding
+            colorization = struct.unpack('>3h', file.read(6))
+            master = struct.unpack('>3h', file.read(6))
+            ranges = []
+            for _ in range(6):
+                values = struct.unpack('>4h3h', file.read(14))
+                ranges.append(HueSaturationRange(values[:4], *values[4:]))
+
+        return cls(bool(colorize), colorization, master, ranges)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+from typing import BinaryIO, List, Tuple
+
+from photoshoppy.models.layer.layer_info.model import LayerInfo
+from photoshoppy.utilities.descriptor import Descriptor, UnitFloat, read_descriptor
+from photoshoppy.utilities.read_section import ReadSection
+
+
+# Gradient types, by their descriptor enum
+GRADIENT_TYPES = {
+    "Lnr ": "linear",
+    "Rdl ": "radial",
+    "Angl": "angle",
+    "Rflc": "reflected",
+    "Dmnd": "diamond",
+}
+
+# Color stops that use the foreground or background color store the color they had when the gradient was made; if they
+#   don't, Photoshop's default colors are used. Gray is stored as a percentage of ink, so 100 is black.
+DEFAULT_FOREGROUND_COLOR = Descriptor("", "Grsc", {"Gry ": 100.0})
+DEFAULT_BACKGROUND_COLOR = Descriptor("", "Grsc", {"Gry ": 0.0})
+
+
+class FillContent(LayerInfo):
+    """ Base class for the layer info blocks of fill layers, which generate their pixels instead of storing them. """
+
+    @classmethod
+    def from_descriptor(cls, descriptor: Descriptor) -> FillContent:
+        raise NotImplementedError
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> FillContent:
+        with ReadSection(file):
+            file.read(4)  # Version = 16
+            descriptor = read_descriptor(file)
+
+        return cls.from_descriptor(descriptor)
+
+
+class SolidColor(FillContent):
+    def __init__(self, color: Descriptor):
+        self._color = color
+
+    @property
+    def color(self) -> Descriptor:
+        """ A color descriptor; its class ID is the color's model ('RGBC', 'HSBC', 'CMYC', 'Grsc' or 'LbCl'). """
+        return self._color
+
+    @classmethod
+    def key(cls) -> str:
+        return "SoCo"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Solid Color"
+
+    @classmethod
+    def from_descriptor(cls, descriptor: Descriptor) -> SolidColor:
+        return cls(descriptor["Clr "])
+
+
+class ColorStop:
+    def __init__(self, location: int, midpoint: int, color: Descriptor):
+        self.location = location  # 0-4096
+        self.midpoint = midpoint  # 0-100; the percentage of the way to the next stop where colors are mixed evenly
+        self.color = color
+
+
+class TransparencyStop:
+    def __init__(self, location: int, midpoint: int, opacity: float):
+        self.location = location  # 0-4096
+        self.midpoint = midpoint  # 0-100
+        self.opacity = opacity  # 0-100
+
+
+class GradientFill(FillContent):
+    def __init__(self, gradient_type: str, angle: float, scale: float, reverse: bool, align: bool,
+                 offset: Tuple[float, float], color_stops: List[ColorStop],
+                 transparency_stops: List[TransparencyStop], is_noise: bool = False):
+        self._gradient_type = gradient_type
+        self._angle = angle
+        self._scale = scale
+        self._reverse = reverse
+        self._align = align
+        self._offset = offset
+        self._color_stops = color_stops
+        self._transparency_stops = transparency_stops
+        self._is_noise = is_noise
+
+    @property
+    def gradient_type(self) -> str:
+        """ 'linear', 'radial', 'angle', 'reflected' or 'diamond'. """
+        return self._gradient_type
+
+    @property
+    def angle(self) -> float:
+        # Degrees, counterclockwise from pointing right
+        return self._angle
+
+    @property
+    def scale(self) -> float:
+        # Percent
+        return self._scale
+
+    @property
+    def reverse(self) -> bool:
+        return self._reverse
+
+    @property
+    def align(self) -> bool:
+        """ If True, the gradient spans the layer's bounds; otherwise it spans the canvas. """
+        return self._align
+
+    @property
+    def offset(self) -> Tuple[float, float]:
+        """ Horizontal and vertical offset of the gradient's center, in percent of the area it spans. """
+        return self._offset
+
+    @property
+    def color_stops(self) -> List[ColorStop]:
+        return self._color_stops
+
+    @property
+    def transparency_stops(self) -> List[TransparencyStop]:
+        return self._transparency_stops
+
+    @property
+    def is_noise(self) -> bool:
+        """ Noise gradients are generated from a random seed instead of stops. """
+        return self._is_noise
+
+    @classmethod
+    def key(cls) -> str:
+        return "GdFl"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Gradient"
+
+    @classmethod
+    def from_descriptor(cls, descriptor: Descriptor) -> GradientFill:
+        gradient = descriptor["Grad"]
+        color_stops = []
+        for stop in gradient.get("Clrs", []):
+            color = stop.get("Clr ")
+            if stop.get("Type") == "BckC":
+                color = color or DEFAULT_BACKGROUND_COLOR
+            color_stops.append(ColorStop(stop["Lctn"], stop["Mdpn"], color or DEFAULT_FOREGROUND_COLOR))
+        transparency_stops = [TransparencyStop(stop["Lctn"], stop["Mdpn"], stop["Opct"].value)
+                              for stop in gradient.get("Trns", [])]
+
+        offset = descriptor.get("Ofst")
+        return cls(
+            gradient_type=GRADIENT_TYPES.get(descriptor.get("Type", "Lnr "), "linear"),
+            angle=descriptor["Angl"].value if "Angl" in descriptor else 90.0,
+            scale=descriptor["Scl "].value if "Scl " in descriptor else 100.0,
+            reverse=descriptor.get("Rvrs", False),
+            align=descriptor.get("Algn", True),
+            offset=(_number(offset["Hrzn"]), _number(offset["Vrtc"])) if offset is not None else (0.0, 0.0),
+            color_stops=color_stops,
+            transparency_stops=transparency_stops,
+            is_noise=gradient.get("GrdF") == "ClNs")
+
+
+class PatternFill(FillContent):
+    def __init__(self, pattern_id: str, pattern_name: str, scale: float, align: bool, phase: Tuple[float, float]):
+        self._pattern_id = pattern_id
+        self._pattern_name = pattern_name
+        self._scale = scale
+        self._align = align
+        self._phase = phase
+
+    @property
+    def pattern_id(self) -> str:
+        """ The unique ID of one of the document's patterns; see Patterns. """
+        return self._pattern_id
+
+    @property
+    def pattern_name(self) -> str:
+        return self._pattern_name
+
+    @property
+    def scale(self) -> float:
+        # Percent
+        return self._scale
+
+    @property
+    def align(self) -> bool:
+        """ If True, the pattern is tiled from the layer's origin; otherwise from the canvas origin. """
+        return self._align
+
+    @property
+    def phase(self) -> Tuple[float, float]:
+        """ Horizontal and vertical offset of the pattern, in pixels. """
+        return self._phase
+
+    @classmethod
+    def key(cls) -> str:
+        return "PtFl"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Pattern"
+
+    @classmethod
+    def from_descriptor(cls, descriptor: Descriptor) -> PatternFill:
+        pattern = descriptor["Ptrn"]
+        phase = descriptor.get("phase")
+        return cls(
+            pattern_id=pattern["Idnt"],
+            pattern_name=pattern.get("Nm  ", ""),
+            scale=descriptor["Scl "].value if "Scl " in descriptor else 100.0,
+            align=descriptor.get("Algn", True),
+            phase=(_number(phase["Hrzn"]), _number(phase["Vrtc"])) if phase is not None else (0.0, 0.0))
+
+
+def _number(value: float or UnitFloat) -> float:
+    """ Points are stored as plain doubles, or as unit floats. """
+    return value.value if isinstance(value, UnitFloat) else value
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import struct
+from typing import BinaryIO
+
+from photoshoppy.models.layer.layer_info.model import LayerInfo
+from photoshoppy.utilities.read_section import ReadSection
+
+
+class FillOpacity(LayerInfo):
+    def __init__(self, fill: int):
+        self._fill = fill
+
+    @property
+    def fill(self) -> int:
+        # 0 = Transparent; 255 = Opaque
+        return self._fill
+
+    @classmethod
+    def key(cls) -> str:
+        return "iOpa"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Fill Opacity"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> FillOpacity:
+        with ReadSection(file):
+            fill = struct.unpack('>B', file.read(1))[0]  # Followed by 3 bytes of padding
+
+        return cls(fill)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import io
+import os
+import struct
+from typing import BinaryIO, List
+
+import numpy as np
+
+from photoshoppy.models.layer.layer_info.model import LayerInfo
+from photoshoppy.psd_render.color_conversion import COLOR_MODE_IDS, color_channel_count
+from photoshoppy.utilities.image_data import get_image_data
+from photoshoppy.utilities.read_section import ReadSection
+from photoshoppy.utilities.rect import Rect
+from photoshoppy.utilities.string import read_pascal_string, read_unicode_string
+
+
+class Pattern:
+    def __init__(self, name: str, pattern_id: str, color_mode: str, rect: Rect, planes: List[np.array],
+                 alpha: np.array or None = None, palette: np.array or None = None):
+        self._name = name
+        self._pattern_id = pattern_id
+        self._color_mode = color_mode
+        self._rect = rect
+        self._planes = planes
+        self._alpha = alpha
+        self._palette = palette
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def pattern_id(self) -> str:
+        return self._pattern_id
+
+    @property
+    def color_mode(self) -> str:
+        return self._color_mode
+
+    @property
+    def rect(self) -> Rect:
+        return self._rect
+
+    @property
+    def width(self) -> int:
+        return self._rect.right - self._rect.left
+
+    @property
+    def height(self) -> int:
+        return self._rect.bottom - self._rect.top
+
+    @property
+    def planes(self) -> List[np.array]:
+        """ The pattern's color channels, as 8-bit or 16-bit planes. """
+        return self._planes
+
+    @property
+    def alpha(self) -> np.array or None:
+        return self._alpha
+
+    @property
+    def palette(self) -> np.array or None:
+        """ The (256, 3) RGB palette of an indexed color pattern. """
+        return self._palette
+
+    @classmethod
+    def read_pattern(cls, file: BinaryIO) -> Pattern:
+        with ReadSection(file):
+            file.read(4)  # Version = 1
+            image_mode = struct.unpack('>L', file.read(4))[0]
+            file.read(4)  # Height and width; the pattern data's rect is used instead
+            name = read_unicode_string(file).rstrip("\x00")
+            pattern_id = read_pascal_string(file)
+            if pattern_id.count == 0:
+                file.seek(1, os.SEEK_CUR)  # Null strings aren't read past their count byte
+            pattern_id = pattern_id.value
+
+            color_mode = COLOR_MODE_IDS[image_mode]
+            palette = None
+            if color_mode == "Indexed":
+                palette = np.frombuffer(file.read(768), dtype=np.uint8).reshape(256, 3).copy()
+                file.read(4)  # Palette size and transparent index
+
+            rect, channels = cls._read_virtual_memory_array_list(file)
+
+        color_channels = color_channel_count(color_mode)
+        planes = channels[:color_channels]
+        alpha = channels[color_channels] if len(channels) > color_channels else None
+        return cls(name, pattern_id, color_mode, rect, planes, alpha=alpha, palette=palette)
+
+    @classmethod
+    def _read_virtual_memory_array_list(cls, file: BinaryIO) -> tuple:
+        """ Returns the pattern's rect, and every channel that was written. """
+        file.read(4)  # Version = 3
+        with ReadSection(file):
+            rect = Rect(*struct.unpack('>4L', file.read(16)))
+            channel_count = struct.unpack('>L', file.read(4))[0]
+
+            # Followed by a user mask and a sheet mask
+            channels = []
+            for _ in range(channel_count + 2):
+                is_written = struct.unpack('>L', file.read(4))[0]
+                if not is_written:
+                    continue
+                with ReadSection(file) as array_section:
+                    if array_section.section_length == 0:
+                        continue
+                    file.read(4)  # Pixel depth
+                    array_rect = Rect(*struct.unpack('>4L', file.read(16)))
+                    depth, compression = struct.unpack('>HB', file.read(3))
+                    data = io.BytesIO(file.read(array_section.section_end - file.tell()))
+                    width, height = array_rect.right - array_rect.left, array_rect.bottom - array_rect.top
+                    channels.append(get_image_data(data, compression, width, height, channels=1, depth=depth)[:, :, 0])
+
+        return rect, channels
+
+
+class Patterns(LayerInfo):
+    """ The patterns a document's pattern fills and effects use. Patterns are stored in the document's global layer
+    info, instead of in a layer.
+    """
+    def __init__(self, patterns: List[Pattern]):
+        self._patterns = patterns
+
+    @property
+    def patterns(self) -> List[Pattern]:
+        return self._patterns
+
+    @classmethod
+    def key(cls) -> str:
+        return "Patt"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Pattern"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> Patterns:
+        patterns = []
+        with ReadSection(file) as section:
+            while file.tell() + 4 <= section.section_end:
+                pattern_start = file.tell()
+                patterns.append(Pattern.read_pattern(file))
+                # Each pattern is padded to a multiple of 4 bytes
+                file.seek(pattern_start + (file.tell() - pattern_start + 3) // 4 * 4, os.SEEK_SET)
+
+        return cls(patterns)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import struct
+from typing import BinaryIO, List, Tuple
+
+from photoshoppy.models.layer.layer_info.model import LayerInfo
+from photoshoppy.utilities.read_section import ReadSection
+
+
+FLAG_INVERT = 1 << 0
+FLAG_NOT_LINKED = 1 << 1
+FLAG_DISABLED = 1 << 2
+
+# Path record selectors
+RECORD_CLOSED_SUBPATH_LENGTH = 0
+RECORD_CLOSED_SUBPATH_KNOT_LINKED = 1
+RECORD_CLOSED_SUBPATH_KNOT_UNLINKED = 2
+RECORD_OPEN_SUBPATH_LENGTH = 3
+RECORD_OPEN_SUBPATH_KNOT_LINKED = 4
+RECORD_OPEN_SUBPATH_KNOT_UNLINKED = 5
+RECORD_PATH_FILL_RULE = 6
+RECORD_CLIPBOARD = 7
+RECORD_INITIAL_FILL_RULE = 8
+
+PATH_RECORD_LENGTH = 26
+
+# How a subpath is combined with the subpaths before it
+OPERATION_XOR = 0
+OPERATION_UNION = 1
+OPERATION_SUBTRACT = 2
+OPERATION_INTERSECT = 3
+
+
+class PathKnot:
+    """ A Bezier knot: the control point before the anchor, the anchor, and the control point after it. Points are
+    (vertical, horizontal), as fractions of the document's height and width.
+    """
+    def __init__(self, preceding: Tuple[float, float], anchor: Tuple[float, float], leaving: Tuple[float, float],
+                 linked: bool = True):
+        self.preceding = preceding
+        self.anchor = anchor
+        self.leaving = leaving
+        self.linked = linked
+
+
+class Subpath:
+    def __init__(self, closed: bool, operation: int, knots: List[PathKnot]):
+        self.closed = closed
+        self.operation = operation
+        self.knots = knots
+
+
+class VectorMask(LayerInfo):
+    def __init__(self, flags: int, subpaths: List[Subpath], fills_all: bool = False):
+        self._flags = flags
+        self._subpaths = subpaths
+        self._fills_all = fills_all
+
+    @property
+    def flags(self) -> int:
+        return self._flags
+
+    @property
+    def is_inverted(self) -> bool:
+        return self._flags & FLAG_INVERT != 0
+
+    @property
+    def is_linked(self) -> bool:
+        return self._flags & FLAG_NOT_LINKED == 0
+
+    @property
+    def is_disabled(self) -> bool:
+        return self._flags & FLAG_DISABLED != 0
+
+    @property
+    def subpaths(self) -> List[Subpath]:
+        return self._subpaths
+
+    @property
+    def fills_all(self) -> bool:
+        """ If True, the path's fill starts with every pixel, so the subpaths cut out of it. """
+        return self._fills_all
+
+    @classmethod
+    def key(cls) -> str:
+        return "vmsk"
+
+    @classmethod
+    def name(cls) -> str:
+        return "Vector Mask"
+
+    @classmethod
+    def read_section(cls, file: BinaryIO) -> VectorMask:
+        with ReadSection(file) as section:
+            _, flags = struct.unpack('>2L', file.read(8))  # Version = 3
+            subpaths = []
+            fills_all = False
+            while file.tell() + PATH_RECORD_LENGTH <= section.section_end:
+                record = file.read(PATH_RECORD_LENGTH)
+                selector = struct.unpack('>H', record[:2])[0]
+                if selector in [RECORD_CLOSED_SUBPATH_LENGTH, RECORD_OPEN_SUBPATH_LENGTH]:
+                    _, operation = struct.unpack('>Hh', record[2:6])
+                    subpaths.append(Subpath(selector == RECORD_CLOSED_SUBPATH_LENGTH, operation, []))
+                elif selector in [RECORD_CLOSED_SUBPATH_KNOT_LINKED, RECORD_CLOSED_SUBPATH_KNOT_UNLINKED,
+                                  RECORD_OPEN_SUBPATH_KNOT_LINKED, RECORD_OPEN_SUBPATH_KNOT_UNLINKED]:
+                    if subpaths:
+                        subpaths[-1].knots.append(cls._read_knot(record, selector))
+                elif selector == RECORD_INITIAL_FILL_RULE:
+                    fills_all = struct.unpack('>H', record[2:4])[0] == 1
+
+        return cls(flags, subpaths, fills_all=fills_all)
+
+    @staticmethod
+    def _read_knot(record: bytes, selector: int) -> PathKnot:
+        # Fixed point numbers, with 8 bits before the binary point and 24 after it
+        values = [value / (1 << 24) for value in struct.unpack('>6i', record[2:26])]
+        points = [(values[i], values[i + 1]) for i in range(0, 6, 2)]
+        linked = selector in [RECORD_CLOSED_SUBPATH_KNOT_LINKED, RECORD_OPEN_SUBPATH_KNOT_LINKED]
+        return PathKnot(*points, linked=linked)
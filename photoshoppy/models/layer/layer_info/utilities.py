@@ -6,24 +6,24 @@ from photoshoppy.utilities.string import unpack_string
 
 
 dispatch_table = {
-    'SoCo': "Solid Color",
-    'GdFl': "Gradient",
-    'PtFl': "Pattern",
-    'brit': "Brightness/Contrast",
-    'levl': "Levels",
-    'curv': "Curves",
+    'SoCo': SolidColor,
+    'GdFl': GradientFill,
+    'PtFl': PatternFill,
+    'brit': BrightnessContrast,
+    'levl': Levels,
+    'curv': Curves,
     'expA': "Exposure",
     'vibA': "Vibrance",
     'hue ': "Old Hue/saturation, Photoshop 4.0",
-    'hue2': "New Hue/saturation, Photoshop 5.0",
+    'hue2': HueSaturation,
     'blnc': "Color Balance",
     'blwh': "Black and White",
     'phfl': "Photo Filter",
     'mixr': "Channel Mixer",
     'clrL': "Color Lookup",
-    'nvrt': "Invert",
-    'post': "Posterize",
-    'thrs': "Threshold",
+    'nvrt': Invert,
+    'post': Posterize,
+    'thrs': Threshold,
     'grdm': "Gradient Map",
     'selc': "Selective color",
     'lrFX': "Effects Layer",
@@ -32,9 +32,9 @@ dispatch_table = {
     'luni': "Type Tool",
     'lyid': "Layer ID",
     'lfx2': "Object-based Effects Layer",
-    'Patt': "Pattern",
-    'Pat2': "Pattern 2",
-    'Pat3': "Pattern 3",
+    'Patt': Patterns,
+    'Pat2': Patterns,
+    'Pat3': Patterns,
     'Anno': "Annotations",
     'clbl': "Blend Clipping Elements",
     'infx': "Blend Interior Elements",
@@ -44,8 +44,8 @@ dispatch_table = {
     'fxrp': "Reference Point",
     'lsct': SectionDivider,
     'brst': "Channel Blending Restrictions",
-    'vmsk': "Vector Mask",
-    'vsms': "Vector Mask, Photoshop CS6",
+    'vmsk': VectorMask,
+    'vsms': VectorMask,
     'ffxi': "Foreign Effect ID",
     'lnsr': "Layer Name Source",
     'shpa': "Pattern Data",
@@ -81,13 +81,14 @@ dispatch_table = {
     'LMsk': "User Mask",
     'FXid': "Filter Effects",
     'FEid': "Filter Effects",
+    'iOpa': FillOpacity,
 }
 
 
 def read_layer_info(file: BinaryIO) -> LayerInfo:
     unpack_string(file.read(4), length=4)  # Signature: 8BIM or 8B64
     key = unpack_string(file.read(4), length=4)
-    layer_info_class = dispatch_table.get(key)  # type: LayerInfo
+    layer_info_class = dispatch_table.get(key, key)  # type: LayerInfo
     if type(layer_info_class) == str:
         layer_info = TempLayerInfo(key, layer_info_class, file)
     else:
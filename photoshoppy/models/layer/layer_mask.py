@@ -6,6 +6,7 @@ from typing import BinaryIO, List
 import numpy as np
 
 import photoshoppy
+from photoshoppy.psd_render.compositing import to_working_depth
 from photoshoppy.utilities.array import crop_array, pad_array
 from photoshoppy.utilities.rect import Rect
 from .layer_channel import LayerChannel, CHANNEL_USER_LAYER_MASK
@@ -36,6 +37,15 @@ class LayerMask:
     def flags(self) -> int:
         return self._flags
 
+    @property
+    def is_disabled(self) -> bool:
+        return self.flag_set(FLAG_MASK_DISABLED)
+
+    @property
+    def is_inverted(self) -> bool:
+        """ Whether the mask is inverted when blending. """
+        return self.flag_set(FLAG_INVERT_WHEN_BLENDING)
+
     @property
     def width(self) -> int:
         return self.rect.right - self.rect.left
@@ -52,10 +62,26 @@ class LayerMask:
     def layer(self, layer: photoshoppy.models.layer.model.Layer):
         self._layer = layer
 
+    @property
+    def default_value(self) -> int or float:
+        """ The default color in the mask's working type; 16-bit and 32-bit masks are float32, from 0 to 1. """
+        if self.layer is not None and self.layer.depth != 8:
+            return self.default_color / 255
+        return self.default_color
+
     @property
     def image_data(self) -> np.array:
+        """ The mask's pixels. 8-bit masks are uint8; 16-bit and 32-bit masks are float32, from 0 to 1. """
+        m = self.layer.get_channel(CHANNEL_USER_LAYER_MASK)  # type: LayerChannel
+        return to_working_depth(m.channel_data)
+
+    def read_image_data(self, rect: Rect) -> np.array:
+        """ Return the mask's pixels inside a screen-space rect, which must lie inside the mask's rect. If the mask
+        channel hasn't been decoded yet, only the rows inside the rect are decoded.
+        """
         m = self.layer.get_channel(CHANNEL_USER_LAYER_MASK)  # type: LayerChannel
-        return m.channel_data
+        rows = m.read_rows(rect.top - self.rect.top, rect.bottom - self.rect.top)
+        return to_working_depth(rows[:, rect.left - self.rect.left:rect.right - self.rect.left])
 
     def flag_set(self, flag):
         """ Check if a particular flag is set. """
@@ -2,20 +2,24 @@ from __future__ import annotations
 
 import os
 import struct
-from typing import BinaryIO, Generator, List
+from typing import BinaryIO, Generator, List, Tuple
 
 import numpy as np
 
 from .layer_channel import LayerChannel
-from .layer_channel import CHANNEL_RED, CHANNEL_GREEN, CHANNEL_BLUE
 from .layer_channel import CHANNEL_TRANSPARENCY_MASK
 from .layer_info.model import LayerInfo
 from .layer_info.layer_info_blocks.section_divider import SectionDivider, DividerType
+from .layer_info.layer_info_blocks.fill_opacity import FillOpacity
+from .layer_info.layer_info_blocks.adjustments import Adjustment
+from .layer_info.layer_info_blocks.fill_layers import FillContent
+from .layer_info.layer_info_blocks.vector_mask import VectorMask
 from .layer_info.utilities import read_layer_info
 from .layer_mask import LayerMask
 from .blending_ranges import BlendingRanges
 from photoshoppy.models.blend_mode.model import BlendMode
-from photoshoppy.psd_render.compositing import scale_channel
+from photoshoppy.psd_render.color_conversion import color_channel_count, to_rgb
+from photoshoppy.psd_render.compositing import channel_max, scale_channel, to_working_depth, working_dtype
 from photoshoppy.utilities.read_section import ReadSection
 from photoshoppy.utilities.rect import Rect
 from photoshoppy.utilities.string import unpack_string, read_pascal_string
@@ -36,13 +40,19 @@ class Layer:
         self._channels = []
         self._blend_mode = BlendMode.from_name("normal")
         self._opacity = 255
+        self._fill = 255
         self._clipping_base = True
         self._flags = FLAG_HAS_USEFUL_INFORMATION
-        self._image_data = np.empty(0)
+        self._image_data = None
+        self._color_mode = "RGB"
+        self._depth = 8
 
         self._blending_ranges = None
         self._layer_mask = None
         self._layer_info = []
+        self._adjustment = None
+        self._fill_content = None
+        self._vector_mask = None
 
         self._is_group = False
         self._is_bounding_section_divider = False
@@ -64,6 +74,7 @@ class Layer:
     @rect.setter
     def rect(self, rect: Rect):
         self._rect = rect
+        self.invalidate_image_data()
 
     @property
     def width(self) -> int:
@@ -73,12 +84,28 @@ class Layer:
     def height(self) -> int:
         return self.rect.bottom - self.rect.top
 
+    @property
+    def content_rect(self) -> Rect:
+        """ The part of the layer's rect that holds visible pixels, read from its transparency channel.
+        The rect is empty (but still positioned at the layer's top left) if every pixel is transparent.
+        """
+        a = self.get_channel(CHANNEL_TRANSPARENCY_MASK)
+        if a is None:
+            return self.rect
+
+        bounds = a.content_bounds
+        if bounds is None:
+            return Rect(self.rect.top, self.rect.left, self.rect.top, self.rect.left)
+        return Rect(self.rect.top + bounds.top, self.rect.left + bounds.left,
+                    self.rect.top + bounds.bottom, self.rect.left + bounds.right)
+
     @property
     def channels(self) -> List[LayerChannel]:
         return self._channels
 
-    def add_channel(self, channel_id: int):
-        self._channels.append(LayerChannel(channel_id=channel_id, layer=self))
+    def add_channel(self, channel_id: int, data_length: int = 0):
+        self._channels.append(LayerChannel(channel_id=channel_id, layer=self, data_length=data_length))
+        self.invalidate_image_data()
 
     def get_channel(self, name: str) -> LayerChannel or None:
         for channel in self.channels:
@@ -108,6 +135,21 @@ class Layer:
         else:
             raise TypeError("opacity must be int or float")
 
+    @property
+    def fill(self) -> int:
+        # Fill opacity scales the layer's pixels, but not its effects. 0 = Transparent; 255 = Opaque
+        return self._fill
+
+    @fill.setter
+    def fill(self, fill: int or float):
+        if type(fill) == int:
+            self._fill = fill
+        elif type(fill) == float:
+            self._fill = int(fill * 255)
+        else:
+            raise TypeError("fill must be int or float")
+        self.invalidate_image_data()
+
     @property
     def clipping_base(self) -> bool:
         return self._clipping_base
@@ -160,28 +202,103 @@ class Layer:
             return False
 
     @property
-    def image_data(self):
-        """ Returns the Layer's image data as a composited RGBA image. """
-        r = self.get_channel(CHANNEL_RED)
-        g = self.get_channel(CHANNEL_GREEN)
-        b = self.get_channel(CHANNEL_BLUE)
+    def image_data(self) -> np.array:
+        """ Returns the Layer's image data as a composited RGBA image.
+        The image is built once and cached until the layer's channels change. It's shared, so it's read-only.
+        """
+        if self._image_data is None:
+            image_data = np.dstack(self.image_planes)
+            image_data.flags.writeable = False
+            self._image_data = image_data
+        return self._image_data
+
+    @property
+    def color_mode(self) -> str:
+        """ Color mode of the document the layer belongs to. Other modes are converted to RGB as channels are read. """
+        return self._color_mode
+
+    @color_mode.setter
+    def color_mode(self, color_mode: str):
+        self._color_mode = color_mode
+        self.invalidate_image_data()
+
+    @property
+    def depth(self) -> int:
+        """ Bits per channel of the document the layer belongs to: 8, 16 or 32. """
+        return self._depth
+
+    @depth.setter
+    def depth(self, depth: int):
+        self._depth = depth
+        self.invalidate_image_data()
+
+    @property
+    def color_channels(self) -> List[LayerChannel]:
+        """ The Layer's color channels, in order; for an RGB layer, these are red, green and blue. """
+        channels = {channel.id: channel for channel in self.channels}
+        return [channels[i] for i in range(color_channel_count(self.color_mode))]
+
+    @property
+    def image_planes(self) -> Tuple[np.array, np.array, np.array, np.array]:
+        """ Returns the Layer's red, green, blue and alpha channels as separate arrays, without interleaving them.
+        8-bit layers are uint8; 16-bit and 32-bit layers are float32, from 0 to 1.
+        For 8-bit and 32-bit RGB layers, the arrays are the channel data itself, so they must not be modified.
+        """
+        r, g, b = to_rgb(self.color_mode, [to_working_depth(channel.channel_data) for channel in self.color_channels])
         a = self.get_channel(CHANNEL_TRANSPARENCY_MASK)
 
         # Get alpha channel.
         if a is None:
-            # If no alpha channel is present, generate one with the layer's opacity value
-            alpha = np.full((self.height, self.width), 255, dtype=np.uint8)
+            # If no alpha channel is present, the layer is opaque
+            alpha = self._opaque_alpha((self.height, self.width))
         else:
             # Return the alpha channel
-            alpha = a.channel_data
+            alpha = to_working_depth(a.channel_data)
 
         # Layer fill scales the overall opacity
-        # ToDo: Get layer fill value
-        fill = 1.0
-        alpha = scale_channel(alpha, fill)
+        if self.fill != 255:
+            alpha = scale_channel(alpha, self.fill / 255)
 
-        image_data = np.dstack([r.channel_data, g.channel_data, b.channel_data, alpha])
-        return image_data
+        return r, g, b, alpha
+
+    def read_image_planes(self, rect: Rect, decode_rows: bool = True) -> Tuple[np.array, np.array, np.array, np.array]:
+        """ Like image_planes, but only for a screen-space rect inside the Layer's rect. Only the pixels inside the rect
+        are converted to RGB. If decode_rows is True, channels that haven't been decoded yet only have the rows inside
+        the rect decoded; otherwise they're decoded in full and kept.
+        """
+        top, bottom = rect.top - self.rect.top, rect.bottom - self.rect.top
+        left, right = rect.left - self.rect.left, rect.right - self.rect.left
+
+        def read(channel: LayerChannel) -> np.array:
+            rows = channel.read_rows(top, bottom) if decode_rows else channel.channel_data[top:bottom]
+            return to_working_depth(rows[:, left:right])
+
+        r, g, b = to_rgb(self.color_mode, [read(channel) for channel in self.color_channels])
+        a = self.get_channel(CHANNEL_TRANSPARENCY_MASK)
+        if a is None:
+            alpha = self._opaque_alpha(r.shape)
+        else:
+            alpha = read(a)
+
+        if self.fill != 255:
+            alpha = scale_channel(alpha, self.fill / 255)
+
+        return r, g, b, alpha
+
+    def _opaque_alpha(self, shape: tuple) -> np.array:
+        dtype = working_dtype(self.depth)
+        return np.broadcast_to(dtype.type(channel_max(dtype)), shape)
+
+    def invalidate_image_data(self):
+        """ Drop the cached image data; it's rebuilt the next time it's needed. """
+        self._image_data = None
+
+    @property
+    def content_image_data(self) -> np.array:
+        """ Returns the Layer's image data, cropped to its content rect. """
+        rect = self.content_rect
+        return self.image_data[rect.top - self.rect.top:rect.bottom - self.rect.top,
+                               rect.left - self.rect.left:rect.right - self.rect.left]
 
     @property
     def blending_ranges(self) -> BlendingRanges:
@@ -214,6 +331,29 @@ class Layer:
                 self._blend_mode = layer_info.blend_mode
             elif layer_info.divider_type == DividerType.BoundingSectionDivider:
                 self._is_bounding_section_divider = True
+        elif isinstance(layer_info, FillOpacity):
+            self.fill = layer_info.fill
+        elif isinstance(layer_info, Adjustment):
+            self._adjustment = layer_info
+        elif isinstance(layer_info, FillContent):
+            self._fill_content = layer_info
+        elif isinstance(layer_info, VectorMask):
+            self._vector_mask = layer_info
+
+    @property
+    def adjustment(self) -> Adjustment or None:
+        """ The adjustment an adjustment layer applies to the layers underneath it; None for other layers. """
+        return self._adjustment
+
+    @property
+    def fill_content(self) -> FillContent or None:
+        """ The solid color, gradient or pattern a fill layer generates its pixels from; None for other layers. """
+        return self._fill_content
+
+    @property
+    def vector_mask(self) -> VectorMask or None:
+        """ The path that masks a shape layer or a vector-masked layer, along with its layer mask. """
+        return self._vector_mask
 
     @property
     def is_group(self) -> bool:
@@ -246,12 +386,12 @@ class Layer:
         rect = struct.unpack('>4i', file.read(16))  # (Top, Left, Bottom, Right)
         rect = Rect(*rect)
 
-        channel_ids = []
+        channel_info = []
         num_channels = struct.unpack('>H', file.read(2))[0]
         for channel in range(num_channels):
             channel_id = struct.unpack('>h', file.read(2))[0]
             channel_data_length = struct.unpack('>L', file.read(4))[0]
-            channel_ids.append(channel_id)
+            channel_info.append((channel_id, channel_data_length))
 
         unpack_string(file.read(4), length=4)  # Blend mode signature = 8BIM
         blend_mode_key = unpack_string(file.read(4), length=4)
@@ -296,8 +436,8 @@ class Layer:
         layer.clipping_base = clipping_base
         layer.flags = flags
 
-        for channel_id in channel_ids:
-            layer.add_channel(channel_id)
+        for channel_id, channel_data_length in channel_info:
+            layer.add_channel(channel_id, data_length=channel_data_length)
         layer.blending_ranges = blending_ranges
 
         if layer_mask is not None:
@@ -1,28 +1,38 @@
 import os
 import struct
 import sys
-from typing import List, Generator
+from typing import Dict, List, Generator
 
 import numpy as np
 
+from .psd_render.color_conversion import COLOR_MODE_IDS, read_palette
 from .utilities.image_data import get_image_data
 from .utilities.read_section import ReadSection
 from .models.image_resource.model import ImageResourceBlock
 from .models.layer.model import Layer
+from .models.layer.layer_info.model import LayerInfo
+from .models.layer.layer_info.layer_info_blocks.patterns import Pattern, Patterns
+from .models.layer.layer_info.utilities import read_layer_info
+from .models.layer.layer_channel import CHANNEL_TRANSPARENCY_MASK
 from .models.errors import PSDReadError
 
 
 class PSDFile:
-    def __init__(self, file_path):
+    def __init__(self, file_path, lazy_decode: bool = False):
+        """ If lazy_decode is True, layer channels are decoded the first time they're needed instead of up front. """
         self._file_path = file_path
+        self._lazy_decode = lazy_decode
         self._channels = None
         self._width = None
         self._height = None
         self._depth = None
         self._color_mode = None
+        self._color_mode_data = b""
 
         self._image_resources = []
         self._layers = []
+        self._layer_info = []
+        self._patterns = {}
 
         self._image_data = np.empty(0)
 
@@ -34,6 +44,10 @@ class PSDFile:
     def file_path(self) -> str:
         return self._file_path
 
+    @property
+    def lazy_decode(self) -> bool:
+        return self._lazy_decode
+
     @property
     def channels(self) -> int:
         return self._channels
@@ -54,6 +68,18 @@ class PSDFile:
     def color_mode(self) -> str:
         return self._color_mode
 
+    @property
+    def color_mode_data(self) -> bytes:
+        """ The palette of an indexed color file, or the ink specification of a duotone file. Empty otherwise. """
+        return self._color_mode_data
+
+    @property
+    def palette(self) -> np.ndarray or None:
+        """ The (256, 3) RGB palette of an indexed color file. """
+        if self.color_mode != "Indexed":
+            return None
+        return read_palette(self._color_mode_data)
+
     @property
     def image_resources(self) -> List[ImageResourceBlock]:
         return self._image_resources
@@ -62,6 +88,16 @@ class PSDFile:
     def layers(self) -> List[Layer]:
         return self._layers
 
+    @property
+    def layer_info(self) -> List[LayerInfo]:
+        """ Additional layer info blocks that belong to the whole document, instead of to a layer. """
+        return self._layer_info
+
+    @property
+    def patterns(self) -> Dict[str, Pattern]:
+        """ The document's patterns, by their unique ID. """
+        return self._patterns
+
     @property
     def image_data(self) -> np.ndarray:
         return self._image_data
@@ -81,6 +117,45 @@ class PSDFile:
                 return layer
         raise RuntimeError(f"Layer '{layer_name}' not found")
 
+    def layers_at(self, x: int, y: int) -> List[Layer]:
+        """ Return the visible layers with a non-transparent pixel at a point, from the top down. Layers inside hidden
+        or fully transparent groups, and pixels hidden by a layer's or group's mask, don't count.
+        """
+        hits = []
+        for layer in reversed(list(self.iter_layers())):
+            if not self._is_visible_at(layer, x, y):
+                continue
+            rect = layer.content_rect
+            if not (rect.top <= y < rect.bottom and rect.left <= x < rect.right):
+                continue
+            a = layer.get_channel(CHANNEL_TRANSPARENCY_MASK)
+            if a is None or a.channel_data[y - layer.rect.top, x - layer.rect.left] > 0:
+                hits.append(layer)
+        return hits
+
+    @staticmethod
+    def _is_visible_at(layer: Layer, x: int, y: int) -> bool:
+        """ Check if a layer and every group it's in are visible, not fully transparent, and unmasked at a point. """
+        # Imported here because render_utils imports this module
+        from .psd_render.compositing import channel_max
+        from .psd_render.render_utils import active_mask, mask_default_color
+
+        while layer is not None:
+            if layer.visible is False or layer.opacity == 0:
+                return False
+            mask = active_mask(layer)
+            if mask is not None:
+                rect = mask.rect
+                if rect.top <= y < rect.bottom and rect.left <= x < rect.right:
+                    value = mask.image_data[y - rect.top, x - rect.left]
+                    hidden = value == channel_max(value.dtype) if mask.is_inverted else value == 0
+                else:
+                    hidden = mask_default_color(mask) == 0
+                if hidden:
+                    return False
+            layer = layer.parent
+        return True
+
     def _offset(self) -> int:
         """ Returns the current offset. """
         if self._file is not None:
@@ -113,24 +188,14 @@ class PSDFile:
         self._depth = struct.unpack('>H', self._file.read(2))[0]
 
         color_mode = struct.unpack('>H', self._file.read(2))[0]
-        color_modes = {
-            0: "Bitmap",
-            1: "Grayscale",
-            2: "Indexed",
-            3: "RGB",
-            4: "CMYK",
-            7: "Multichannel",
-            8: "Duotone",
-            9: "Lab",
-        }
-        self._color_mode = color_modes[color_mode]
+        self._color_mode = COLOR_MODE_IDS[color_mode]
 
     def _read_color_mode_data(self):
         """ Only indexed and duotone color have this data. For all other modes, this is just the 4-byte length field,
         which is set to zero.
         """
-        with ReadSection(self._file):
-            pass
+        with ReadSection(self._file) as section:
+            self._color_mode_data = self._file.read(section.section_length)
 
     def _read_image_resources(self):
         """ Image Resources store non-pixel data associated with images, such as pen tool paths. """
@@ -145,7 +210,7 @@ class PSDFile:
             if section.section_length > 0:  # If no layers are present, section length is zero
                 self._read_layer_info()
                 self._read_global_layer_mask_info()
-                self._read_additional_layer_info()
+                self._read_additional_layer_info(section.section_end)
 
     def _read_layer_info(self):
         with ReadSection(self._file):
@@ -158,19 +223,32 @@ class PSDFile:
             # Create layers from layer records
             for i in range(layer_count):
                 layer = Layer.read_layer_record(self._file)
+                layer.color_mode = self.color_mode
+                layer.depth = self.depth
                 self._layers.append(layer)
 
             # Read layer channel data
             for layer in self.layers:
                 for channel in layer.channels:
-                    channel.read_channel_data(file=self._file)
+                    channel.read_channel_data(file=self._file, lazy=self.lazy_decode)
 
     def _read_global_layer_mask_info(self):
         with ReadSection(self._file):
             pass
 
-    def _read_additional_layer_info(self):
-        pass
+    def _read_additional_layer_info(self, section_end: int):
+        """ The rest of the layer and mask information is a series of additional layer info blocks. """
+        while self._offset() + 12 <= section_end:
+            signature = self._file.read(4)
+            self._file.seek(-4, os.SEEK_CUR)
+            if signature not in [b"8BIM", b"8B64"]:
+                break
+
+            layer_info = read_layer_info(self._file)
+            self._layer_info.append(layer_info)
+            if isinstance(layer_info, Patterns):
+                for pattern in layer_info.patterns:
+                    self._patterns[pattern.pattern_id] = pattern
 
     def _read_image_data(self):
         """ Image pixel data. This is the complete merged/composited image. """
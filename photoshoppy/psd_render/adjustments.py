@@ -0,0 +1,296 @@
+""" Adjustment layers for render plans.
+Levels, curves, invert, posterize, threshold and brightness/contrast map each channel's values through a lookup table:
+256 entries for 8-bit documents, and 65536 for 16-bit and 32-bit documents, whose float pixels are quantized to 16 bits
+to index it. Consecutive lookup tables compose into one. Hue/saturation mixes channels, so it's computed from each
+pixel's HSL values instead.
+Adjustments change the colors of the pixels underneath them, but never their alpha.
+"""
+from __future__ import annotations
+
+import math
+from typing import Callable, List
+
+import numpy as np
+
+from .compositing import IgnoreNumpyErrors, channel_max, clamp, gray_values, to_float
+from photoshoppy.models.blend_mode.model import BlendMode
+from photoshoppy.models.layer.layer_info.layer_info_blocks.adjustments import (
+    Adjustment, BrightnessContrast, Curves, HueSaturation, Invert, Levels, LevelsRecord, Posterize, Threshold,
+    CHANNEL_COMPOSITE)
+
+
+# Entries in the lookup tables of documents deeper than 8 bits
+DEEP_LUT_SIZE = 65536
+
+# Blend modes that composite an adjustment's colors as they are
+NORMAL_BLEND_MODES = ("normal", "pass through", "dissolve")
+
+
+class ChannelLUT:
+    """ A lookup table for each of the red, green and blue channels, as a (3, N) array of the document's working
+    type. If gray is True, every table is indexed by the pixel's gray value instead of by its own channel.
+    """
+    def __init__(self, luts: np.array, gray: bool = False):
+        self._luts = luts
+        self._gray = gray
+
+    @property
+    def luts(self) -> np.array:
+        return self._luts
+
+    @property
+    def gray(self) -> bool:
+        return self._gray
+
+    @classmethod
+    def from_transfer(cls, transfer: Callable[[int, np.array], np.array], dtype: np.dtype,
+                      gray: bool = False) -> ChannelLUT:
+        """ Build the tables from transfer(channel, values), which maps 0-1 floats to 0-1 floats. Channels are 0, 1
+        and 2 for red, green and blue.
+        """
+        size = 256 if dtype == np.uint8 else DEEP_LUT_SIZE
+        values = np.arange(size) / (size - 1)
+        with IgnoreNumpyErrors():
+            luts = np.stack([clamp(np.nan_to_num(transfer(channel, values))) for channel in range(3)])
+        if dtype == np.uint8:
+            luts = np.around(luts * channel_max(np.uint8)).astype(np.uint8)
+        else:
+            luts = luts.astype(dtype)
+        return cls(luts, gray=gray)
+
+    def then(self, other: ChannelLUT or HueSaturationAdjustment) -> ChannelLUT or None:
+        """ Return a single table that applies this one and then another, or None if they can't be composed. Tables
+        indexed by gray values can only come first, since changing channels separately changes their gray values.
+        """
+        if not isinstance(other, ChannelLUT) or other.gray:
+            return None
+        luts = np.stack([other.luts[channel][_lut_index(self._luts[channel])] for channel in range(3)])
+        return ChannelLUT(luts, gray=self._gray)
+
+    def apply(self, rgb: np.array) -> np.array:
+        """ Return the adjusted colors of an RGB or RGBA image, as a new RGB array. """
+        if self._gray:
+            index = _lut_index(gray_values(rgb))
+            return np.dstack([self._luts[channel][index] for channel in range(3)])
+        return np.dstack([self._luts[channel][_lut_index(rgb[:, :, channel])] for channel in range(3)])
+
+
+class HueSaturationAdjustment:
+    """ Hue/saturation, using its master settings. Colors are rotated around the hue wheel and scaled in saturation
+    in HSL space, then lightened towards white or darkened towards black. Colorizing gives every pixel the same hue and
+    saturation, keeping its gray value.
+    """
+    def __init__(self, adjustment: HueSaturation):
+        self._adjustment = adjustment
+
+    def then(self, other: ChannelLUT or HueSaturationAdjustment) -> None:
+        return None
+
+    def apply(self, rgb: np.array) -> np.array:
+        rgb_float = to_float(rgb[:, :, :3])
+        if self._adjustment.colorize:
+            hue, saturation, lightness = self._adjustment.colorization
+            gray = to_float(gray_values(rgb))
+            h = np.full(gray.shape, hue % 360 / 360)
+            s = np.full(gray.shape, saturation / 100)
+            result = _hsl_to_rgb(h, s, gray)
+        else:
+            hue, saturation, lightness = self._adjustment.master
+            h, s, l = _rgb_to_hsl(rgb_float)
+            h += hue / 360
+            h %= 1
+            if saturation < 0:
+                s *= 1 + saturation / 100
+            elif saturation > 0:
+                with IgnoreNumpyErrors():
+                    s /= 1 - saturation / 100
+                s = clamp(np.nan_to_num(s, posinf=1))
+            result = _hsl_to_rgb(h, s, l)
+
+        if lightness > 0:
+            result += (1 - result) * (lightness / 100)
+        elif lightness < 0:
+            result *= 1 + lightness / 100
+        result = clamp(result)
+
+        if rgb.dtype == np.uint8:
+            return np.around(result * channel_max(np.uint8)).astype(np.uint8)
+        return result.astype(rgb.dtype)
+
+
+def build_adjustment(adjustment: Adjustment, dtype: np.dtype) -> ChannelLUT or HueSaturationAdjustment or None:
+    """ Build what's needed to apply an adjustment layer's adjustment to pixels of a working type. Returns None for
+    adjustments that aren't supported.
+    """
+    dtype = np.dtype(dtype)
+    if isinstance(adjustment, Levels):
+        return ChannelLUT.from_transfer(_levels_transfer(adjustment.records), dtype)
+    if isinstance(adjustment, Curves):
+        return ChannelLUT.from_transfer(_curves_transfer(adjustment), dtype)
+    if isinstance(adjustment, Invert):
+        return ChannelLUT.from_transfer(lambda channel, values: 1 - values, dtype)
+    if isinstance(adjustment, Posterize):
+        return ChannelLUT.from_transfer(_posterize_transfer(adjustment.levels), dtype)
+    if isinstance(adjustment, Threshold):
+        return ChannelLUT.from_transfer(
+            lambda channel, values: np.where(np.around(values * 255) >= adjustment.level, 1.0, 0.0), dtype, gray=True)
+    if isinstance(adjustment, BrightnessContrast):
+        return ChannelLUT.from_transfer(_brightness_contrast_transfer(adjustment), dtype)
+    if isinstance(adjustment, HueSaturation):
+        return HueSaturationAdjustment(adjustment)
+    return None
+
+
+def composite_adjustment(adjusted: np.array, bg: np.array, blend_mode: BlendMode, mask: np.array or None,
+                         opacity: int):
+    """ Composite adjusted colors over the RGBA image they were computed from, in place. The adjusted colors are
+    blended with the blend mode, and mixed in by opacity and mask; bg's alpha doesn't change.
+    """
+    bg_rgb = bg[:, :, :3]
+    if blend_mode.name not in NORMAL_BLEND_MODES:
+        with IgnoreNumpyErrors():
+            color = clamp(np.nan_to_num(blend_mode.blend_fn.color_fn(to_float(adjusted), to_float(bg_rgb))))
+        if bg.dtype == np.uint8:
+            adjusted = np.around(color * channel_max(np.uint8)).astype(np.uint8)
+        else:
+            adjusted = color.astype(bg.dtype)
+
+    if mask is None and opacity == 255:
+        bg_rgb[:] = adjusted
+        return
+
+    weight = opacity / 255
+    if mask is not None:
+        weight = to_float(mask) * weight
+    result = to_float(bg_rgb)
+    result += (to_float(adjusted) - result) * np.asarray(weight)[..., None]
+    if bg.dtype == np.uint8:
+        result *= channel_max(np.uint8)
+        np.around(result, out=result)
+    bg_rgb[:] = result
+
+
+def _lut_index(values: np.array) -> np.array:
+    """ Return the lookup table index of values of a working type. """
+    if values.dtype == np.uint8:
+        return values
+    return np.around(clamp(values) * (DEEP_LUT_SIZE - 1)).astype(np.uint16)
+
+
+def _levels_transfer(records: List[LevelsRecord]) -> Callable:
+    def apply_record(record: LevelsRecord, values: np.array) -> np.array:
+        if record.is_default:
+            return values
+        input_range = max(record.input_ceiling - record.input_floor, 1) / 255
+        values = clamp((values - record.input_floor / 255) / input_range) ** (1 / record.gamma)
+        return (record.output_floor + values * (record.output_ceiling - record.output_floor)) / 255
+
+    def transfer(channel: int, values: np.array) -> np.array:
+        if channel + 1 < len(records):
+            values = apply_record(records[channel + 1], values)
+        return apply_record(records[CHANNEL_COMPOSITE], values) if records else values
+
+    return transfer
+
+
+def _curves_transfer(adjustment: Curves) -> Callable:
+    def curve_values(curve: list, values: np.array) -> np.array:
+        if adjustment.is_map:
+            table = np.array(curve, dtype=np.float64) / 255
+            return table[np.around(values * 255).astype(np.intp)]
+        return _spline(curve, values * 255) / 255
+
+    def transfer(channel: int, values: np.array) -> np.array:
+        if channel + 1 in adjustment.curves:
+            values = curve_values(adjustment.curves[channel + 1], values)
+        if CHANNEL_COMPOSITE in adjustment.curves:
+            values = curve_values(adjustment.curves[CHANNEL_COMPOSITE], values)
+        return values
+
+    return transfer
+
+
+def _spline(points: list, values: np.array) -> np.array:
+    """ Evaluate the natural cubic spline through a curve's (input, output) points. Values outside the first and last
+    points keep the first and last outputs.
+    """
+    points = sorted(dict(points).items())
+    x = np.array([p[0] for p in points], dtype=np.float64)
+    y = np.array([p[1] for p in points], dtype=np.float64)
+    if len(points) == 1:
+        return np.full(values.shape, y[0])
+
+    # Second derivatives at each point; they're 0 at both ends
+    n = len(points)
+    h = np.diff(x)
+    second = np.zeros(n)
+    if n > 2:
+        a = np.zeros((n - 2, n - 2))
+        i = np.arange(n - 2)
+        a[i, i] = 2 * (h[:-1] + h[1:])
+        a[i[1:], i[1:] - 1] = h[1:-1]
+        a[i[:-1], i[:-1] + 1] = h[1:-1]
+        b = 6 * (np.diff(y[1:]) / h[1:] - np.diff(y[:-1]) / h[:-1])
+        second[1:-1] = np.linalg.solve(a, b)
+
+    clipped = np.clip(values, x[0], x[-1])
+    k = np.clip(np.searchsorted(x, clipped, side="right") - 1, 0, n - 2)
+    t0 = x[k + 1] - clipped
+    t1 = clipped - x[k]
+    result = (second[k] * t0 ** 3 + second[k + 1] * t1 ** 3) / (6 * h[k])
+    result += (y[k] / h[k] - second[k] * h[k] / 6) * t0
+    result += (y[k + 1] / h[k] - second[k + 1] * h[k] / 6) * t1
+    return np.clip(result, 0, 255)
+
+
+def _posterize_transfer(levels: int) -> Callable:
+    levels = max(levels, 2)
+
+    def transfer(channel: int, values: np.array) -> np.array:
+        steps = np.minimum(np.floor(np.around(values * 255) * levels / 256), levels - 1)
+        return steps / (levels - 1)
+
+    return transfer
+
+
+def _brightness_contrast_transfer(adjustment: BrightnessContrast) -> Callable:
+    """ Legacy brightness/contrast: brightness scales values towards white or black, and contrast steepens or flattens
+    them around the middle.
+    """
+    brightness = adjustment.brightness / 100
+    slope = math.tan((min(adjustment.contrast / 100, 0.99) + 1) * math.pi / 4)
+
+    def transfer(channel: int, values: np.array) -> np.array:
+        if brightness < 0:
+            values = values * (1 + brightness)
+        else:
+            values = values + (1 - values) * brightness
+        return (values - 0.5) * slope + 0.5
+
+    return transfer
+
+
+def _rgb_to_hsl(rgb: np.array) -> tuple:
+    r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+    rgb_max = np.maximum(np.maximum(r, g), b)
+    rgb_min = np.minimum(np.minimum(r, g), b)
+    delta = rgb_max - rgb_min
+    l = (rgb_max + rgb_min) / 2
+
+    with IgnoreNumpyErrors():
+        s = np.where(delta > 0, delta / (1 - np.abs(2 * l - 1)), 0)
+        h = np.where(rgb_max == r, ((g - b) / delta) % 6,
+                     np.where(rgb_max == g, (b - r) / delta + 2, (r - g) / delta + 4))
+    h = np.where(delta > 0, h / 6, 0)
+    return h, clamp(np.nan_to_num(s)), l
+
+
+def _hsl_to_rgb(h: np.array, s: np.array, l: np.array) -> np.array:
+    chroma = (1 - np.abs(2 * l - 1)) * s
+
+    # Offset of each channel around the hue wheel
+    rgb = np.empty(h.shape + (3,))
+    for channel, n in enumerate([0, 8, 4]):
+        k = (n + h * 12) % 12
+        rgb[:, :, channel] = l - chroma / 2 * np.maximum(-1, np.minimum(np.minimum(k - 3, 9 - k), 1))
+    return rgb
@@ -0,0 +1,213 @@
+""" Incremental image encoders.
+Band writers take an RGBA image one horizontal band at a time, top to bottom, and encode each band as it arrives, so
+the whole image never has to be held in memory. Images are 8 or 16 bits per channel.
+"""
+import os
+import struct
+import zlib
+from typing import BinaryIO
+
+import numpy as np
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPE_RGBA = 6
+PNG_FILTER_UP = 2
+
+TIFF_COMPRESSION_DEFLATE = 8
+TIFF_PHOTOMETRIC_RGB = 2
+TIFF_EXTRA_SAMPLES_UNASSOCIATED_ALPHA = 2
+TIFF_TYPE_SHORT = 3
+TIFF_TYPE_LONG = 4
+
+BIT_DEPTH_DTYPES = {8: np.dtype(np.uint8), 16: np.dtype(np.uint16)}
+
+
+class BandWriter:
+    """ Base class for band writers. Bands must be written in order and cover the whole image. """
+    def __init__(self, file_path: str, width: int, height: int, compression_level: int = 6, bit_depth: int = 8):
+        if bit_depth not in BIT_DEPTH_DTYPES:
+            raise ValueError(f"Bit depth must be 8 or 16; got {bit_depth}")
+        self._file_path = file_path
+        self._width = width
+        self._height = height
+        self._compression_level = compression_level
+        self._bit_depth = bit_depth
+        self._rows_written = 0
+        self._file = None
+
+    @property
+    def file_path(self) -> str:
+        return self._file_path
+
+    @property
+    def rows_written(self) -> int:
+        return self._rows_written
+
+    def __enter__(self):
+        self._file = open(self._file_path, "wb")
+        self._write_header(self._file)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                if self._rows_written != self._height:
+                    raise RuntimeError(f"Only {self._rows_written} of {self._height} rows were written")
+                self._write_footer(self._file)
+        finally:
+            self._file.close()
+
+    def write_band(self, band: np.array):
+        """ Encode the next rows of the image. The band is an RGBA uint8 or uint16 array, matching the bit depth, and
+        as wide as the image.
+        """
+        dtype = BIT_DEPTH_DTYPES[self._bit_depth]
+        if band.shape[1:] != (self._width, 4) or band.dtype != dtype:
+            raise ValueError(f"Expected a {dtype} band of shape (rows, {self._width}, 4); "
+                             f"got {band.dtype} {band.shape}")
+        if self._rows_written + band.shape[0] > self._height:
+            raise ValueError("Band runs past the bottom of the image")
+        self._write_band(self._file, band)
+        self._rows_written += band.shape[0]
+
+    def _write_header(self, f: BinaryIO):
+        raise NotImplementedError
+
+    def _write_band(self, f: BinaryIO, band: np.array):
+        raise NotImplementedError
+
+    def _write_footer(self, f: BinaryIO):
+        raise NotImplementedError
+
+
+class PNGBandWriter(BandWriter):
+    """ Writes an RGBA PNG. Every row uses the "up" filter, and the zlib stream is flushed into IDAT chunks as bands
+    are compressed.
+    """
+    def __init__(self, file_path: str, width: int, height: int, compression_level: int = 6, bit_depth: int = 8):
+        super().__init__(file_path, width, height, compression_level, bit_depth)
+        self._compressor = zlib.compressobj(compression_level)
+        self._row_length = width * 4 * bit_depth // 8
+        self._previous_row = np.zeros((1, self._row_length), dtype=np.uint8)
+
+    def _write_header(self, f: BinaryIO):
+        f.write(PNG_SIGNATURE)
+        self._write_chunk(f, b"IHDR", struct.pack(">2L5B", self._width, self._height, self._bit_depth,
+                                                  PNG_COLOR_TYPE_RGBA, 0, 0, 0))
+
+    def _write_band(self, f: BinaryIO, band: np.array):
+        # 16-bit samples are big endian. The filter works on bytes, whatever the bit depth.
+        band = band.astype(band.dtype.newbyteorder(">"), copy=False)
+        band = np.ascontiguousarray(band).view(np.uint8).reshape(band.shape[0], self._row_length)
+
+        # Each row is stored as its difference from the row above, with a leading filter type byte
+        filtered = np.empty((band.shape[0], self._row_length + 1), dtype=np.uint8)
+        filtered[:, 0] = PNG_FILTER_UP
+        rows = filtered[:, 1:]
+        np.subtract(band[:1], self._previous_row, out=rows[:1])
+        np.subtract(band[1:], band[:-1], out=rows[1:])
+        self._previous_row = band[-1:].copy()
+
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._write_chunk(f, b"IDAT", data)
+
+    def _write_footer(self, f: BinaryIO):
+        self._write_chunk(f, b"IDAT", self._compressor.flush())
+        self._write_chunk(f, b"IEND", b"")
+
+    @staticmethod
+    def _write_chunk(f: BinaryIO, chunk_type: bytes, data: bytes):
+        f.write(struct.pack(">L", len(data)))
+        f.write(chunk_type)
+        f.write(data)
+        f.write(struct.pack(">L", zlib.crc32(chunk_type + data)))
+
+
+class TIFFBandWriter(BandWriter):
+    """ Writes an RGBA TIFF, with one deflate-compressed strip per band. Every band but the last must have the same
+    height. The strip tables are written at the end of the file.
+    """
+    def __init__(self, file_path: str, width: int, height: int, compression_level: int = 6, bit_depth: int = 8):
+        super().__init__(file_path, width, height, compression_level, bit_depth)
+        self._strip_offsets = []
+        self._strip_byte_counts = []
+        self._rows_per_strip = None
+
+    def _write_header(self, f: BinaryIO):
+        # Little endian; the IFD offset is filled in by the footer
+        f.write(b"II*\x00")
+        f.write(struct.pack("<L", 0))
+
+    def _write_band(self, f: BinaryIO, band: np.array):
+        if self._rows_per_strip is None:
+            self._rows_per_strip = band.shape[0]
+        is_last = self.rows_written + band.shape[0] == self._height
+        if band.shape[0] != self._rows_per_strip and not is_last:
+            raise ValueError(f"Every band but the last must be {self._rows_per_strip} rows high")
+
+        data = zlib.compress(np.ascontiguousarray(band, dtype=band.dtype.newbyteorder("<")).tobytes(),
+                             self._compression_level)
+        self._strip_offsets.append(f.tell())
+        self._strip_byte_counts.append(len(data))
+        f.write(data)
+        if f.tell() % 2:
+            f.write(b"\x00")
+
+    def _write_footer(self, f: BinaryIO):
+        # Arrays that don't fit in a tag entry are written before the IFD
+        bits_per_sample_offset = f.tell()
+        f.write(struct.pack("<4H", *[self._bit_depth] * 4))
+        strip_offsets_offset = f.tell()
+        f.write(struct.pack(f"<{len(self._strip_offsets)}L", *self._strip_offsets))
+        strip_byte_counts_offset = f.tell()
+        f.write(struct.pack(f"<{len(self._strip_byte_counts)}L", *self._strip_byte_counts))
+
+        strip_count = len(self._strip_offsets)
+        entries = [
+            (256, TIFF_TYPE_LONG, 1, self._width),  # ImageWidth
+            (257, TIFF_TYPE_LONG, 1, self._height),  # ImageLength
+            (258, TIFF_TYPE_SHORT, 4, bits_per_sample_offset),  # BitsPerSample
+            (259, TIFF_TYPE_SHORT, 1, TIFF_COMPRESSION_DEFLATE),  # Compression
+            (262, TIFF_TYPE_SHORT, 1, TIFF_PHOTOMETRIC_RGB),  # PhotometricInterpretation
+            (273, TIFF_TYPE_LONG, strip_count, self._strip_offsets[0] if strip_count == 1 else strip_offsets_offset),
+            (277, TIFF_TYPE_SHORT, 1, 4),  # SamplesPerPixel
+            (278, TIFF_TYPE_LONG, 1, self._rows_per_strip),  # RowsPerStrip
+            (279, TIFF_TYPE_LONG, strip_count,
+             self._strip_byte_counts[0] if strip_count == 1 else strip_byte_counts_offset),
+            (284, TIFF_TYPE_SHORT, 1, 1),  # PlanarConfiguration: chunky
+            (338, TIFF_TYPE_SHORT, 1, TIFF_EXTRA_SAMPLES_UNASSOCIATED_ALPHA),  # ExtraSamples
+        ]
+
+        ifd_offset = f.tell()
+        f.write(struct.pack("<H", len(entries)))
+        for tag, field_type, count, value in entries:
+            if field_type == TIFF_TYPE_SHORT and count == 1:
+                f.write(struct.pack("<HHLHH", tag, field_type, count, value, 0))
+            else:
+                f.write(struct.pack("<HHLL", tag, field_type, count, value))
+        f.write(struct.pack("<L", 0))  # No more IFDs
+
+        f.seek(4)
+        f.write(struct.pack("<L", ifd_offset))
+
+
+BAND_WRITERS = {
+    ".png": PNGBandWriter,
+    ".tif": TIFFBandWriter,
+    ".tiff": TIFFBandWriter,
+}
+
+
+def supports_bands(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in BAND_WRITERS
+
+
+def open_band_writer(file_path: str, width: int, height: int, compression_level: int = 6,
+                     bit_depth: int = 8) -> BandWriter:
+    """ Return a band writer for a file, based on its extension. """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in BAND_WRITERS:
+        raise ValueError(f"Can't write {ext} files in bands; supported extensions are {', '.join(BAND_WRITERS)}")
+    return BAND_WRITERS[ext](file_path, width, height, compression_level, bit_depth)
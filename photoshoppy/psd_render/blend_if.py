@@ -0,0 +1,113 @@
+""" Blending ranges ("Blend If") for render plans.
+A layer's blending ranges hide its pixels by their own values, or by the values of the pixels underneath them. Each
+range is turned into a table of 256 8-bit weights the first time it's needed, and a layer's mask is scaled by the
+weights of all of its ranges, one gather per range over the window being composited.
+"""
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+from .compositing import channel_max, gray_values
+from photoshoppy.models.layer.blending_ranges import BlendRange
+from photoshoppy.models.layer.model import Layer
+
+
+_weight_luts = {}
+
+
+def weight_lut(blend_range: BlendRange) -> np.array:
+    """ Return the weight of every 8-bit value in a range, as a uint8 array.
+    Values between the black and white sliders get 255, and values outside of them get 0. Split sliders ramp the
+    weights between their two halves.
+    """
+    key = (blend_range.black_low, blend_range.black_high, blend_range.white_low, blend_range.white_high)
+    lut = _weight_luts.get(key)
+    if lut is None:
+        lut = build_weight_lut(*key)
+        _weight_luts[key] = lut
+    return lut
+
+
+def build_weight_lut(black_low: int, black_high: int, white_low: int, white_high: int) -> np.array:
+    values = np.arange(256, dtype=np.float64)
+    if black_high > black_low:
+        black = np.clip((values - black_low) / (black_high - black_low), 0, 1)
+    else:
+        black = values >= black_low
+    if white_high > white_low:
+        white = np.clip((white_high - values) / (white_high - white_low), 0, 1)
+    else:
+        white = values <= white_high
+    lut = np.around(np.minimum(black, white) * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def weight_luts(layer: Layer) -> List[Tuple[bool, int or None, np.array]]:
+    """ Return (is_destination, channel, lut) for every range of a layer that hides something. The channel is None
+    for the gray range. Per-channel ranges are only used for RGB documents, since other color modes are converted to
+    RGB before they're blended.
+    """
+    ranges = layer.blending_ranges
+    if ranges is None or ranges.is_default:
+        return []
+
+    channel_ranges = [(None, ranges.gray_range)]
+    if layer.color_mode == "RGB":
+        channel_ranges.extend(enumerate(ranges.channel_ranges[:3]))
+
+    luts = []
+    for channel, csdr in channel_ranges:
+        for is_destination, blend_range in [(False, csdr.source), (True, csdr.destination)]:
+            if not blend_range.is_default:
+                luts.append((is_destination, channel, weight_lut(blend_range)))
+    return luts
+
+
+def uses_blend_if(layer: Layer) -> bool:
+    """ True if a layer's blending ranges hide any of its pixels. """
+    return len(weight_luts(layer)) > 0
+
+
+def apply_blend_if(layer: Layer, fg: np.array, bg: np.array, mask: np.array or None) -> np.array or None:
+    """ Scale the mask of a window being composited by the weights of a layer's blending ranges.
+    fg and bg are the window's layer and underlying pixels, and mask is a window mask as given by
+    render_utils.mask_to_windows. Layers with default ranges get their mask back untouched.
+    """
+    luts = weight_luts(layer)
+    if not luts:
+        return mask
+
+    weights = None
+    for is_destination, channel, lut in luts:
+        values = _channel_values(bg if is_destination else fg, channel)
+        if weights is None:
+            weights = lut[values].astype(np.uint16)
+        else:
+            weights *= lut[values]
+            weights += 127
+            weights //= 255
+
+    if fg.dtype != np.uint8:
+        weights = weights.astype(fg.dtype)
+        weights /= 255
+        if mask is not None:
+            weights *= mask
+        return weights
+
+    if mask is not None:
+        weights *= mask
+        weights += 127
+        weights //= 255
+    return weights.astype(np.uint8)
+
+
+def _channel_values(image_data: np.array, channel: int or None) -> np.array:
+    """ Return the 8-bit values of one channel of an RGBA window, or its gray values if channel is None. """
+    if image_data.dtype != np.uint8:
+        image_data = np.around(np.clip(image_data[:, :, :3], 0, 1) * channel_max(np.uint8)).astype(np.uint8)
+    if channel is not None:
+        return image_data[:, :, channel]
+    return gray_values(image_data)
@@ -0,0 +1,117 @@
+""" Lookup-table blending for 8-bit images.
+Separable blend modes compute each output channel from nothing but the (fg, bg) values of that channel, so every
+possible result fits in a 256x256 table. The tables are built from the float blend functions the first time they are
+needed; blending is then a single gather, and the Porter/Duff alpha math is done with integers in scratch buffers.
+"""
+import numpy as np
+
+from .compositing import IgnoreNumpyErrors, uint8_to_float, float_to_uint8, clamp
+from .scratch import get_scratch_pool
+from photoshoppy.models.blend_mode.model import BlendMode
+
+
+SEPARABLE_BLEND_MODES = (
+    "normal",
+    "darken", "multiply", "color burn", "linear burn",
+    "lighten", "screen", "color dodge", "linear dodge",
+    "overlay", "soft light", "hard light", "vivid light", "linear light", "pin light", "hard mix",
+    "difference", "exclusion", "subtract", "divide",
+)
+
+# Alpha values are kept in steps of 1/65025 (255 * 255) so that opacity and masks don't lose precision.
+ALPHA_ONE = 255 * 255
+
+_luts = {}
+
+
+def get_lut(blend_mode: BlendMode) -> np.array or None:
+    """ Return the lookup table for a blend mode, or None if the blend mode isn't separable. """
+    if blend_mode.name not in SEPARABLE_BLEND_MODES:
+        return None
+
+    lut = _luts.get(blend_mode.name)
+    if lut is None:
+        lut = build_lut(blend_mode)
+        _luts[blend_mode.name] = lut
+    return lut
+
+
+def build_lut(blend_mode: BlendMode) -> np.array:
+    """ Evaluate a blend mode's color function for every pair of 8-bit values. Indexed as lut[fg, bg]. """
+    values = uint8_to_float(np.arange(256, dtype=np.uint8))
+    fg, bg = np.meshgrid(values, values, indexing='ij')
+    with IgnoreNumpyErrors():
+        color = blend_mode.blend_fn.color_fn(fg, bg)
+        color = clamp(np.nan_to_num(color))
+    return float_to_uint8(color)
+
+
+def blend_lut(fg: np.array, bg: np.array, mask: np.array or None, fg_opacity: float, lut: np.array,
+              out: np.array or None = None) -> np.array:
+    """ Blend two uint8 RGBA images with a lookup table. Takes the same arguments as the float blend functions. """
+    fg_rgb = fg[:, :, :3]
+    bg_rgb = bg[:, :, :3]
+    shape = fg.shape[:2]
+
+    pool = get_scratch_pool()
+    with pool.frame():
+        # Blended colors, gathered from the flattened table at fg * 256 + bg
+        index = pool.array(fg_rgb.shape, np.intp)
+        index[...] = fg_rgb
+        index <<= 8
+        index |= bg_rgb
+        blended = np.take(lut.ravel(), index, out=pool.array(fg_rgb.shape, np.uint8), mode="clip")
+
+        # Source alpha, scaled by opacity and mask
+        opacity = int(round(fg_opacity * 255))
+        src_alpha = pool.array(shape, np.uint32)
+        src_alpha[...] = fg[:, :, 3]
+        if mask is not None:
+            src_alpha *= mask
+            src_alpha *= opacity
+            src_alpha += 127
+            src_alpha //= 255
+        else:
+            src_alpha *= opacity
+
+        result = np.empty_like(fg) if out is None else out
+        result_rgb = pool.array(fg_rgb.shape, np.uint32)
+        product = pool.array(fg_rgb.shape, np.uint32)
+        if bg.size and bg[:, :, 3].min() == 255:
+            # Over an opaque backdrop the result is opaque, and the colors are mixed by the source alpha alone, so
+            # there's no per pixel division
+            weight = np.subtract(ALPHA_ONE, src_alpha, out=pool.array(shape, np.uint32))
+            np.multiply(weight[:, :, None], bg_rgb, out=result_rgb)
+            result_rgb += np.multiply(src_alpha[:, :, None], blended, out=product)
+            result_rgb += ALPHA_ONE // 2
+            result_rgb //= ALPHA_ONE
+            result[:, :, :3] = result_rgb
+            result[:, :, 3] = 255
+            return result
+
+        dst_alpha = pool.array(shape, np.uint32)
+        dst_alpha[...] = bg[:, :, 3]
+
+        # Area of coverage, in steps of 1 / (65025 * 255)
+        area_src = np.subtract(255, dst_alpha, out=pool.array(shape, np.uint32))
+        area_src *= src_alpha
+        area_dst = np.subtract(ALPHA_ONE, src_alpha, out=pool.array(shape, np.uint32))
+        area_dst *= dst_alpha
+        area_both = np.multiply(src_alpha, dst_alpha, out=src_alpha)
+        area = np.add(area_src, area_dst, out=dst_alpha)
+        area += area_both
+
+        # Premultiplied result; the largest possible sum is 65025 * 255 * 255, which still fits in a uint32
+        np.multiply(area_src[:, :, None], fg_rgb, out=result_rgb)
+        result_rgb += np.multiply(area_dst[:, :, None], bg_rgb, out=product)
+        result_rgb += np.multiply(area_both[:, :, None], blended, out=product)
+
+        # Unpremultiply, rounding to the nearest value. Fully transparent pixels end up black.
+        with IgnoreNumpyErrors():
+            result_rgb += (area >> 1)[:, :, None]
+            result_rgb //= area[:, :, None]
+        result[:, :, :3] = result_rgb
+        area += ALPHA_ONE // 2
+        area //= ALPHA_ONE
+        result[:, :, 3] = area
+        return result
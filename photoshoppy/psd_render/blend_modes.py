@@ -2,53 +2,123 @@ from typing import Callable
 
 import numpy as np
 
+from . import tracing
 from .compositing import *
-
-
-def blend(blend_fn: Callable) -> np.array:
-    """ Decorator function for handling blend modes. """
-    def bm(fg: np.array, bg: np.array, mask: np.array or None, fg_opacity: float):
-        # Normalize uint8 numbers to a 0-1 floating point range.
-        fg = uint8_to_float(fg)
-        bg = uint8_to_float(bg)
-
-        if mask is not None:
-            mask = uint8_to_float(mask)
-        else:
-            mask = np.ones((fg.shape[0], fg.shape[1]), dtype=np.float64)
-
-        def over(src_rgba, dst_rgba):
-            """ Porter/Duff Over operator, using the blend mode for the "both" color.
-            This was super helpful: http://ssp.impulsetrain.com/porterduff.html
-            """
+from .scratch import ScratchPool, get_scratch_pool
+
+
+LUMINOSITY_WEIGHTS = np.array([0.3, 0.59, 0.11])
+
+
+def blend_kernel(kernel: Callable) -> Callable:
+    """ Decorator function for blend mode kernels.
+    A kernel is called as kernel(fg, bg, out, pool). fg and bg are float64 RGB arrays in a 0-1 range, which it must not
+    modify, and it writes the blended color to out, which has the same shape. Any temporary arrays it needs come from
+    pool (see scratch.ScratchPool).
+    The decorated function blends RGBA images with the Porter/Duff Over operator, using the kernel for the color where
+    both images are present. Its working arrays come from the thread's scratch pool, and the result is written to out
+    if it's given, so compositing a layer doesn't allocate any full-size arrays. Like every blend function, it also
+    takes the canvas position of the images' top left pixel as origin, which only matters to dissolve.
+    """
+    def bm(fg: np.array, bg: np.array, mask: np.array or None, fg_opacity: float,
+           out: np.array or None = None, origin: tuple = (0, 0)) -> np.array:
+        if out is None:
+            out = np.empty(bg.shape, dtype=bg.dtype)
+
+        pool = get_scratch_pool()
+        with pool.frame():
+            # Normalize uint8 numbers to a 0-1 floating point range. Float buffers from deep documents already are.
+            # bg is converted before anything is written to out, which may be bg itself.
+            with tracing.span("convert"):
+                src_rgba = to_float(fg, out=pool.like(fg, np.float64))
+                dst_rgba = to_float(bg, out=pool.like(bg, np.float64))
+
+                # Masks can be a 0-d array when a whole window has the same value; layers without one skip it entirely
+                if mask is not None:
+                    mask = to_float(mask, out=pool.like(mask, np.float64))
+
+            # Porter/Duff Over operator, using the blend mode for the "both" color.
+            # This was super helpful: http://ssp.impulsetrain.com/porterduff.html
             src_rgb = src_rgba[:, :, :3]
             dst_rgb = dst_rgba[:, :, :3]
-            src_alpha = src_rgba[:, :, 3] * fg_opacity * mask
             dst_alpha = dst_rgba[:, :, 3]
+            src_alpha = pool.like(dst_alpha)
+            np.multiply(src_rgba[:, :, 3], fg_opacity, out=src_alpha)
+            if mask is not None:
+                src_alpha *= mask
+
+            with tracing.span("blend"):
+                both = pool.like(src_rgb)
+                kernel(src_rgb, dst_rgb, both, pool)
+
+            with tracing.span("alpha"):
+                # Area of coverage
+                area_src = pool.like(src_alpha)
+                np.subtract(1, dst_alpha, out=area_src)
+                area_src *= src_alpha
+                area_dst = pool.like(src_alpha)
+                np.subtract(1, src_alpha, out=area_dst)
+                area_dst *= dst_alpha
+                area_both = src_alpha
+                area_both *= dst_alpha
+
+                # Result rgb is effectively a blend + premultiplication
+                result_rgb = pool.like(both)
+                np.multiply(area_src[:, :, None], src_rgb, out=result_rgb)
+                np.multiply(area_dst[:, :, None], dst_rgb, out=src_rgb)
+                result_rgb += src_rgb
+                both *= area_both[:, :, None]
+                result_rgb += both
+                result_alpha = area_src
+                result_alpha += area_dst
+                result_alpha += area_both
+
+                # Unpremultiply
+                with IgnoreNumpyErrors():
+                    result_rgb /= result_alpha[:, :, None]
+
+            with tracing.span("convert"):
+                if out.dtype == np.uint8:
+                    for channel in [result_rgb, result_alpha]:
+                        channel *= np.iinfo(np.uint8).max
+                        np.around(channel, out=channel)  # Round before casting to int to avoid floating-point errors
+                else:
+                    # Fully transparent pixels unpremultiply to NaN; casting to uint8 zeroes them, so do the same here
+                    np.nan_to_num(result_rgb, copy=False)
+                with IgnoreNumpyErrors():
+                    out[:, :, :3] = result_rgb
+                    out[:, :, 3] = result_alpha
+        return out
+
+    def color_fn(fg: np.array, bg: np.array) -> np.array:
+        color = np.empty(np.broadcast(fg, bg).shape)
+        kernel(fg, bg, color, ScratchPool())
+        return color
+
+    # Keep a reference to the undecorated color function; lookup tables are built from it.
+    bm.color_fn = color_fn
+    bm.kernel = kernel
+    return bm
 
-            src = src_rgb
-            dst = dst_rgb
-            both = blend_fn(src_rgb, dst_rgb)
-
-            # Area of coverage
-            area_src = src_alpha * (1 - dst_alpha)
-            area_dst = dst_alpha * (1 - src_alpha)
-            area_both = src_alpha * dst_alpha
-
-            # Result rgb is effectively a blend + premultiplication
-            result_rgb = area_src[:, :, None] * src + area_dst[:, :, None] * dst + area_both[:, :, None] * both
-            result_alpha = area_src + area_dst + area_both
 
-            # Combine / unpremultiply result
-            result = np.dstack([result_rgb, result_alpha])
-            result = unpremultiply(result)
-            return result
+def blend(blend_fn: Callable) -> Callable:
+    """ Decorator function for handling blend modes.
+    blend_fn(fg, bg) returns the blended color of two float64 RGB arrays as a new array. It's the simplest way to write
+    a blend mode; see blend_kernel for one that doesn't allocate temporary arrays.
+    """
+    def kernel(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+        np.copyto(out, blend_fn(fg, bg))
 
-        color = over(fg, bg)
+    bm = blend_kernel(kernel)
+    bm.color_fn = blend_fn
+    return bm
 
-        return float_to_uint8(color)
 
-    return bm
+def _clamp(array: np.array) -> np.array:
+    """ Clamp an array to 0-1 in place. """
+    np.minimum(array, 1, out=array)
+    np.maximum(array, 0, out=array)
+    return array
 
 
 @blend
@@ -56,230 +126,399 @@ def blend_pass_through(fg: np.array, bg: np.array) -> np.array:
     raise NotImplementedError
 
 
-@blend
-def blend_normal(fg: np.array, bg: np.array) -> np.array:
-    return fg
+@blend_kernel
+def blend_normal(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.copyto(out, fg)
 
 
-def blend_dissolve(fg: np.array, bg: np.array, fg_opacity: float, mask) -> np.array:
-    """ Dissolve is weird, so it does not use the blend decorator. """
-    raise NotImplementedError
-    # Normalize uint8 numbers to a 0-1 floating point range.
-    fg = uint8_to_float(fg)
-    bg = uint8_to_float(bg)
+def blend_dissolve(fg: np.array, bg: np.array, mask: np.array or None, fg_opacity: float,
+                   out: np.array or None = None, origin: tuple = (0, 0)) -> np.array:
+    """ Dissolve is weird, so it does not use the blend decorator.
+    Each fg pixel is either drawn fully opaque or not at all, with a chance equal to its alpha. The noise it's compared
+    against comes from the pixel's canvas position, so a layer dissolves the same way in any tile or region.
+    """
+    if out is None:
+        out = np.empty(bg.shape, dtype=bg.dtype)
 
-    # Separate rgb and alpha channels
-    fg_rgb = fg[:, :, :3]
-    bg_rgb = bg[:, :, :3]
-    fg_alpha = fg[:, :, 3]
-    bg_alpha = bg[:, :, 3]
+    pool = get_scratch_pool()
+    with pool.frame():
+        shape = fg.shape[:2]
+        with tracing.span("blend"):
+            # Scale fg alpha by layer opacity and the mask; fill is already applied to fg's alpha before blending
+            fg_alpha = to_float(fg[:, :, 3], out=pool.array(shape))
+            fg_alpha *= fg_opacity
+            if mask is not None:
+                fg_alpha *= to_float(mask, out=pool.like(mask, np.float64))
+            drawn = np.greater(fg_alpha, _dissolve_noise(origin, shape, pool), out=pool.array(shape, np.bool_))
 
-    # Scale fg alpha by layer opacity
-    # ToDo: Scale by fill, too
-    fg_alpha *= fg_opacity
+            if out is not bg:
+                np.copyto(out, bg)
+            np.copyto(out[:, :, :3], fg[:, :, :3], where=drawn[:, :, None])
+            np.copyto(out[:, :, 3], channel_max(out.dtype), where=drawn)
+    return out
 
-    # Create random alpha mask
-    dissolve_mask = np.random.rand(fg_alpha.shape[0], fg_alpha.shape[1])
-    dissolve_alpha = np.where(fg_alpha > dissolve_mask, 1, 0)
 
-    # Calculate alpha
-    alpha = dissolve_alpha + bg_alpha - (dissolve_alpha * bg_alpha)
+def _dissolve_noise(origin: tuple, shape: tuple, pool: ScratchPool) -> np.array:
+    """ Return noise in a 0-1 range for the pixels in a window of the canvas, hashed from their coordinates. """
+    top, left = origin
+    rows = np.arange(top, top + shape[0]).astype(np.uint32)
+    rows *= np.uint32(0x9E3779B1)
+    columns = np.arange(left, left + shape[1]).astype(np.uint32)
+    columns *= np.uint32(0x85EBCA77)
 
-    # Composite new fg over bg
-    rgb = alpha_blend(fg_rgb, bg_rgb, dissolve_alpha, bg_alpha)
-    rgba = np.dstack([rgb, alpha])
+    # Mix the coordinates together with MurmurHash3's finalizer
+    h = np.bitwise_xor(rows[:, None], columns[None, :], out=pool.array(shape, np.uint32))
+    shifted = pool.array(shape, np.uint32)
+    for shift, multiplier in [(16, 0x85EBCA6B), (13, 0xC2B2AE35)]:
+        h ^= np.right_shift(h, shift, out=shifted)
+        h *= np.uint32(multiplier)
+    h ^= np.right_shift(h, 16, out=shifted)
 
-    # Convert back to uint8
-    color = float_to_uint8(rgba)
-    return color
+    noise = pool.array(shape)
+    np.multiply(h, 1 / 2 ** 32, out=noise)
+    return noise
 
 
-@blend
-def blend_darken(fg: np.array, bg: np.array) -> np.array:
-    return np.minimum(fg, bg)
+@blend_kernel
+def blend_darken(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.minimum(fg, bg, out=out)
 
 
-@blend
-def blend_multiply(fg: np.array, bg: np.array) -> np.array:
-    return fg * bg
+@blend_kernel
+def blend_multiply(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.multiply(fg, bg, out=out)
 
 
-@blend
-def blend_color_burn(fg: np.array, bg: np.array) -> np.array:
+@blend_kernel
+def blend_color_burn(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
     with IgnoreNumpyErrors():
-        color_burn = 1 - clamp((1 - bg) / fg)
-        color = np.where(bg == 1, bg,
-                         np.where(fg == 0, fg, color_burn))
-    return color
+        np.subtract(1, bg, out=out)
+        out /= fg
+        np.subtract(1, _clamp(out), out=out)
+    where = pool.like(out, np.bool_)
+    np.copyto(out, fg, where=np.equal(fg, 0, out=where))
+    np.copyto(out, bg, where=np.equal(bg, 1, out=where))
 
 
-@blend
-def blend_linear_burn(fg: np.array, bg: np.array) -> np.array:
-    linear_burn = fg + bg - 1
-    color = np.where(fg + bg < 1, 0, linear_burn)
-    return color
+@blend_kernel
+def blend_linear_burn(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.add(fg, bg, out=out)
+    where = np.less(out, 1, out=pool.like(out, np.bool_))
+    out -= 1
+    np.copyto(out, 0, where=where)
 
 
-@blend
-def blend_darker_color(fg: np.array, bg: np.array) -> np.array:
-    mask = get_luminosity(fg) < get_luminosity(bg)
-    color = np.where(mask[:, :, None], fg, bg)
-    return color
+@blend_kernel
+def blend_darker_color(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _blend_by_luminosity(fg, bg, out, pool, np.less)
 
 
-@blend
-def blend_lighten(fg: np.array, bg: np.array) -> np.array:
-    return np.maximum(fg, bg)
+@blend_kernel
+def blend_lighten(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.maximum(fg, bg, out=out)
 
 
-@blend
-def blend_screen(fg: np.array, bg: np.array) -> np.array:
-    return 1 - ((1 - bg) * (1 - fg))
+@blend_kernel
+def blend_screen(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.subtract(1, bg, out=out)
+    out *= np.subtract(1, fg, out=pool.like(out))
+    np.subtract(1, out, out=out)
 
 
-@blend
-def blend_color_dodge(fg: np.array, bg: np.array) -> np.array:
+@blend_kernel
+def blend_color_dodge(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
     with IgnoreNumpyErrors():
-        color_dodge = clamp(bg / (1 - fg))
-        color = np.where(bg == 0, 0,
-                         np.where(fg == 1, 1, color_dodge))
-    return color
+        np.subtract(1, fg, out=out)
+        np.divide(bg, out, out=out)
+        _clamp(out)
+    where = pool.like(out, np.bool_)
+    np.copyto(out, 1, where=np.equal(fg, 1, out=where))
+    np.copyto(out, 0, where=np.equal(bg, 0, out=where))
 
 
-@blend
-def blend_linear_dodge(fg: np.array, bg: np.array) -> np.array:
-    return clamp(fg + bg)
+@blend_kernel
+def blend_linear_dodge(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _clamp(np.add(fg, bg, out=out))
 
 
-@blend
-def blend_lighter_color(fg: np.array, bg: np.array) -> np.array:
-    mask = get_luminosity(fg) > get_luminosity(bg)
-    color = np.where(mask[:, :, None], fg, bg)
-    return color
+@blend_kernel
+def blend_lighter_color(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _blend_by_luminosity(fg, bg, out, pool, np.greater)
 
 
-@blend
-def blend_overlay(fg: np.array, bg: np.array) -> np.array:
-    multiply = 2 * fg * bg
-    screen = 1 - (2 * ((1 - fg) * (1 - bg)))
-    color = np.where(bg < 0.5, multiply, screen)
-    return color
+def _blend_by_luminosity(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool, compare: np.ufunc):
+    """ Pick the fg color where comparing its luminosity to the bg's is true, and the bg color elsewhere. """
+    fg_luminosity = np.dot(fg, LUMINOSITY_WEIGHTS, out=pool.array(fg.shape[:-1]))
+    bg_luminosity = np.dot(bg, LUMINOSITY_WEIGHTS, out=pool.array(bg.shape[:-1]))
+    where = compare(fg_luminosity, bg_luminosity, out=pool.array(fg.shape[:-1], np.bool_))
+    np.copyto(out, bg)
+    np.copyto(out, fg, where=where[..., None])
 
 
-@blend
-def blend_soft_light(fg: np.array, bg: np.array) -> np.array:
-    dark = bg - (1 - 2 * fg) * bg * (1 - bg)
-    light = bg + (2 * fg - 1) * ((4 * bg) * (4 * bg + 1) * (bg - 1) + 7 * bg)
-    light_less = bg + (2 * fg - 1) * (np.power(bg, 0.5) - bg)
-    color = np.where(fg <= 0.5, dark,
-                     np.where(bg <= 0.25, light, light_less))
-    return color
+def _multiply_or_screen(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool, use_multiply: np.array):
+    """ 2 * fg * bg where use_multiply is true, and 1 - 2 * (1 - fg) * (1 - bg) elsewhere. """
+    np.subtract(1, fg, out=out)
+    out *= np.subtract(1, bg, out=pool.like(out))
+    out *= 2
+    np.subtract(1, out, out=out)
+    multiply = np.multiply(2, fg, out=pool.like(out))
+    multiply *= bg
+    np.copyto(out, multiply, where=use_multiply)
 
 
-@blend
-def blend_hard_light(fg: np.array, bg: np.array) -> np.array:
-    multiply = 2 * fg * bg
-    screen = 1 - (2 * ((1 - fg) * (1 - bg)))
-    color = np.where(fg <= 0.5, multiply, screen)
+@blend_kernel
+def blend_overlay(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _multiply_or_screen(fg, bg, out, pool, np.less(bg, 0.5, out=pool.like(out, np.bool_)))
 
-    return color
 
+@blend_kernel
+def blend_soft_light(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    # 2 * fg - 1 scales every branch
+    scale = np.multiply(2, fg, out=pool.like(out))
+    scale -= 1
+    where = pool.like(out, np.bool_)
+    temp = pool.like(out)
 
-@blend
-def blend_vivid_light(fg: np.array, bg: np.array) -> np.array:
-    # Scale FG to cover half ranges
-    burn_fg = clamp(2 * fg)
-    dodge_fg = clamp(2 * (fg - 0.5))
+    # Light, for bg above a quarter: bg + (2 * fg - 1) * (sqrt(bg) - bg)
+    np.power(bg, 0.5, out=temp)
+    temp -= bg
+    temp *= scale
+    np.add(bg, temp, out=out)
 
-    with IgnoreNumpyErrors():
-        color_burn = 1 - clamp((1 - bg) / burn_fg)
-        color_dodge = bg / (1 - dodge_fg)
+    # Light, for darker bg: bg + (2 * fg - 1) * ((4 * bg) * (4 * bg + 1) * (bg - 1) + 7 * bg)
+    light = np.multiply(4, bg, out=pool.like(out))
+    np.add(light, 1, out=temp)
+    light *= temp
+    light *= np.subtract(bg, 1, out=temp)
+    light += np.multiply(7, bg, out=temp)
+    light *= scale
+    np.add(bg, light, out=light)
+    np.copyto(out, light, where=np.less_equal(bg, 0.25, out=where))
 
-        color = np.where(fg == 1, fg,
-                         np.where(fg == 0, fg,
-                                  np.where(fg <= 0.5, clamp(color_burn), clamp(color_dodge))))
-    return color
+    # Dark: bg - (1 - 2 * fg) * bg * (1 - bg)
+    dark = np.multiply(2, fg, out=light)
+    np.subtract(1, dark, out=dark)
+    dark *= bg
+    dark *= np.subtract(1, bg, out=temp)
+    np.subtract(bg, dark, out=dark)
+    np.copyto(out, dark, where=np.less_equal(fg, 0.5, out=where))
 
 
-@blend
-def blend_linear_light(fg: np.array, bg: np.array) -> np.array:
-    # Scale FG to cover half ranges
-    burn_fg = clamp(2 * fg)
-    dodge_fg = clamp(2 * (fg - 0.5))
+@blend_kernel
+def blend_hard_light(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _multiply_or_screen(fg, bg, out, pool, np.less_equal(fg, 0.5, out=pool.like(out, np.bool_)))
 
-    with IgnoreNumpyErrors():
-        linear_burn = burn_fg + bg - 1
-        linear_dodge = clamp(dodge_fg + bg)
 
-        color = np.where(fg <= 0.5, clamp(linear_burn), clamp(linear_dodge))
+def _half_ranges(fg: np.array, pool: ScratchPool) -> tuple:
+    """ Scale fg to cover half ranges: clamp(2 * fg) for the lower half, and clamp(2 * (fg - 0.5)) for the upper. """
+    lower = _clamp(np.multiply(2, fg, out=pool.like(fg)))
+    upper = np.subtract(fg, 0.5, out=pool.like(fg))
+    upper *= 2
+    return lower, _clamp(upper)
 
-    return color
 
+def _upper_half(fg: np.array, pool: ScratchPool) -> np.array:
+    """ Where fg is above 0.5. """
+    where = np.less_equal(fg, 0.5, out=pool.like(fg, np.bool_))
+    return np.logical_not(where, out=where)
 
-@blend
-def blend_pin_light(fg: np.array, bg: np.array) -> np.array:
-    # Scale FG to cover half ranges
-    darken_fg = clamp(2 * fg)
-    lighten_fg = clamp(2 * (fg - 0.5))
+
+@blend_kernel
+def blend_vivid_light(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    burn_fg, dodge_fg = _half_ranges(fg, pool)
 
     with IgnoreNumpyErrors():
-        darken = np.minimum(darken_fg, bg)
-        lighten = np.maximum(lighten_fg, bg)
-        color = np.where(fg <= 0.5, clamp(darken), clamp(lighten))
+        # Color burn
+        np.subtract(1, bg, out=out)
+        out /= burn_fg
+        np.subtract(1, _clamp(out), out=out)
+        _clamp(out)
 
-    return color
+        # Color dodge
+        np.subtract(1, dodge_fg, out=dodge_fg)
+        color_dodge = _clamp(np.divide(bg, dodge_fg, out=dodge_fg))
 
+    where = _upper_half(fg, pool)
+    np.copyto(out, color_dodge, where=where)
+    np.copyto(out, fg, where=np.equal(fg, 0, out=where))
+    np.copyto(out, fg, where=np.equal(fg, 1, out=where))
 
-@blend
-def blend_hard_mix(fg: np.array, bg: np.array) -> np.array:
-    # ToDo: This isn't a perfect match
-    # This method yields false-positives that Photoshop would otherwise ignore
-    fg2 = np.round(fg, 3)
-    bg2 = np.round(bg, 3)
-    color = np.where(bg == 0, 0,
-                     np.where(fg2 + bg2 >= 1, 1, 0))
-    return color
 
+@blend_kernel
+def blend_linear_light(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    burn_fg, dodge_fg = _half_ranges(fg, pool)
 
-@blend
-def blend_difference(fg: np.array, bg: np.array) -> np.array:
-    return np.abs(fg - bg)
+    # Linear burn
+    np.add(burn_fg, bg, out=out)
+    out -= 1
+    _clamp(out)
 
+    # Linear dodge
+    dodge_fg += bg
+    np.copyto(out, _clamp(dodge_fg), where=_upper_half(fg, pool))
 
-@blend
-def blend_exclusion(fg: np.array, bg: np.array) -> np.array:
-    return clamp((fg + bg) - (2 * fg * bg))
 
+@blend_kernel
+def blend_pin_light(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    darken_fg, lighten_fg = _half_ranges(fg, pool)
+    _clamp(np.minimum(darken_fg, bg, out=out))
+    lighten = _clamp(np.maximum(lighten_fg, bg, out=lighten_fg))
+    np.copyto(out, lighten, where=_upper_half(fg, pool))
 
-@blend
-def blend_subtract(fg: np.array, bg: np.array) -> np.array:
-    return clamp(bg - fg)
 
+@blend_kernel
+def blend_hard_mix(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    # ToDo: This isn't a perfect match
+    # This method yields false-positives that Photoshop would otherwise ignore
+    total = np.round(fg, 3, out=pool.like(out))
+    total += np.round(bg, 3, out=pool.like(out))
+    where = np.greater_equal(total, 1, out=pool.like(out, np.bool_))
+    np.copyto(out, where)
+    np.copyto(out, 0, where=np.equal(bg, 0, out=where))
 
-@blend
-def blend_divide(fg: np.array, bg: np.array) -> np.array:
-    with IgnoreNumpyErrors():
-        color = np.where(bg == 0, 0,
-                         np.where(fg == 0, 1, clamp(bg / fg)))
-    return color
 
+@blend_kernel
+def blend_difference(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.abs(np.subtract(fg, bg, out=out), out=out)
 
-@blend
-def blend_hue(fg: np.array, bg: np.array) -> np.array:
-    return set_luminosity(set_saturation(fg, get_saturation(bg)), get_luminosity(bg))
 
+@blend_kernel
+def blend_exclusion(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.add(fg, bg, out=out)
+    product = np.multiply(2, fg, out=pool.like(out))
+    product *= bg
+    out -= product
+    _clamp(out)
 
-@blend
-def blend_saturation(fg: np.array, bg: np.array) -> np.array:
-    return set_luminosity(set_saturation(bg, get_saturation(fg)), get_luminosity(bg))
 
+@blend_kernel
+def blend_subtract(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _clamp(np.subtract(bg, fg, out=out))
 
-@blend
-def blend_color(fg: np.array, bg: np.array) -> np.array:
-    return set_luminosity(fg, get_luminosity(bg))
 
+@blend_kernel
+def blend_divide(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    with IgnoreNumpyErrors():
+        _clamp(np.divide(bg, fg, out=out))
+    where = pool.like(out, np.bool_)
+    np.copyto(out, 1, where=np.equal(fg, 0, out=where))
+    np.copyto(out, 0, where=np.equal(bg, 0, out=where))
 
-@blend
-def blend_luminosity(fg: np.array, bg: np.array) -> np.array:
-    return set_luminosity(bg, get_luminosity(fg))
 
+@blend_kernel
+def blend_hue(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _set_saturation(fg, _saturation(bg, pool), out, pool)
+    _set_luminosity(out, _luminosity(bg, pool), pool)
+
+
+@blend_kernel
+def blend_saturation(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    _set_saturation(bg, _saturation(fg, pool), out, pool)
+    _set_luminosity(out, _luminosity(bg, pool), pool)
+
+
+@blend_kernel
+def blend_color(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.copyto(out, fg)
+    _set_luminosity(out, _luminosity(bg, pool), pool)
+
+
+@blend_kernel
+def blend_luminosity(fg: np.array, bg: np.array, out: np.array, pool: ScratchPool):
+    np.copyto(out, bg)
+    _set_luminosity(out, _luminosity(fg, pool), pool)
+
+
+# The helpers for the non-separable modes work on the R, G and B planes directly, instead of stacking copies of
+#   per-pixel values to match the RGB arrays. They give exactly the same results as get_luminosity, set_luminosity,
+#   clip_color, get_saturation and set_saturation in compositing.
+
+
+def _luminosity(rgb: np.array, pool: ScratchPool) -> np.array:
+    return np.dot(rgb, LUMINOSITY_WEIGHTS, out=pool.array(rgb.shape[:-1]))
+
+
+def _channel_max(rgb: np.array, out: np.array) -> np.array:
+    # Elementwise maximums of the channel planes are much faster than reducing a length 3 axis
+    np.maximum(rgb[..., 0], rgb[..., 1], out=out)
+    return np.maximum(out, rgb[..., 2], out=out)
+
+
+def _channel_min(rgb: np.array, out: np.array) -> np.array:
+    np.minimum(rgb[..., 0], rgb[..., 1], out=out)
+    return np.minimum(out, rgb[..., 2], out=out)
+
+
+def _saturation(rgb: np.array, pool: ScratchPool) -> np.array:
+    saturation = _channel_max(rgb, pool.array(rgb.shape[:-1]))
+    saturation -= _channel_min(rgb, pool.array(rgb.shape[:-1]))
+    return saturation
+
+
+def _set_saturation(rgb: np.array, saturation: np.array, out: np.array, pool: ScratchPool):
+    """ Write rgb with its saturation replaced to out. Each pixel's largest channel becomes the new saturation, its
+    smallest becomes 0, and the one in between is scaled to match. Tied channels are set alike.
+    """
+    shape = rgb.shape[:-1]
+    with pool.frame():
+        where = pool.array(shape, np.bool_)
+        rgb_max = _channel_max(rgb, pool.array(shape))
+        rgb_min = _channel_min(rgb, pool.array(shape))
+        delta = np.subtract(rgb_max, rgb_min, out=pool.array(shape))
+        gray = np.less_equal(delta, 0, out=pool.array(shape, np.bool_))
+
+        for channel in range(3):
+            c = rgb[..., channel]
+            channel_out = out[..., channel]
+            np.subtract(c, rgb_min, out=channel_out)
+            channel_out *= saturation
+            with IgnoreNumpyErrors():
+                channel_out /= delta
+            np.copyto(channel_out, 0, where=np.equal(c, rgb_min, out=where))
+            np.copyto(channel_out, saturation, where=np.equal(c, rgb_max, out=where))
+            # Gray pixels have no saturation to scale
+            np.copyto(channel_out, 0, where=gray)
+
+
+def _set_luminosity(rgb: np.array, luminosity: np.array, pool: ScratchPool):
+    """ Shift rgb in place to a new luminosity, then clip it back into range, keeping its luminosity. """
+    with pool.frame():
+        shift = _luminosity(rgb, pool)
+        np.subtract(luminosity, shift, out=shift)
+        rgb += shift[..., None]
+        _clip_color(rgb, pool)
+
+
+def _clip_color(rgb: np.array, pool: ScratchPool):
+    """ Pull out of range pixels back towards their luminosity, in place. Only pixels with a channel below 0 or above
+    1 change, so the clipping math is skipped entirely when there aren't any.
+    """
+    shape = rgb.shape[:-1]
+    with pool.frame():
+        rgb_min = _channel_min(rgb, pool.array(shape))
+        rgb_max = _channel_max(rgb, pool.array(shape))
+        below = np.less(rgb_min, 0, out=pool.array(shape, np.bool_))
+        above = np.greater(rgb_max, 1, out=pool.array(shape, np.bool_))
+        has_below, has_above = below.any(), above.any()
+        if not has_below and not has_above:
+            return
+
+        l = _luminosity(rgb, pool)[..., None]
+        scale = pool.array(shape + (1,))
+        clipped = pool.like(rgb)
+        with IgnoreNumpyErrors():
+            if has_above:
+                # l + (rgb - l) * (1 - l) / (max - l), for pixels that aren't also below 0
+                np.subtract(rgb, l, out=clipped)
+                clipped *= np.subtract(1, l, out=scale)
+                clipped /= np.subtract(rgb_max[..., None], l, out=scale)
+                clipped += l
+                above &= np.logical_not(below, out=pool.array(shape, np.bool_))
+                np.copyto(rgb, clipped, where=above[..., None])
+            if has_below:
+                # l + (rgb - l) * l / (l - min)
+                np.subtract(rgb, l, out=clipped)
+                clipped *= l
+                clipped /= np.subtract(l, rgb_min[..., None], out=scale)
+                clipped += l
+                np.copyto(rgb, clipped, where=below[..., None])
@@ -0,0 +1,127 @@
+""" Conversion from Photoshop color modes to the RGB working space the renderer composites in.
+Conversions work on separate channel planes and are purely per pixel, so they can run on a whole layer, or on just the
+rows of a tile or band.
+"""
+import numpy as np
+
+
+# Color modes, by the ID files and patterns store them as.
+COLOR_MODE_IDS = {
+    0: "Bitmap",
+    1: "Grayscale",
+    2: "Indexed",
+    3: "RGB",
+    4: "CMYK",
+    7: "Multichannel",
+    8: "Duotone",
+    9: "Lab",
+}
+
+# Number of color channels in each color mode; any channels after these are alpha or spot channels.
+COLOR_MODE_CHANNELS = {
+    "Bitmap": 1,
+    "Grayscale": 1,
+    "Indexed": 1,
+    "RGB": 3,
+    "CMYK": 4,
+    "Multichannel": None,
+    "Duotone": 1,
+    "Lab": 3,
+}
+
+# D50 reference white, which Photoshop's Lab values are relative to.
+D50_WHITE = (0.96422, 1.0, 0.82521)
+
+# XYZ (D50) to linear sRGB, with Bradford adaptation to D65.
+XYZ_D50_TO_LINEAR_SRGB = np.array([
+    [3.1338561, -1.6168667, -0.4906146],
+    [-0.9787684, 1.9161415, 0.0334540],
+    [0.0719453, -0.2289914, 1.4052427],
+], dtype=np.float32)
+
+# Products of every pair of 8-bit values, divided by 255. Built the first time CMYK is converted.
+_product_lut = None
+
+
+def color_channel_count(color_mode: str) -> int:
+    count = COLOR_MODE_CHANNELS.get(color_mode)
+    if count is None:
+        raise NotImplementedError(f"Color mode not supported: {color_mode}")
+    return count
+
+
+def to_rgb(color_mode: str, planes: list, palette: np.array or None = None) -> tuple:
+    """ Convert a color mode's channel planes to red, green and blue planes of the same type: either uint8, or float32
+    in a 0-1 range (see compositing.to_working_depth). Indexed planes are always 8-bit indices.
+    RGB and grayscale planes are returned without being copied, so they must not be modified.
+    """
+    if color_mode == "RGB":
+        return planes[0], planes[1], planes[2]
+    if color_mode in ["Grayscale", "Duotone"]:
+        # Duotone documents store a single ink channel; without the ink curves, it's shown as grayscale
+        return planes[0], planes[0], planes[0]
+    if color_mode == "CMYK":
+        return cmyk_to_rgb(*planes[:4])
+    if color_mode == "Lab":
+        return lab_to_rgb(*planes[:3])
+    if color_mode == "Indexed":
+        if palette is None:
+            raise ValueError("Indexed color needs a palette")
+        return expand_palette(planes[0], palette)
+    raise NotImplementedError(f"Color mode not supported: {color_mode}")
+
+
+def cmyk_to_rgb(c: np.array, m: np.array, y: np.array, k: np.array) -> tuple:
+    """ Naive, profile-free CMYK conversion. Photoshop stores CMYK inverted, with 255 meaning no ink, so each RGB
+    channel is an ink channel times black, which is looked up in a table of 8-bit products.
+    """
+    if c.dtype != np.uint8:
+        return c * k, m * k, y * k
+    lut = _get_product_lut()
+    return lut[c, k], lut[m, k], lut[y, k]
+
+
+def lab_to_rgb(l: np.array, a: np.array, b: np.array) -> tuple:
+    """ Convert Lab, with L scaled to 0-255 and a and b offset by 128, to sRGB. Float planes are scaled to 0-1, and
+    the result is left unquantized.
+    """
+    scale = np.float32(1 if l.dtype == np.uint8 else 255)
+    fy = (l.astype(np.float32) * scale * np.float32(100 / 255) + 16) / 116
+    fx = fy + (a.astype(np.float32) * scale - 128) / 500
+    fz = fy - (b.astype(np.float32) * scale - 128) / 200
+
+    xyz = np.stack([_lab_f_inverse(f) * white for f, white in zip([fx, fy, fz], D50_WHITE)], axis=-1)
+    rgb = xyz @ XYZ_D50_TO_LINEAR_SRGB.T
+    np.clip(rgb, 0, 1, out=rgb)
+    rgb = np.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * np.power(rgb, 1 / 2.4, dtype=np.float32) - 0.055)
+    if l.dtype == np.uint8:
+        rgb = np.around(rgb * 255).astype(np.uint8)
+    else:
+        rgb = rgb.astype(np.float32)
+    return rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+
+def expand_palette(indices: np.array, palette: np.array) -> tuple:
+    """ Look up indexed pixels in a (256, 3) palette. """
+    rgb = palette[indices]
+    return rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+
+def read_palette(color_mode_data: bytes) -> np.array:
+    """ Indexed color mode data is 256 reds, then 256 greens, then 256 blues. """
+    if len(color_mode_data) < 768:
+        raise ValueError(f"Indexed color mode data should be 768 bytes; got {len(color_mode_data)}")
+    return np.frombuffer(color_mode_data[:768], dtype=np.uint8).reshape(3, 256).T.copy()
+
+
+def _lab_f_inverse(t: np.array) -> np.array:
+    delta = np.float32(6 / 29)
+    return np.where(t > delta, t * t * t, 3 * delta * delta * (t - np.float32(4 / 29)))
+
+
+def _get_product_lut() -> np.array:
+    global _product_lut
+    if _product_lut is None:
+        values = np.arange(256, dtype=np.uint32)
+        _product_lut = ((values[:, None] * values[None, :] + 127) // 255).astype(np.uint8)
+    return _product_lut
@@ -26,6 +26,41 @@ def float_to_uint8(data: np.array) -> np.array:
     return new_data.astype(np.uint8)
 
 
+def to_float(data: np.array, out: np.array or None = None) -> np.array:
+    """ Normalize 8-bit, 16-bit or float data to a 0-1 floating point range, in a new float64 array or in out. """
+    if out is None:
+        out = data.astype(np.float64)
+    else:
+        np.copyto(out, data)
+    if data.dtype.kind in "ui":
+        out /= np.iinfo(data.dtype).max
+    return out
+
+
+def working_dtype(depth: int) -> np.dtype:
+    """ The type pixels are composited in. 8-bit documents stay 8-bit; deeper documents are composited as float32, so
+    they're never quantized to 8 bits along the way.
+    """
+    return np.dtype(np.uint8) if depth == 8 else np.dtype(np.float32)
+
+
+def to_working_depth(data: np.array) -> np.array:
+    """ Convert decoded channel data to its working type: 8-bit and float data is returned as-is, and 16-bit data is
+    normalized to float32.
+    """
+    if data.dtype == np.uint16:
+        return data.astype(np.float32) / np.float32(np.iinfo(np.uint16).max)
+    return data
+
+
+def channel_max(dtype: np.dtype) -> int or float:
+    """ The value of a fully opaque alpha, or white, for a type. """
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui":
+        return np.iinfo(dtype).max
+    return 1.0
+
+
 def premultiply(rgba: np.array) -> np.array:
     rgb = rgba[:, :, :3]
     a = rgba[:, :, 3]
@@ -42,6 +77,8 @@ def unpremultiply(rgba: np.array) -> np.array:
 
 
 def scale_channel(array: np.array, scale: float) -> np.array:
+    if array.dtype.kind == "f":
+        return array * array.dtype.type(scale)
     array = uint8_to_float(array)
     array *= scale
     array = float_to_uint8(array)
@@ -52,6 +89,25 @@ def get_luminosity(rgb: np.array) -> np.array:
     return np.dot(rgb, [0.3, 0.59, 0.11])
 
 
+# Integer luminosity weights for gray values, which add up to 256
+GRAY_WEIGHTS = (77, 151, 28)
+
+
+def gray_values(rgb: np.array) -> np.array:
+    """ Return the gray values of an RGB or RGBA image, in the image's own type. 8-bit values are rounded. """
+    if rgb.dtype != np.uint8:
+        return np.dot(rgb[:, :, :3], np.array(GRAY_WEIGHTS, dtype=rgb.dtype) / 256)
+
+    # Planes are widened before they're weighted; uint8 * uint16 scalar stays uint8 under value-based casting
+    gray = rgb[:, :, 0].astype(np.uint16)
+    gray *= GRAY_WEIGHTS[0]
+    for i in [1, 2]:
+        gray += rgb[:, :, i].astype(np.uint16) * GRAY_WEIGHTS[i]
+    gray += 128
+    gray >>= 8
+    return gray.astype(np.uint8)
+
+
 def set_luminosity(rgb: np.array, luminosity: np.array) -> np.array:
     d = luminosity - get_luminosity(rgb)
     return clip_color(rgb + d[:, :, None])
@@ -0,0 +1,283 @@
+""" Fill layers for render plans.
+Solid color, gradient and pattern fill layers generate their pixels instead of storing them, and nothing is generated
+ahead of time: each window's pixels are generated as it's composited, so a fill never costs a full-canvas buffer.
+Solid colors broadcast a single pixel over the window, gradients are evaluated from the window's own coordinate arrays,
+and patterns are tiled over the window with a strided view of the pattern.
+"""
+from __future__ import annotations
+
+import colorsys
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+from .color_conversion import lab_to_rgb, to_rgb
+from .compositing import channel_max, clamp, to_float
+from photoshoppy.models.layer.layer_info.layer_info_blocks.fill_layers import (
+    ColorStop, FillContent, GradientFill, PatternFill, SolidColor, TransparencyStop)
+from photoshoppy.models.layer.layer_info.layer_info_blocks.patterns import Pattern
+from photoshoppy.utilities.descriptor import Descriptor, UnitFloat
+from photoshoppy.utilities.rect import Rect, rect_height, rect_is_empty, rect_width
+
+
+# Gradient stop locations are in 4096ths of the gradient's length, so a ramp with an entry for each is exact
+GRADIENT_RAMP_SIZE = 4097
+
+
+class SolidColorGenerator:
+    def __init__(self, rgb: np.array, dtype: np.dtype):
+        self._pixel = _to_dtype(np.append(rgb, 1.0), dtype)
+
+    @property
+    def is_opaque(self) -> bool:
+        return True
+
+    def render(self, window: Rect) -> np.array:
+        """ Return the fill's RGBA pixels inside a window, as a read-only view of a single pixel. """
+        return np.broadcast_to(self._pixel, (rect_height(window), rect_width(window), 4))
+
+    def opaque_pixels(self, window: Rect) -> np.array:
+        return np.ones((rect_height(window), rect_width(window)), dtype=np.bool_)
+
+    def scaled(self, factor: int) -> SolidColorGenerator:
+        return self
+
+
+class GradientGenerator:
+    """ Gradients map a position from 0 to 1 along the gradient to a ramp of RGBA values, with an entry for every stop
+    location. The position is computed per pixel from the window's coordinates, relative to the gradient's center.
+    bounds is the area the gradient spans, in the document's pixels. A proxy factor samples the gradient at every
+    factor-th pixel.
+    """
+    def __init__(self, gradient: GradientFill, bounds: Rect, dtype: np.dtype, factor: int = 1):
+        self._gradient = gradient
+        self._bounds = bounds
+        self._dtype = dtype
+        self._factor = factor
+        self._ramp = _to_dtype(_gradient_ramp(gradient), dtype)
+
+        width, height = rect_width(bounds), rect_height(bounds)
+        horizontal, vertical = gradient.offset
+        self._center = (bounds.left + width * (0.5 + horizontal / 100), bounds.top + height * (0.5 + vertical / 100))
+
+        # The gradient's direction, with y pointing down; its length spans the bounds along that direction
+        angle = math.radians(gradient.angle)
+        self._direction = (math.cos(angle), -math.sin(angle))
+        length = abs(width * self._direction[0]) + abs(height * self._direction[1])
+        self._length = max(length * gradient.scale / 100, 1e-6)
+
+    @property
+    def is_opaque(self) -> bool:
+        return all(stop.opacity >= 100 for stop in self._gradient.transparency_stops)
+
+    def render(self, window: Rect) -> np.array:
+        """ Return the fill's RGBA pixels inside a window, as a new array. """
+        positions = self._positions(window)
+        if self._gradient.reverse:
+            positions = 1 - positions
+        index = np.around(clamp(positions) * (GRADIENT_RAMP_SIZE - 1)).astype(np.intp)
+        return self._ramp[index]
+
+    def opaque_pixels(self, window: Rect) -> np.array:
+        return np.full((rect_height(window), rect_width(window)), self.is_opaque, dtype=np.bool_)
+
+    def scaled(self, factor: int) -> GradientGenerator:
+        return GradientGenerator(self._gradient, self._bounds, self._dtype, factor=self._factor * factor)
+
+    def _positions(self, window: Rect) -> np.array:
+        """ Each pixel's position along the gradient, sampled at the pixel's center. """
+        rows, columns = np.ogrid[window.top:window.bottom, window.left:window.right]
+        x = ((columns + 0.5) * self._factor - self._center[0]).astype(np.float32)
+        y = ((rows + 0.5) * self._factor - self._center[1]).astype(np.float32)
+        dx, dy = self._direction
+        half_length = np.float32(self._length / 2)
+        gradient_type = self._gradient.gradient_type
+
+        if gradient_type == "radial":
+            return np.hypot(x, y) / half_length
+        if gradient_type == "angle":
+            # Swept clockwise from the gradient's angle
+            angles = np.arctan2(-y, x) - np.float32(math.radians(self._gradient.angle))
+            return (-angles / np.float32(2 * math.pi)) % 1
+
+        along = x * np.float32(dx) + y * np.float32(dy)
+        if gradient_type == "reflected":
+            return np.abs(along) / half_length
+        if gradient_type == "diamond":
+            across = y * np.float32(dx) - x * np.float32(dy)
+            return (np.abs(along) + np.abs(across)) / half_length
+        return along / np.float32(self._length) + np.float32(0.5)
+
+
+class PatternGenerator:
+    """ Patterns are converted to an RGBA tile of the document's working type once, and tiled from origin, a (top,
+    left) canvas position. A window is rendered from a zero-copy view that repeats the tile over the window with zero
+    strides; only the window, rounded out to whole tiles, is ever materialized.
+    """
+    def __init__(self, tile: np.array, origin: Tuple[float, float]):
+        self._tile = tile
+        self._origin = (int(math.floor(origin[0])), int(math.floor(origin[1])))
+
+    @classmethod
+    def from_pattern(cls, pattern: Pattern, scale: float, origin: Tuple[float, float],
+                     dtype: np.dtype) -> PatternGenerator:
+        return cls(_pattern_tile(pattern, scale, dtype), origin)
+
+    @property
+    def tile(self) -> np.array:
+        return self._tile
+
+    @property
+    def is_opaque(self) -> bool:
+        return bool((self._tile[:, :, 3] >= channel_max(self._tile.dtype)).all())
+
+    def render(self, window: Rect) -> np.array:
+        """ Return the fill's RGBA pixels inside a window. """
+        return self._tiled(self._tile, window)
+
+    def opaque_pixels(self, window: Rect) -> np.array:
+        return self._tiled(self._tile[:, :, 3] >= channel_max(self._tile.dtype), window)
+
+    def scaled(self, factor: int) -> PatternGenerator:
+        height, width = self._tile.shape[:2]
+        rows = np.arange(-(-height // factor)) * factor
+        columns = np.arange(-(-width // factor)) * factor
+        tile = self._tile[rows[:, None], columns[None, :]]
+        return PatternGenerator(tile, (self._origin[0] / factor, self._origin[1] / factor))
+
+    def _tiled(self, tile: np.array, window: Rect) -> np.array:
+        height, width = tile.shape[:2]
+        top = (window.top - self._origin[0]) % height
+        left = (window.left - self._origin[1]) % width
+        rows = -(-(top + rect_height(window)) // height)
+        columns = -(-(left + rect_width(window)) // width)
+
+        # (rows, height, columns, width, ...) view of the tile, repeated without copying it
+        strides = tile.strides
+        view = np.lib.stride_tricks.as_strided(
+            tile, shape=(rows, height, columns, width) + tile.shape[2:], strides=(0, strides[0], 0) + strides[1:],
+            writeable=False)
+        view = view.reshape((rows * height, columns * width) + tile.shape[2:])
+        return view[top:top + rect_height(window), left:left + rect_width(window)]
+
+
+def build_fill(fill_content: FillContent, bounds: Rect, canvas: Rect, dtype: np.dtype,
+               patterns: dict) -> SolidColorGenerator or GradientGenerator or PatternGenerator or None:
+    """ Build what's needed to generate a fill layer's pixels in a working type. bounds is the layer's rect, which
+    gradients and patterns can be aligned to; patterns are looked up by ID. Returns None for fills that aren't
+    supported.
+    """
+    dtype = np.dtype(dtype)
+    bounds = canvas if rect_is_empty(bounds) else bounds
+    if isinstance(fill_content, SolidColor):
+        rgb = color_to_rgb(fill_content.color)
+        return None if rgb is None else SolidColorGenerator(rgb, dtype)
+    if isinstance(fill_content, GradientFill):
+        if fill_content.is_noise or any(color_to_rgb(stop.color) is None for stop in fill_content.color_stops):
+            return None
+        return GradientGenerator(fill_content, bounds if fill_content.align else canvas, dtype)
+    if isinstance(fill_content, PatternFill):
+        pattern = patterns.get(fill_content.pattern_id)
+        if pattern is None or pattern.width == 0 or pattern.height == 0:
+            return None
+        phase_x, phase_y = fill_content.phase
+        origin = (phase_y, phase_x)
+        if fill_content.align:
+            origin = (origin[0] + bounds.top, origin[1] + bounds.left)
+        return PatternGenerator.from_pattern(pattern, fill_content.scale, origin, dtype)
+    return None
+
+
+def color_to_rgb(color: Descriptor) -> np.array or None:
+    """ Convert a color descriptor to 0-1 RGB floats. Returns None for color models that aren't supported. """
+    if color.class_id == "RGBC":
+        if "redFloat" in color:
+            rgb = [color["redFloat"], color["greenFloat"], color["blueFloat"]]
+        else:
+            rgb = [color["Rd  "] / 255, color["Grn "] / 255, color["Bl  "] / 255]
+    elif color.class_id == "HSBC":
+        hue = color["H   "].value if isinstance(color["H   "], UnitFloat) else color["H   "]
+        rgb = colorsys.hsv_to_rgb(hue % 360 / 360, color["Strt"] / 100, color["Brgh"] / 100)
+    elif color.class_id == "Grsc":
+        rgb = [1 - color["Gry "] / 100] * 3
+    elif color.class_id == "CMYC":
+        # Naive, profile-free conversion, like color_conversion.cmyk_to_rgb
+        black = 1 - color["Blck"] / 100
+        rgb = [(1 - color[key] / 100) * black for key in ["Cyn ", "Mgnt", "Ylw "]]
+    elif color.class_id == "LbCl":
+        planes = [np.array([color["Lmnc"] / 100], dtype=np.float32),
+                  np.array([(color["A   "] + 128) / 255], dtype=np.float32),
+                  np.array([(color["B   "] + 128) / 255], dtype=np.float32)]
+        rgb = [plane[0] for plane in lab_to_rgb(*planes)]
+    else:
+        return None
+    return clamp(np.array(rgb, dtype=np.float64))
+
+
+def _gradient_ramp(gradient: GradientFill) -> np.array:
+    """ RGBA values for every stop location, as 0-1 floats. """
+    locations = np.arange(GRADIENT_RAMP_SIZE, dtype=np.float64)
+    rgb = _interpolate_stops(locations, gradient.color_stops, lambda stop: color_to_rgb(stop.color), default=[0.0] * 3)
+    alpha = _interpolate_stops(locations, gradient.transparency_stops, lambda stop: [stop.opacity / 100],
+                               default=[1.0])
+    return np.concatenate([rgb, alpha], axis=1)
+
+
+def _interpolate_stops(locations: np.array, stops: List[ColorStop or TransparencyStop], value_fn,
+                       default: list) -> np.array:
+    """ Interpolate stop values at each location. Colors are mixed evenly at the midpoint a stop stores for the
+    stretch between the previous stop and itself. Locations before the first stop or after the last one take its
+    value.
+    """
+    stops = sorted(stops, key=lambda s: s.location)
+    if not stops:
+        return np.tile(np.array(default, dtype=np.float64), (len(locations), 1))
+
+    values = np.array([value_fn(stop) for stop in stops], dtype=np.float64)
+    result = np.empty((len(locations), values.shape[1]), dtype=np.float64)
+    result[:] = values[0]
+    for i in range(1, len(stops)):
+        start, end = stops[i - 1].location, stops[i].location
+        inside = locations >= start
+        if end <= start:
+            result[inside] = values[i]
+            continue
+        amount = np.clip((locations[inside] - start) / (end - start), 0, 1)
+        midpoint = min(max(stops[i].midpoint / 100, 0.01), 0.99)
+        amount = np.where(amount <= midpoint, amount / midpoint * 0.5, 0.5 + (amount - midpoint) / (1 - midpoint) * 0.5)
+        result[inside] = values[i - 1] + (values[i] - values[i - 1]) * amount[:, None]
+    return result
+
+
+def _pattern_tile(pattern: Pattern, scale: float, dtype: np.dtype) -> np.array:
+    """ Convert a pattern to an RGBA tile of a working type, resampled to scale (in percent) with nearest neighbors.
+    """
+    def to_working(plane: np.array) -> np.array:
+        return _to_dtype(to_float(plane), dtype)
+
+    if pattern.color_mode == "Indexed":
+        rgb = [to_working(plane) for plane in to_rgb("Indexed", pattern.planes, palette=pattern.palette)]
+    else:
+        rgb = list(to_rgb(pattern.color_mode, [to_working(plane) for plane in pattern.planes]))
+    if pattern.alpha is not None:
+        alpha = to_working(pattern.alpha)
+    else:
+        alpha = np.full(rgb[0].shape, channel_max(dtype), dtype=dtype)
+    tile = np.dstack(rgb + [alpha])
+
+    if scale != 100:
+        height, width = tile.shape[:2]
+        scaled_height = max(int(round(height * scale / 100)), 1)
+        scaled_width = max(int(round(width * scale / 100)), 1)
+        rows = np.arange(scaled_height) * height // scaled_height
+        columns = np.arange(scaled_width) * width // scaled_width
+        tile = tile[rows[:, None], columns[None, :]]
+    return np.ascontiguousarray(tile)
+
+
+def _to_dtype(values: np.array, dtype: np.dtype) -> np.array:
+    """ Convert 0-1 floats to a working type. """
+    if np.dtype(dtype) == np.uint8:
+        return np.around(values * channel_max(np.uint8)).astype(np.uint8)
+    return values.astype(dtype)
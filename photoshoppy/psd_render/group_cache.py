@@ -0,0 +1,60 @@
+""" Group composites shared between the render plans of one export.
+When every group of a file is exported, a nested group is composited for its own file, and again inside each of its
+ancestors. A GroupCache keeps each group's composite until all the ancestors that will use it have been rendered, so
+every group is only composited once.
+"""
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+
+from photoshoppy.models.layer.model import Layer
+
+
+class GroupCache:
+    """ Composites of groups rendered in isolation, keyed by group identity and whether lookup tables were used.
+    A composite is only kept if some ancestor is expected to use it, and it's dropped once every one of them has been
+    released. The cache is safe to share between threads.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._users = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def expect(self, group: Layer):
+        """ Record that one more ancestor of a group will be rendered with this cache. """
+        with self._lock:
+            self._users[id(group)] = self._users.get(id(group), 0) + 1
+
+    def put(self, group: Layer, use_luts: bool, image_data: np.array):
+        """ Store a group's composite, if anything still expects to use it. The image data must not be modified. """
+        with self._lock:
+            if self._users.get(id(group), 0) > 0:
+                image_data.flags.writeable = False
+                self._entries[(id(group), use_luts)] = image_data
+
+    def get(self, group: Layer, use_luts: bool) -> np.array or None:
+        with self._lock:
+            image_data = self._entries.get((id(group), use_luts))
+            if image_data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return image_data
+
+    def release(self, group: Layer):
+        """ Record that one of a group's ancestors is done. The group's composite is dropped after the last one. """
+        with self._lock:
+            users = self._users.get(id(group), 0) - 1
+            if users > 0:
+                self._users[id(group)] = users
+                return
+            self._users.pop(id(group), None)
+            for key in [key for key in self._entries if key[0] == id(group)]:
+                del self._entries[key]
@@ -0,0 +1,101 @@
+""" Occlusion culling for render plans.
+The canvas is split into tiles, and each tile is marked as covered once a fully opaque, unmasked, normal layer is
+known to hide it. Anything underneath a covered tile can't affect the result.
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from .blend_if import uses_blend_if
+from .compositing import channel_max
+from .render_utils import active_mask
+from photoshoppy.models.layer.model import Layer
+from photoshoppy.models.layer.layer_channel import CHANNEL_TRANSPARENCY_MASK
+from photoshoppy.utilities.rect import Rect, intersect_rects, rect_is_empty
+
+
+OCCLUSION_TILE_SIZE = 64
+
+
+class CoverageMap:
+    """ Tracks which tiles of a canvas are hidden under opaque layers. """
+    def __init__(self, width: int, height: int, tile_size: int = OCCLUSION_TILE_SIZE):
+        self._width = width
+        self._height = height
+        self._tile_size = tile_size
+        self._tiles = np.zeros((math.ceil(height / tile_size), math.ceil(width / tile_size)), dtype=np.bool_)
+
+    @property
+    def tile_size(self) -> int:
+        return self._tile_size
+
+    @property
+    def tiles(self) -> np.array:
+        return self._tiles
+
+    def copy(self) -> CoverageMap:
+        coverage = CoverageMap(self._width, self._height, self._tile_size)
+        coverage._tiles[:] = self._tiles
+        return coverage
+
+    def uncovered_bounds(self, window: Rect) -> Rect or None:
+        """ Shrink a window to the bounding box of its tiles that aren't covered. Returns None if all are covered. """
+        t = self.tile_size
+        top, left = window.top // t, window.left // t
+        bottom, right = math.ceil(window.bottom / t), math.ceil(window.right / t)
+
+        uncovered = ~self._tiles[top:bottom, left:right]
+        rows = np.flatnonzero(uncovered.any(axis=1))
+        if not len(rows):
+            return None
+        cols = np.flatnonzero(uncovered.any(axis=0))
+
+        bounds = Rect((top + rows[0]) * t, (left + cols[0]) * t, (top + rows[-1] + 1) * t, (left + cols[-1] + 1) * t)
+        return intersect_rects(window, bounds)
+
+    def add_opaque_pixels(self, opaque: np.array, window: Rect):
+        """ Cover the tiles that lie inside the window and are opaque at every pixel.
+        Tiles cut off by the edge of the canvas only need to be opaque where they're on the canvas.
+        """
+        t = self.tile_size
+        top = math.ceil(window.top / t)
+        left = math.ceil(window.left / t)
+        bottom = math.ceil(window.bottom / t) if window.bottom == self._height else window.bottom // t
+        right = math.ceil(window.right / t) if window.right == self._width else window.right // t
+        if bottom <= top or right <= left:
+            return
+
+        # Pad partial edge tiles so every tile has the same shape
+        opaque = opaque[top * t - window.top:, left * t - window.left:]
+        pad_y = (bottom - top) * t - opaque.shape[0]
+        pad_x = (right - left) * t - opaque.shape[1]
+        opaque = np.pad(opaque, ((0, max(0, pad_y)), (0, max(0, pad_x))), constant_values=True)
+        opaque = opaque[:(bottom - top) * t, :(right - left) * t]
+
+        tiles = opaque.reshape(bottom - top, t, right - left, t).all(axis=(1, 3))
+        self._tiles[top:bottom, left:right] |= tiles
+
+
+def is_occluder(layer: Layer, opacity: int) -> bool:
+    """ An occluder completely replaces whatever is underneath its opaque pixels. """
+    return (not layer.is_group and layer.blend_mode.name == "normal" and opacity == 255 and layer.fill == 255
+            and active_mask(layer) is None and not uses_blend_if(layer))
+
+
+def opaque_pixels(layer: Layer, window: Rect) -> np.array:
+    """ Return a boolean array of the layer's fully opaque pixels inside a window. """
+    shape = (window.bottom - window.top, window.right - window.left)
+    alpha = layer.get_channel(CHANNEL_TRANSPARENCY_MASK)
+    if alpha is None:
+        return np.ones(shape, dtype=np.bool_)
+
+    overlap = intersect_rects(window, layer.rect)
+    opaque = np.zeros(shape, dtype=np.bool_)
+    if not rect_is_empty(overlap):
+        data = alpha.read_rows(overlap.top - layer.rect.top, overlap.bottom - layer.rect.top)
+        data = data[:, overlap.left - layer.rect.left:overlap.right - layer.rect.left]
+        opaque[overlap.top - window.top:overlap.bottom - window.top,
+               overlap.left - window.left:overlap.right - window.left] = data >= channel_max(data.dtype)
+    return opaque
@@ -0,0 +1,212 @@
+""" Low-resolution proxies of layers, for fast previews.
+Proxies are box-filtered down by an integer factor, and stand in for layers in a scaled RenderPlan. They only have the
+parts of the Layer interface that executing a plan needs.
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from .compositing import working_dtype
+from .render_utils import active_mask
+from photoshoppy.models.layer.blending_ranges import BlendingRanges
+from photoshoppy.models.layer.model import Layer
+from photoshoppy.models.layer.layer_mask import LayerMask
+from photoshoppy.utilities.rect import Rect, rect_is_empty
+
+
+PROXY_SCALES = (1 / 2, 1 / 4, 1 / 8)
+
+
+class MaskProxy:
+    def __init__(self, mask: LayerMask, factor: int):
+        self._default_color = mask.default_color
+        self._default_value = mask.default_value
+        self._is_inverted = mask.is_inverted
+        self._rect = scale_rect(mask.rect, factor)
+        self._image_data = downsample(mask.image_data, mask.rect, factor, fill=mask.default_value)
+
+    @property
+    def rect(self) -> Rect:
+        return self._rect
+
+    @property
+    def default_color(self) -> int:
+        return self._default_color
+
+    @property
+    def default_value(self) -> int or float:
+        return self._default_value
+
+    @property
+    def is_disabled(self) -> bool:
+        return False
+
+    @property
+    def is_inverted(self) -> bool:
+        return self._is_inverted
+
+    @property
+    def image_data(self) -> np.array:
+        return self._image_data
+
+    def read_image_data(self, rect: Rect) -> np.array:
+        return self._image_data[rect.top - self._rect.top:rect.bottom - self._rect.top,
+                                rect.left - self._rect.left:rect.right - self._rect.left]
+
+
+class LayerProxy:
+    """ A layer downsampled by an integer factor. Only the layer's visible pixels are downsampled, and the layer's
+    full-size image data isn't cached along the way. Disabled masks are left out.
+    """
+    def __init__(self, layer: Layer, factor: int):
+        self._layer = layer
+        mask = active_mask(layer)
+        self._layer_mask = None if mask is None else MaskProxy(mask, factor)
+
+        rect = Rect(0, 0, 0, 0) if layer.is_group else layer.content_rect
+        self._rect = scale_rect(rect, factor)
+        if rect_is_empty(rect):
+            self._image_data = np.zeros((0, 0, 4), dtype=working_dtype(layer.depth))
+        else:
+            planes = [plane[rect.top - layer.rect.top:rect.bottom - layer.rect.top,
+                            rect.left - layer.rect.left:rect.right - layer.rect.left] for plane in layer.image_planes]
+            self._image_data = downsample_rgba(np.dstack(planes), rect, factor)
+        self._image_data.flags.writeable = False
+
+    @property
+    def layer(self) -> Layer:
+        return self._layer
+
+    @property
+    def name(self) -> str:
+        return self._layer.name
+
+    @property
+    def blend_mode(self):
+        return self._layer.blend_mode
+
+    @property
+    def opacity(self) -> int:
+        return self._layer.opacity
+
+    @property
+    def depth(self) -> int:
+        return self._layer.depth
+
+    @property
+    def color_mode(self) -> str:
+        return self._layer.color_mode
+
+    @property
+    def blending_ranges(self) -> BlendingRanges:
+        return self._layer.blending_ranges
+
+    @property
+    def is_group(self) -> bool:
+        return self._layer.is_group
+
+    @property
+    def rect(self) -> Rect:
+        return self._rect
+
+    @property
+    def content_rect(self) -> Rect:
+        return self._rect
+
+    @property
+    def layer_mask(self) -> MaskProxy or None:
+        return self._layer_mask
+
+    @property
+    def image_data(self) -> np.array:
+        return self._image_data
+
+    @property
+    def image_planes(self) -> tuple:
+        return tuple(self._image_data[:, :, i] for i in range(4))
+
+    def read_image_planes(self, rect: Rect, decode_rows: bool = True) -> tuple:
+        image_data = self._image_data[rect.top - self._rect.top:rect.bottom - self._rect.top,
+                                      rect.left - self._rect.left:rect.right - self._rect.left]
+        return tuple(image_data[:, :, i] for i in range(4))
+
+
+def scale_factor(scale: float) -> int:
+    """ Convert a scale like 1/4 to the integer factor pixels are downsampled by. """
+    if scale <= 0 or scale > 1:
+        raise ValueError(f"Scale must be between 0 and 1; got {scale}")
+    factor = round(1 / scale)
+    if not math.isclose(1 / scale, factor, rel_tol=1e-6):
+        raise ValueError(f"Scale must be 1 / n for a whole number n, like {', '.join(map(str, PROXY_SCALES))}; "
+                         f"got {scale}")
+    return factor
+
+
+def scale_rect(rect: Rect, factor: int) -> Rect:
+    """ Scale a rect down, growing it outward to whole proxy pixels. """
+    return Rect(rect.top // factor, rect.left // factor, -(-rect.bottom // factor), -(-rect.right // factor))
+
+
+def downsample(image_data: np.array, rect: Rect, factor: int, fill: int = 0) -> np.array:
+    """ Box filter a single channel down by an integer factor. The image is first padded with the fill value, so that
+    its pixels line up with the proxy pixel grid.
+    """
+    padded = _pad_to_grid(image_data, rect, factor, fill)
+    if image_data.dtype != np.uint8:
+        return (_block_sums(padded.astype(np.float64), factor) / (factor * factor)).astype(image_data.dtype)
+    sums = _block_sums(padded.astype(np.uint32), factor)
+    return ((sums + factor * factor // 2) // (factor * factor)).astype(np.uint8)
+
+
+def downsample_rgba(image_data: np.array, rect: Rect, factor: int) -> np.array:
+    """ Box filter RGBA image data. Colors are weighted by alpha, so transparent pixels don't bleed into the result.
+    """
+    padded = _pad_to_grid(image_data, rect, factor, fill=0)
+    if image_data.dtype != np.uint8:
+        return _downsample_rgba_float(padded, factor).astype(image_data.dtype)
+    alpha = padded[:, :, 3].astype(np.uint32)
+    premultiplied = np.empty(padded.shape, dtype=np.uint32)
+    np.multiply(padded[:, :, :3], alpha[:, :, None], out=premultiplied[:, :, :3])
+    premultiplied[:, :, 3] = alpha
+    sums = _block_sums(premultiplied, factor)
+
+    result = np.empty(sums.shape, dtype=np.uint8)
+    alpha_sums = sums[:, :, 3:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[:, :, :3] = np.where(alpha_sums > 0, (sums[:, :, :3] + alpha_sums // 2) // alpha_sums, 0)
+    result[:, :, 3] = (sums[:, :, 3] + factor * factor // 2) // (factor * factor)
+    return result
+
+
+def _downsample_rgba_float(padded: np.array, factor: int) -> np.array:
+    padded = padded.astype(np.float64)
+    premultiplied = padded.copy()
+    premultiplied[:, :, :3] *= padded[:, :, 3:]
+    sums = _block_sums(premultiplied, factor)
+    alpha_sums = sums[:, :, 3:]
+    result = np.empty(sums.shape, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[:, :, :3] = np.where(alpha_sums > 0, sums[:, :, :3] / alpha_sums, 0)
+    result[:, :, 3] = sums[:, :, 3] / (factor * factor)
+    return result
+
+
+def _block_sums(image_data: np.array, factor: int) -> np.array:
+    """ Sum each factor x factor block of pixels. Rows are summed first, then columns. """
+    height, width = image_data.shape[0] // factor, image_data.shape[1] // factor
+    rows = image_data.reshape(height, factor, *image_data.shape[1:]).sum(axis=1, dtype=image_data.dtype)
+    return rows.reshape(height, width, factor, *image_data.shape[2:]).sum(axis=2, dtype=image_data.dtype)
+
+
+def _pad_to_grid(image_data: np.array, rect: Rect, factor: int, fill: int) -> np.array:
+    scaled = scale_rect(rect, factor)
+    before_y = rect.top - scaled.top * factor
+    before_x = rect.left - scaled.left * factor
+    after_y = (scaled.bottom - scaled.top) * factor - image_data.shape[0] - before_y
+    after_x = (scaled.right - scaled.left) * factor - image_data.shape[1] - before_x
+    if not any([before_y, before_x, after_y, after_x]):
+        return image_data
+    padding = [(before_y, after_y), (before_x, after_x)] + [(0, 0)] * (image_data.ndim - 2)
+    return np.pad(image_data, padding, constant_values=fill)
@@ -1,105 +1,488 @@
+from __future__ import annotations
+
+import concurrent.futures
+import math
 import os
+import threading
+import time
+import tracemalloc
+from typing import Tuple
 
 import numpy as np
 from PIL import Image
 
-from . import render_utils
+from . import band_writers, color_conversion, tracing
+from .compositing import to_working_depth
+from .group_cache import GroupCache
+from .render_plan import OpType, RenderPlan
 from photoshoppy.psd_file import PSDFile
-from photoshoppy.utilities.layer import get_root_layer
+from photoshoppy.utilities.rect import Rect, intersect_rects, rect_is_empty, rect_height, rect_width
 from photoshoppy.utilities.string import clean_file_name
 
 
-def render_psd(psd: PSDFile, file_path: str, overwrite: bool = False):
-    """ Render the current PSD file. """
+class RenderStats:
+    """ Memory use of a render. Peak memory is only measured when a memory limit is given. """
+    def __init__(self, memory_limit: int or None, estimated_bytes: int, tile_size: int or None, tile_count: int,
+                 band_height: int or None = None):
+        self.memory_limit = memory_limit
+        self.estimated_bytes = estimated_bytes
+        self.tile_size = tile_size
+        self.tile_count = tile_count
+        self.band_height = band_height
+        self.peak_bytes = None
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return (f"RenderStats(estimated_bytes={self.estimated_bytes}, peak_bytes={self.peak_bytes}, "
+                f"tile_size={self.tile_size}, tile_count={self.tile_count}, band_height={self.band_height}, "
+                f"seconds={self.seconds:.3f})")
+
+
+def render_psd(psd: PSDFile, file_path: str, overwrite: bool = False, plan: RenderPlan or None = None,
+               use_luts: bool or None = None, memory_limit: int or None = None,
+               band_height: int or None = None, scale: float = 1.0,
+               region: Rect or None = None) -> RenderStats:
+    """ Render the current PSD file.
+    A RenderPlan compiled from the same file can be passed in to skip compiling it again. Its use_luts and region are
+    used as they are; ValueError is raised if different ones are given too.
+    If use_luts is True, separable blend modes are blended with lookup tables, which is faster but may differ from
+    the float blend functions by one 8-bit step.
+    If memory_limit is given (in bytes) and the render is estimated to need more, the canvas is composited in tiles
+    small enough to fit. MemoryError is raised before rendering starts if no tile size fits.
+    If band_height is given, the canvas is composited in horizontal bands of that many rows, and each band is encoded
+    while the next one is composited. Only PNG and TIFF files can be written this way (see band_writers).
+    A scale like 1/2, 1/4 or 1/8 renders a low-resolution preview from box-filtered copies of the layers.
+    16-bit and 32-bit documents are composited in float, and written as 16-bit PNG or TIFF files; give a .npy file path
+    to keep the float pixels as they are.
+    If region is given, only that part of the canvas is rendered, and the image is cropped to it. Open the PSDFile with
+    lazy_decode=True so that only the channel rows crossing the region are decoded.
+    """
     if overwrite is False and os.path.isfile(file_path):
         raise FileExistsError(file_path)
+    if band_height is not None and not band_writers.supports_bands(file_path):
+        raise ValueError(f"Can't render {file_path} in bands; only PNG and TIFF files are supported")
+
+    if plan is None:
+        with tracing.span("compile plan"):
+            plan = RenderPlan.from_psd(psd, use_luts=bool(use_luts), region=region)
+    else:
+        if use_luts is not None and use_luts != plan.use_luts:
+            raise ValueError(f"use_luts={use_luts} doesn't match the plan's use_luts={plan.use_luts}")
+        if region is not None and intersect_rects(region, plan.canvas) != plan.region:
+            raise ValueError(f"Region {region} doesn't match the plan's region {plan.region}")
+    if scale != 1:
+        with tracing.span("scale plan", scale=scale):
+            plan = plan.scaled(scale)
+
+    height, width = rect_height(plan.region), rect_width(plan.region)
+    if band_height is not None:
+        # One band is being encoded while the next is composited, and the encoder makes a copy of it
+        band_bytes = min(band_height, height) * width * 4 * plan.dtype.itemsize
+        estimate = plan.estimate_memory(band_height=band_height) + band_bytes * 2
+        if memory_limit is not None and estimate > memory_limit:
+            raise MemoryError(f"Rendering in {band_height} row bands needs an estimated {estimate} bytes; the memory "
+                              f"limit is {memory_limit} bytes")
+        stats = RenderStats(memory_limit, estimate, None, math.ceil(height / band_height), band_height)
+    else:
+        # Writing the image makes a copy of it
+        write_bytes = width * height * 4 * plan.dtype.itemsize
+        tile_size = None
+        if memory_limit is not None:
+            tile_size = plan.choose_tile_size(memory_limit, reserved_bytes=write_bytes)
+        tile_count = 1 if tile_size is None else len(plan.tiles(tile_size))
+        stats = RenderStats(memory_limit, plan.estimate_memory(tile_size) + write_bytes, tile_size, tile_count)
+
+    start = time.perf_counter()
+    with _PeakMemory(enabled=memory_limit is not None) as peak:
+        if band_height is not None:
+            _stream_image(plan, file_path, band_height)
+        else:
+            image_data = plan.execute(tile_size=stats.tile_size)
+            _write_image(image_data, file_path, "RGBA")
+    stats.peak_bytes = peak.bytes
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+class PSDTarget:
+    """ Export target for the whole document, rendered like render_psd. """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+
+class LayersTarget:
+    """ Export target for every layer, written to a folder like render_layers. """
+    def __init__(self, folder_path: str, extension: str = "png", skip_hidden_layers: bool = True,
+                 render_masks: bool = False):
+        self.folder_path = folder_path
+        self.extension = extension
+        self.skip_hidden_layers = skip_hidden_layers
+        self.render_masks = render_masks
+
+
+class GroupsTarget:
+    """ Export target for every group, written to a folder like render_groups. """
+    def __init__(self, folder_path: str, extension: str = "png", skip_hidden_groups: bool = True,
+                 render_masks: bool = False):
+        self.folder_path = folder_path
+        self.extension = extension
+        self.skip_hidden_groups = skip_hidden_groups
+        self.render_masks = render_masks
+
+
+def export(psd: PSDFile, targets: list, overwrite: bool = False, max_workers: int = 1,
+           compression_level: int or None = None):
+    """ Render several outputs of a PSD file in one pass. Targets are PSDTarget, LayersTarget and GroupsTarget objects.
+    Every image is composited once, however many targets need it, and encoded while the next one is composited. Groups
+    are composited before the groups and document that contain them, which reuse their pixels (see GroupCache), so
+    compositing the document along with its groups costs about as much as rendering the document alone; encoding each
+    extra file is the only added work.
+    With max_workers > 1, images are composited in parallel, and encoded on a separate pool of threads while others
+    are composited. The files are the same as a serial export's. compression_level (0-9) trades PNG encoding speed
+    for file size.
+    """
+    exporter = _Exporter(overwrite, max_workers, compression_level)
+
+    for target in targets:
+        if isinstance(target, LayersTarget):
+            _add_layers(exporter, psd, target)
 
-    root = get_root_layer(psd)
-    image_data = render_utils.flatten_group(group=root, psd=psd)
-    _write_image(image_data, file_path, "RGBA")
+    groups = {}
+    for target in targets:
+        if isinstance(target, GroupsTarget):
+            for group in psd.iter_groups():
+                if group.visible is True or target.skip_hidden_groups is False:
+                    groups[id(group)] = group
+    # Groups come after their children in the file, so a nested group's composite is cached before the groups and
+    #   document containing it use it, and dropped once they've all been rendered.
+    groups = [group for group in psd.iter_groups() if id(group) in groups]
+    psd_targets = [target for target in targets if isinstance(target, PSDTarget)]
+
+    with tracing.span("compile plan"):
+        plans = {id(group): RenderPlan.from_psd(psd, group=group) for group in groups}
+
+    # Each group's plan reads the cached composites of the nearest exported groups inside it; groups nested deeper
+    #   are skipped along with them, so only the nearest ones are kept for it.
+    group_cache = GroupCache()
+    descendants = {}
+    for group in groups:
+        descendants[id(group)] = _cached_groups(plans[id(group)], plans)
+    if psd_targets:
+        with tracing.span("compile plan"):
+            plan = RenderPlan.from_psd(psd)
+        descendants[None] = _cached_groups(plan, plans)
+    for cached_groups in descendants.values():
+        for descendant in cached_groups:
+            group_cache.expect(descendant)
+
+    for target in targets:
+        if isinstance(target, GroupsTarget):
+            _add_groups(exporter, psd, target, group_cache, plans, descendants)
+    for target in psd_targets:
+        exporter.add(target.file_path, "RGBA", _group_image_data, plan, None, group_cache, descendants[None])
+
+    exporter.run()
 
 
 def render_layers(psd: PSDFile, folder_path: str, extension: str = "png", overwrite: bool = False,
-                  skip_hidden_layers: bool = True, render_masks: bool = False):
-    """ Render each layer of a PSD file to a folder. """
-    ext = extension.strip(".")
+                  skip_hidden_layers: bool = True, render_masks: bool = False, max_workers: int = 1,
+                  compression_level: int or None = None):
+    """ Render each layer of a PSD file to a folder.
+    With max_workers > 1, layers are composited in parallel, and encoded on a separate pool of threads while others
+    are composited. The files are the same as a serial export's. compression_level (0-9) trades PNG encoding speed
+    for file size.
+    """
+    target = LayersTarget(folder_path, extension, skip_hidden_layers, render_masks)
+    export(psd, [target], overwrite=overwrite, max_workers=max_workers, compression_level=compression_level)
+
+
+def render_groups(psd: PSDFile, folder_path: str, extension: str = "png", overwrite: bool = False,
+                  skip_hidden_groups: bool = True, render_masks: bool = False, max_workers: int = 1,
+                  compression_level: int or None = None):
+    """ Render each group of a PSD file to a folder.
+    With max_workers > 1, groups are composited in parallel, and encoded on a separate pool of threads while others
+    are composited. The files are the same as a serial export's. compression_level (0-9) trades PNG encoding speed
+    for file size.
+    """
+    target = GroupsTarget(folder_path, extension, skip_hidden_groups, render_masks)
+    export(psd, [target], overwrite=overwrite, max_workers=max_workers, compression_level=compression_level)
+
+
+def render_image_data(psd: PSDFile, file_path: str, overwrite: bool = False):
+    """ Render the image data from a PSD file as an image.
+    This is the flattened representation of the document when it was last saved.
+    """
+    if overwrite is False and os.path.isfile(file_path):
+        raise FileExistsError(file_path)
+
+    image_data, mode = _convert_color_mode(psd)
+    _write_image(image_data, file_path, mode)
+
+
+def _write_image(image_data: np.ndarray, file_path, mode: str, compression_level: int or None = None):
+    """ Encode an image. compression_level (0-9) only applies to PNG files; by default PIL uses 6.
+    .npy files store the image data unchanged. Other than that, 16-bit and float images are written with 16 bits per
+    channel, which only PNG and TIFF files support.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    with tracing.span("write image", file_path=file_path):
+        if ext == ".npy":
+            np.save(file_path, image_data)
+            return
+        if image_data.dtype == np.uint16 or image_data.dtype.kind == "f":
+            _write_16_bit_image(image_data, file_path, mode, compression_level)
+            return
+
+        image = Image.fromarray(image_data, mode=mode)
+        options = {}
+        if compression_level is not None and ext == ".png":
+            options["compress_level"] = compression_level
+        image.save(file_path, **options)
+
+
+def _write_16_bit_image(image_data: np.ndarray, file_path, mode: str, compression_level: int or None = None):
+    if not band_writers.supports_bands(file_path):
+        raise ValueError(f"Can't write 16-bit image data to {file_path}; only PNG, TIFF and NPY files are supported")
+    image_data = _to_uint16(image_data)
+    if mode == "L":
+        # PIL writes single channel 16-bit images; color ones go through a band writer
+        Image.fromarray(image_data, mode="I;16").save(file_path)
+        return
+    if mode == "RGB":
+        image_data = np.dstack([image_data, np.full(image_data.shape[:2], 65535, dtype=np.uint16)])
+
+    height, width = image_data.shape[:2]
+    level = 6 if compression_level is None else compression_level
+    with band_writers.open_band_writer(file_path, width, height, level, bit_depth=16) as writer:
+        writer.write_band(image_data)
+
+
+def _to_uint16(image_data: np.ndarray) -> np.ndarray:
+    """ Quantize float image data in a 0-1 range to 16 bits. """
+    if image_data.dtype == np.uint16:
+        return image_data
+    image_data = np.clip(image_data, 0, 1) * 65535
+    return np.around(image_data, out=image_data).astype(np.uint16)
+
+
+def _add_layers(exporter: _Exporter, psd: PSDFile, target: LayersTarget):
+    ext = target.extension.strip(".")
     for layer in psd.iter_layers():
-        if layer.visible is False and skip_hidden_layers is True:
+        if layer.visible is False and target.skip_hidden_layers is True:
             continue
 
         layer_name = clean_file_name(layer.name)
-        layer_path = os.path.join(folder_path, f"{layer_name}.{ext}")
-        if overwrite is False and os.path.isfile(layer_path):
-            raise FileExistsError(layer_path)
+        layer_path = os.path.join(target.folder_path, f"{layer_name}.{ext}")
 
         if len(layer.channels) == 3:
             mode = "RGB"
         else:
             mode = "RGBA"
 
-        _write_image(layer.image_data, layer_path, mode)
+        exporter.add(layer_path, mode, _layer_image_data, layer)
 
-        if render_masks:
+        if target.render_masks:
             if layer.layer_mask is not None:
-                mask_path = os.path.join(folder_path, f"{layer_name}_mask.{ext}")
-                _write_image(layer.layer_mask.image_data, mask_path, "L")
+                mask_path = os.path.join(target.folder_path, f"{layer_name}_mask.{ext}")
+                exporter.add(mask_path, "L", _mask_image_data, layer)
 
 
-def render_groups(psd: PSDFile, folder_path: str, extension: str = "png", overwrite: bool = False,
-                  skip_hidden_groups: bool = True, render_masks: bool = False):
-    """ Render each group of a PSD file to a folder. """
-    ext = extension.strip(".")
+def _add_groups(exporter: _Exporter, psd: PSDFile, target: GroupsTarget, group_cache: GroupCache, plans: dict,
+                descendants: dict):
+    ext = target.extension.strip(".")
     for group in psd.iter_groups():
-        if group.visible is False and skip_hidden_groups is True:
+        if group.visible is False and target.skip_hidden_groups is True:
             continue
 
         group_name = clean_file_name(group.name)
-        group_path = os.path.join(folder_path, f"{group_name}.{ext}")
-        if overwrite is False and os.path.isfile(group_path):
-            raise FileExistsError(group_path)
-
-        group_image_data = render_utils.composite_group(group=group, psd=psd, bg=None)
-        _write_image(group_image_data, group_path, "RGBA")
+        group_path = os.path.join(target.folder_path, f"{group_name}.{ext}")
+        exporter.add(group_path, "RGBA", _group_image_data, plans[id(group)], group, group_cache,
+                     descendants[id(group)])
 
-        if render_masks:
+        if target.render_masks:
             if group.layer_mask is not None:
-                mask_path = os.path.join(folder_path, f"{group_name}_mask.{ext}")
-                _write_image(group.layer_mask.image_data, mask_path, "L")
+                mask_path = os.path.join(target.folder_path, f"{group_name}_mask.{ext}")
+                exporter.add(mask_path, "L", _mask_image_data, group)
 
 
-def render_image_data(psd: PSDFile, file_path: str, overwrite: bool = False):
-    """ Render the image data from a PSD file as an image.
-    This is the flattened representation of the document when it was last saved.
+def _layer_image_data(layer) -> np.ndarray:
+    # Layers are exported trimmed to their visible pixels, unless there aren't any
+    if rect_is_empty(layer.content_rect):
+        return layer.image_data
+    return layer.content_image_data
+
+
+def _cached_groups(plan: RenderPlan, group_ids) -> list:
+    """ The outermost groups in a plan that are composited on their own, and whose composites it can reuse. """
+    groups = []
+    cached = []  # For each group op the plan is inside, whether its composite is reused
+    for op in plan.ops:
+        if op.op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+            reused = op.op_type == OpType.BeginGroup and id(op.layer) in group_ids and not any(cached)
+            if reused:
+                groups.append(op.layer)
+            cached.append(reused)
+        elif op.op_type == OpType.EndGroup:
+            cached.pop()
+    return groups
+
+
+def _group_image_data(plan: RenderPlan, group, group_cache: GroupCache, descendants: list) -> np.ndarray:
+    """ Composite a group's plan, or the whole document's if group is None, and release the cached groups it
+    contains.
     """
-    if overwrite is False and os.path.isfile(file_path):
-        raise FileExistsError(file_path)
+    image_data = plan.execute(group_cache=group_cache)
+    if group is not None:
+        group_cache.put(group, plan.use_luts, image_data)
+    for descendant in descendants:
+        group_cache.release(descendant)
+    return image_data
+
+
+def _mask_image_data(layer) -> np.ndarray:
+    return layer.layer_mask.image_data
+
+
+class _Exporter:
+    """ Composites images and writes them to files.
+    Images with the same composite function and arguments are only composited once, and written to each of their
+    files. If two images have the same path, only the last one is written, as if the earlier one had been overwritten.
+    Images are encoded on a background thread while the next one is composited. With max_workers > 1, images are
+    composited on a pool of that many threads, and encoded on a second pool of the same size. At most max_workers
+    finished composites wait to be encoded, so fast compositing can't fill memory with images. Both numpy and PIL's
+    encoders release the GIL for most of their work.
+    """
+    def __init__(self, overwrite: bool, max_workers: int = 1, compression_level: int or None = None):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1; got {max_workers}")
+        if compression_level is not None and not 0 <= compression_level <= 9:
+            raise ValueError(f"compression_level must be between 0 and 9; got {compression_level}")
+        self._overwrite = overwrite
+        self._max_workers = max_workers
+        self._compression_level = compression_level
+        self._jobs = {}
+
+    def add(self, file_path: str, mode: str, composite, *args):
+        """ Queue an image to export. composite(*args) returns its image data. """
+        if self._overwrite is False and (os.path.isfile(file_path) or file_path in self._jobs):
+            raise FileExistsError(file_path)
+        self._jobs.pop(file_path, None)
+        self._jobs[file_path] = (mode, composite, args)
+
+    def run(self):
+        images = {}
+        for file_path, (mode, composite, args) in self._jobs.items():
+            key = (composite, tuple(id(arg) for arg in args))
+            images.setdefault(key, (composite, args, []))[2].append((file_path, mode))
+
+        if self._max_workers == 1:
+            # Each image is encoded on a background thread while the next one is composited
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as encode_pool:
+                pending = None
+                for composite, args, outputs in images.values():
+                    image_data = composite(*args)
+                    if pending is not None:
+                        pending.result()
+                    pending = encode_pool.submit(self._write_images, image_data, outputs)
+                if pending is not None:
+                    pending.result()
+            return
 
-    mode = _convert_color_mode(psd)
-    _write_image(psd.image_data, file_path, mode)
+        pending = threading.BoundedSemaphore(self._max_workers)
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as composite_pool, \
+                concurrent.futures.ThreadPoolExecutor(self._max_workers) as encode_pool:
 
+            def composite_job(composite, args, outputs: list) -> concurrent.futures.Future:
+                pending.acquire()
+                try:
+                    image_data = composite(*args)
+                    future = encode_pool.submit(self._write_images, image_data, outputs)
+                except BaseException:
+                    pending.release()
+                    raise
+                future.add_done_callback(lambda _: pending.release())
+                return future
 
-def _write_image(image_data: np.ndarray, file_path, mode: str):
-    image = Image.fromarray(image_data, mode=mode)
-    image.save(file_path)
+            composites = [composite_pool.submit(composite_job, *image) for image in images.values()]
+            try:
+                for future in composites:
+                    future.result().result()
+            except BaseException:
+                for future in composites:
+                    future.cancel()
+                raise
 
+    def _write_images(self, image_data: np.ndarray, outputs: list):
+        for file_path, mode in outputs:
+            _write_image(image_data, file_path, mode, self._compression_level)
 
-def _convert_color_mode(psd: PSDFile) -> str:
-    """ Convert Photoshop color mode to PIL mode. """
+
+def _stream_image(plan: RenderPlan, file_path: str, band_height: int):
+    """ Composite a plan in bands, and encode them on a background thread so encoding overlaps compositing.
+    At most one band waits to be encoded while the next one is composited.
+    """
+    bit_depth = 8 if plan.dtype == np.uint8 else 16
+    with band_writers.open_band_writer(file_path, rect_width(plan.region), rect_height(plan.region),
+                                       bit_depth=bit_depth) as writer, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for _, image_data in plan.execute_bands(band_height):
+            if bit_depth == 16:
+                image_data = _to_uint16(image_data)
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(writer.write_band, image_data)
+        if pending is not None:
+            pending.result()
+
+
+def _convert_color_mode(psd: PSDFile) -> Tuple[np.ndarray, str]:
+    """ Convert the merged image data to something PIL can write, and return it with its PIL mode.
+    Bitmap, grayscale and RGB images are written as they are. Other color modes are converted to RGB, and the first
+    channel after the color channels is used as alpha.
+    """
     ps_to_pil_mode = {
         'Bitmap': "1",
         'Grayscale': "L",
-        'Indexed': None,
         'RGB': "RGB",
-        'CMYK': "CMYK",
-        'Multichannel': None,
-        'Duotone': None,
-        'Lab': "LAB",
     }
-    mode = ps_to_pil_mode[psd.color_mode]
-    if mode is None:
-        raise NotImplementedError(f"Color mode not supported: {psd.color_mode}")
+    mode = ps_to_pil_mode.get(psd.color_mode)
+    if mode is not None:
+        if mode == "RGB" and psd.channels == 4:
+            mode = "RGBA"
+        return psd.image_data, mode
+
+    count = color_conversion.color_channel_count(psd.color_mode)
+    planes = [psd.image_data[:, :, i] for i in range(psd.channels)]
+    if psd.color_mode != "Indexed":
+        planes = [to_working_depth(plane) for plane in planes]
+    rgb = color_conversion.to_rgb(psd.color_mode, planes, palette=psd.palette)
+    if psd.channels > count:
+        return np.dstack(rgb + (planes[count],)), "RGBA"
+    return np.dstack(rgb), "RGB"
+
+
+class _PeakMemory:
+    """ Measure the peak memory allocated inside a with block, using tracemalloc. """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.bytes = None
+        self._start = 0
+        self._started_tracing = False
 
-    if mode == "RGB" and psd.channels == 4:
-        mode = "RGBA"
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        # If something else is already tracing, its peak is left alone, so ours may be overstated
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = tracemalloc.get_traced_memory()[0]
+        return self
 
-    return mode
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.enabled:
+            return
+        self.bytes = tracemalloc.get_traced_memory()[1] - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
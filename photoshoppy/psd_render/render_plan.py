@@ -0,0 +1,665 @@
+from __future__ import annotations
+
+import enum
+from typing import Generator, List, Tuple
+
+import numpy as np
+
+from . import adjustments, blend_if, blend_luts, fills, proxy, render_utils, tracing, vector_masks
+from .compositing import channel_max, working_dtype
+from .group_cache import GroupCache
+from .occlusion import CoverageMap, is_occluder, opaque_pixels
+from .scratch import get_scratch_pool
+from photoshoppy.models.blend_mode.model import BlendMode
+from photoshoppy.models.layer.layer_channel import CHANNEL_TRANSPARENCY_MASK, CHANNEL_USER_LAYER_MASK
+from photoshoppy.models.layer.model import Layer
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.utilities.rect import (Rect, intersect_rects, union_rects, rect_is_empty, rect_area, rect_height,
+                                       rect_width)
+
+
+# Rough per-pixel cost of each blend mode, relative to "normal". Only used to estimate the cost of a plan.
+BLEND_MODE_COSTS = {
+    'normal': 1.0,
+    'darken': 1.1,
+    'multiply': 1.1,
+    'lighten': 1.1,
+    'screen': 1.2,
+    'linear dodge': 1.2,
+    'linear burn': 1.3,
+    'difference': 1.2,
+    'exclusion': 1.3,
+    'subtract': 1.2,
+    'color burn': 1.6,
+    'color dodge': 1.6,
+    'divide': 1.6,
+    'overlay': 1.5,
+    'hard light': 1.5,
+    'soft light': 2.0,
+    'vivid light': 2.2,
+    'linear light': 1.8,
+    'pin light': 1.8,
+    'hard mix': 1.6,
+    'darker color': 1.5,
+    'lighter color': 1.5,
+    'hue': 3.5,
+    'saturation': 3.5,
+    'color': 2.5,
+    'luminosity': 2.5,
+}
+
+# Cost of clearing or copying a buffer, relative to a normal blend.
+BUFFER_OP_COST = 0.1
+
+# Peak bytes allocated per pixel while compositing one op, measured with tracemalloc. Includes the window copies of
+#   the layer and mask, and the composited result.
+FLOAT_BLEND_BYTES_PER_PIXEL = 272
+LUT_BLEND_BYTES_PER_PIXEL = 64
+
+# Tile sizes tried when a plan doesn't fit in memory, largest first.
+TILE_SIZES = (4096, 2048, 1024, 512, 256, 128, 64)
+
+
+class OpType(enum.Enum):
+    BeginGroup = 0  # Clear a buffer for an isolated group
+    BeginPassThrough = 1  # Copy the parent buffer for a pass-through group that can't be collapsed
+    Layer = 2  # Composite a layer into a buffer
+    EndGroup = 3  # Composite a group buffer into its parent buffer
+    Adjustment = 4  # Adjust the colors of a buffer in place
+
+
+class RenderOp:
+    """ A single compositing step of a RenderPlan.
+    Ops read from the `source` buffer and write to the `target` buffer, and only touch pixels inside `window`.
+    Adjustment ops apply `adjustment` to the target buffer; see adjustments.build_adjustment. Layer ops of fill layers
+    generate their pixels with `fill`; see fills.build_fill. Ops of layers and groups with a vector mask are masked by
+    `vector_mask` too.
+    """
+    def __init__(self, op_type: OpType, layer: Layer, target: int, window: Rect, source: int or None = None,
+                 blend_mode: BlendMode or None = None, opacity: int = 255,
+                 adjustment: adjustments.ChannelLUT or adjustments.HueSaturationAdjustment or None = None,
+                 fill: fills.SolidColorGenerator or fills.GradientGenerator or fills.PatternGenerator or None = None,
+                 vector_mask: vector_masks.RasterizedVectorMask or None = None):
+        self.op_type = op_type
+        self.layer = layer
+        self.target = target
+        self.source = source
+        self.window = window
+        self.blend_mode = blend_mode
+        self.opacity = opacity
+        self.adjustment = adjustment
+        self.fill = fill
+        self.vector_mask = vector_mask
+
+    @property
+    def has_mask(self) -> bool:
+        return self.op_type in [OpType.Layer, OpType.EndGroup, OpType.Adjustment] and \
+            (render_utils.active_mask(self.layer) is not None or self.vector_mask is not None)
+
+    @property
+    def cost(self) -> float:
+        """ Estimated cost of this op, in normal-blend pixel equivalents. """
+        area = rect_area(self.window)
+        if self.op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+            return area * BUFFER_OP_COST
+        return area * BLEND_MODE_COSTS.get(self.blend_mode.name, 1.0)
+
+    def shift_buffers(self, offset: int):
+        self.target += offset
+        if self.source is not None:
+            self.source += offset
+
+    def __repr__(self):
+        return f"RenderOp({self.op_type.name}, '{self.layer.name}', target={self.target}, source={self.source})"
+
+
+class RenderPlan:
+    """ A flat list of compositing ops compiled from a PSD layer tree.
+    Compiling drops layers that can't affect the result and collapses groups that don't need their own buffer.
+    A plan only references layers, so it can be executed any number of times.
+    If use_luts is True, separable blend modes are blended with lookup tables (see blend_luts). Lookup tables only
+    cover 8-bit pixels; 16-bit and 32-bit documents are composited in float32 buffers, and always use float math.
+    """
+    def __init__(self, width: int, height: int, use_luts: bool = False, depth: int = 8):
+        self._width = width
+        self._height = height
+        self._use_luts = use_luts
+        self._depth = depth
+        self._ops = []
+        self._buffer_count = 1
+        self._region = None
+        self._patterns = {}
+        self._vector_masks = {}
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def ops(self) -> List[RenderOp]:
+        return self._ops
+
+    @property
+    def use_luts(self) -> bool:
+        return self._use_luts
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def dtype(self) -> np.dtype:
+        """ The type of the plan's buffers, and of the image it renders. """
+        return working_dtype(self._depth)
+
+    @property
+    def buffer_count(self) -> int:
+        """ Number of canvas-sized buffers needed to execute the plan. """
+        return self._buffer_count
+
+    @property
+    def cost(self) -> float:
+        return sum(op.cost for op in self.ops)
+
+    @property
+    def canvas(self) -> Rect:
+        return Rect(0, 0, self.height, self.width)
+
+    @property
+    def region(self) -> Rect:
+        """ The part of the canvas the plan renders. Defaults to the whole canvas. """
+        return self.canvas if self._region is None else self._region
+
+    @classmethod
+    def from_psd(cls, psd: PSDFile, group: Layer or None = None, use_luts: bool = False,
+                 cull_occluded: bool = True, region: Rect or None = None) -> RenderPlan:
+        """ Compile a plan for a whole PSD file, or for a single group rendered in isolation.
+        If cull_occluded is True, ops hidden under opaque normal layers are dropped. With a lazily decoded PSDFile, the
+        channels of dropped layers are never decoded.
+        If region is given, only that part of the canvas is rendered. With a lazily decoded PSDFile, only the rows of
+        each channel that cross the region are decoded.
+        """
+        if group is None:
+            layers = [layer for layer in psd.layers if layer.parent is None and not layer.is_bounding_section_divider]
+        else:
+            layers = group.children
+
+        plan = cls(psd.width, psd.height, use_luts=use_luts, depth=psd.depth)
+        plan._patterns = psd.patterns
+        if region is not None:
+            plan._region = intersect_rects(region, plan.canvas)
+            if rect_is_empty(plan._region):
+                raise ValueError(f"Region {region} is outside the canvas")
+        plan._ops, _ = plan._compile_layers(layers, target=0)
+        if cull_occluded:
+            plan._cull_occluded_ops()
+        plan._buffer_count = max([op.target + 1 for op in plan.ops] + [1])
+        return plan
+
+    def scaled(self, scale: float) -> RenderPlan:
+        """ Return a plan that renders a low-resolution proxy, at a scale like 1/2, 1/4 or 1/8.
+        Every layer and mask is box filtered down before compositing, so the cost drops with the square of the scale.
+        """
+        factor = proxy.scale_factor(scale)
+        if factor == 1:
+            return self
+
+        plan = RenderPlan(-(-self.width // factor), -(-self.height // factor), use_luts=self.use_luts,
+                          depth=self.depth)
+        if self._region is not None:
+            plan._region = intersect_rects(proxy.scale_rect(self._region, factor), plan.canvas)
+        proxies = {}
+        for op in self.ops:
+            if id(op.layer) not in proxies:
+                proxies[id(op.layer)] = proxy.LayerProxy(op.layer, factor)
+            window = intersect_rects(proxy.scale_rect(op.window, factor), plan.canvas)
+            fill = op.fill.scaled(factor) if op.fill is not None else None
+            vector_mask = op.vector_mask.scaled(factor) if op.vector_mask is not None else None
+            plan._ops.append(RenderOp(op.op_type, proxies[id(op.layer)], target=op.target, window=window,
+                                      source=op.source, blend_mode=op.blend_mode, opacity=op.opacity,
+                                      adjustment=op.adjustment, fill=fill, vector_mask=vector_mask))
+        plan._buffer_count = self._buffer_count
+        return plan
+
+    def execute(self, tile_size: int or None = None, group_cache: GroupCache or None = None) -> np.array:
+        """ Run the plan. Returns the composited RGBA image of the plan's region.
+        If tile_size is given, the region is composited one tile at a time, so the group buffers and blend temporaries
+        only ever cover a single tile.
+        If a group_cache is given, groups that have already been composited are copied from it instead of being
+        composited again.
+        If a tracing.Tracer is active, a span is recorded for every layer and group.
+        Blend temporaries come from the thread's scratch pool, which is reused from op to op and tile to tile, and
+        freed once the plan has run.
+        """
+        region = self.region
+        with get_scratch_pool().held():
+            if tile_size is None:
+                if self._region is None:
+                    return self._execute_region(region, cache_layers=True, group_cache=group_cache)
+                return self._execute_region(region, cache_layers=False, decode_rows=True, group_cache=group_cache)
+
+            image_data = np.zeros((rect_height(region), rect_width(region), 4), dtype=self.dtype)
+            for tile in self.tiles(tile_size):
+                with tracing.span("tile", window=list(tile)):
+                    image_data[tile.top - region.top:tile.bottom - region.top,
+                               tile.left - region.left:tile.right - region.left] = self._execute_region(
+                        tile, cache_layers=False, decode_rows=self._region is not None, group_cache=group_cache)
+            return image_data
+
+    def execute_bands(self, band_height: int) -> Generator[Tuple[Rect, np.array], None, None]:
+        """ Run the plan one horizontal band of its region at a time, top to bottom. Yields each band's rect and image
+        data. Only the rows of each channel that cross a band are decoded for it.
+        """
+        region = self.region
+        with get_scratch_pool().held():
+            for top in range(region.top, region.bottom, band_height):
+                band = Rect(top, region.left, min(top + band_height, region.bottom), region.right)
+                with tracing.span("band", window=list(band)):
+                    image_data = self._execute_region(band, cache_layers=False, decode_rows=True)
+                yield band, image_data
+
+    def tiles(self, tile_size: int) -> List[Rect]:
+        """ Split the region into tiles, row by row. Tiles on the right and bottom edges may be smaller. """
+        r = self.region
+        return [Rect(top, left, min(top + tile_size, r.bottom), min(left + tile_size, r.right))
+                for top in range(r.top, r.bottom, tile_size) for left in range(r.left, r.right, tile_size)]
+
+    def estimate_memory(self, tile_size: int or None = None, band_height: int or None = None) -> int:
+        """ Estimate the peak bytes allocated by execute() or, if band_height is given, by iterating execute_bands().
+        Channel data that's already decoded isn't counted.
+        """
+        height, width = rect_height(self.region), rect_width(self.region)
+        pixel_bytes = 4 * self.dtype.itemsize
+        if band_height is not None:
+            region_area = min(band_height, height) * width
+            layer_bytes = 0
+        elif tile_size is not None:
+            region_area = min(tile_size, height) * min(tile_size, width)
+            # Tiles are copied into a separate image
+            layer_bytes = height * width * pixel_bytes
+        elif self._region is not None:
+            region_area = height * width
+            # Layers are interleaved one op window at a time
+            layer_bytes = region_area * pixel_bytes
+        else:
+            region_area = height * width
+            # Layers are interleaved into cached RGBA image data
+            layers = {id(op.layer): op.layer for op in self.ops if op.op_type == OpType.Layer}
+            layer_bytes = sum(rect_area(layer.rect) * pixel_bytes for layer in layers.values())
+
+        buffer_bytes = self.buffer_count * region_area * pixel_bytes
+        op_bytes = max([self._op_memory(op, region_area) for op in self.ops] + [0])
+        return buffer_bytes + op_bytes + layer_bytes
+
+    def choose_tile_size(self, memory_limit: int, reserved_bytes: int = 0) -> int or None:
+        """ Return the largest tile size that keeps the estimated memory, plus any reserved bytes, within a limit.
+        Returns None if the plan fits without tiling, and raises MemoryError if even the smallest tiles don't fit.
+        """
+        if self.estimate_memory() + reserved_bytes <= memory_limit:
+            return None
+        for tile_size in TILE_SIZES:
+            if tile_size < max(rect_width(self.region), rect_height(self.region)) and \
+                    self.estimate_memory(tile_size) + reserved_bytes <= memory_limit:
+                return tile_size
+        smallest = self.estimate_memory(TILE_SIZES[-1]) + reserved_bytes
+        raise MemoryError(f"Rendering needs an estimated {smallest} bytes even with {TILE_SIZES[-1]}px tiles; "
+                          f"the memory limit is {memory_limit} bytes")
+
+    def _execute_region(self, region: Rect, cache_layers: bool, decode_rows: bool = False,
+                        group_cache: GroupCache or None = None) -> np.array:
+        """ Run the plan for part of the canvas. Buffers only cover the region, so op windows are offset into it.
+        If cache_layers is True, whole layers are interleaved and cached. If decode_rows is True, channels that haven't
+        been decoded yet only have the rows inside the region decoded.
+        """
+        height, width = rect_height(region), rect_width(region)
+        with tracing.span("allocate buffers", buffers=self.buffer_count):
+            buffers = [np.zeros((height, width, 4), dtype=self.dtype) for _ in range(self.buffer_count)]
+
+        i = 0
+        while i < len(self.ops):
+            op = self.ops[i]
+            i += 1
+            w = intersect_rects(op.window, region)
+            if rect_is_empty(w):
+                continue
+            b = Rect(w.top - region.top, w.left - region.left, w.bottom - region.top, w.right - region.left)
+
+            target = buffers[op.target][b.top:b.bottom, b.left:b.right]
+            if op.op_type == OpType.Adjustment:
+                tracing.begin_span(op.layer.name, "adjustment", **_span_attributes(op))
+                with tracing.span("mask"):
+                    pieces = render_utils.mask_to_windows(op.layer, w, decode_rows=decode_rows,
+                                                          vector_mask=op.vector_mask)
+                for piece, mask in pieces:
+                    bg = target[piece.top - w.top:piece.bottom - w.top, piece.left - w.left:piece.right - w.left]
+                    with tracing.span("adjust"):
+                        adjusted = op.adjustment.apply(bg)
+                    if blend_if.uses_blend_if(op.layer):
+                        with tracing.span("blend if"):
+                            mask = blend_if.apply_blend_if(op.layer, adjusted, bg, mask)
+                    with tracing.span("composite"):
+                        adjustments.composite_adjustment(adjusted, bg, op.blend_mode, mask, op.opacity)
+                tracing.end_span()
+            elif op.op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+                tracing.begin_span(op.layer.name, "group", **_span_attributes(op))
+                cached = None
+                if op.op_type == OpType.BeginGroup and group_cache is not None:
+                    cached = group_cache.get(op.layer, self.use_luts)
+                if cached is not None:
+                    # A group's buffer holds its children composited over transparency, which is what rendering the
+                    #   group on its own produces. Skip ahead to the group's EndGroup op.
+                    with tracing.span("group cache"):
+                        target[:] = cached[w.top:w.bottom, w.left:w.right]
+                    i = self._group_end_index(i - 1)
+                elif op.op_type == OpType.BeginGroup:
+                    target[:] = 0
+                else:
+                    target[:] = buffers[op.source][b.top:b.bottom, b.left:b.right]
+            else:
+                if op.op_type == OpType.Layer:
+                    tracing.begin_span(op.layer.name, "layer", **_span_attributes(op))
+                    with tracing.span("screen space"):
+                        if op.fill is not None:
+                            fg = op.fill.render(w)
+                        elif cache_layers:
+                            fg = render_utils.layer_to_window(op.layer, w)
+                        else:
+                            fg = render_utils.layer_planes_to_window(op.layer, w, decode_rows=decode_rows)
+                else:
+                    fg = buffers[op.source][b.top:b.bottom, b.left:b.right]
+                with tracing.span("mask"):
+                    pieces = render_utils.mask_to_windows(op.layer, w, decode_rows=decode_rows,
+                                                          vector_mask=op.vector_mask)
+                for piece, mask in pieces:
+                    p = Rect(piece.top - w.top, piece.left - w.left, piece.bottom - w.top, piece.right - w.left)
+                    fg_piece = fg[p.top:p.bottom, p.left:p.right]
+                    bg = target[p.top:p.bottom, p.left:p.right]
+                    if blend_if.uses_blend_if(op.layer):
+                        with tracing.span("blend if"):
+                            mask = blend_if.apply_blend_if(op.layer, fg_piece, bg, mask)
+                    render_utils.composite_image_data(
+                        fg=fg_piece,
+                        bg=bg,
+                        blend_mode=op.blend_mode,
+                        mask=mask,
+                        opacity=op.opacity,
+                        use_lut=self.use_luts,
+                        out=bg,
+                        origin=(piece.top, piece.left))
+                tracing.end_span()
+
+        return buffers[0]
+
+    def _op_memory(self, op: RenderOp, region_area: int) -> int:
+        if op.op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+            return 0
+        area = min(rect_area(op.window), region_area)
+        if self.use_luts and op.blend_mode.name in blend_luts.SEPARABLE_BLEND_MODES:
+            return area * LUT_BLEND_BYTES_PER_PIXEL
+        return area * FLOAT_BLEND_BYTES_PER_PIXEL
+
+    def explain(self) -> str:
+        """ Return a human-readable summary of the plan, with the estimated cost of each op. """
+        lines = [f"RenderPlan {self.width}x{self.height}: {len(self.ops)} ops, {self.buffer_count} buffers, "
+                 f"estimated cost {self.cost / 1e6:.3f} Mpix",
+                 f"{'#':>4}  {'op':<16} {'layer':<24} {'src':>3} {'dst':>3}  {'window':<22} {'blend mode':<13} "
+                 f"{'opacity':>7}  {'mask':<4} {'Mpix':>7}"]
+        for i, op in enumerate(self.ops):
+            w = op.window
+            window = f"{w.top},{w.left},{w.bottom},{w.right}"
+            source = op.source if op.source is not None else "-"
+            blend_mode = op.blend_mode.name if op.blend_mode is not None else "-"
+            mask = "yes" if op.has_mask else "no"
+            lines.append(f"{i:>4}  {op.op_type.name:<16} {op.layer.name[:24]:<24} {source:>3} {op.target:>3}  "
+                         f"{window:<22} {blend_mode:<13} {op.opacity:>7}  {mask:<4} {op.cost / 1e6:>7.3f}")
+        return "\n".join(lines)
+
+    def _compile_layers(self, layers: List[Layer], target: int) -> Tuple[List[RenderOp], Rect or None]:
+        """ Compile a stack of layers, bottom to top. Returns the ops and the screen-space area they cover. """
+        ops = []
+        window = None
+        for layer in layers:
+            if not self._is_renderable(layer):
+                continue
+
+            if layer.is_group:
+                layer_ops, layer_window = self._compile_group(layer, target)
+            elif layer.fill_content is not None:
+                layer_ops, layer_window = self._compile_fill(layer, target)
+            elif layer.adjustment is not None:
+                layer_ops, layer_window = self._compile_adjustment(layer, target)
+                if layer_ops and ops and _fold_adjustments(ops[-1], layer_ops[0]):
+                    layer_ops = []
+            else:
+                layer_ops, layer_window = self._compile_layer(layer, target)
+
+            ops.extend(layer_ops)
+            window = union_rects(window, layer_window)
+
+        return ops, window
+
+    def _compile_layer(self, layer: Layer, target: int) -> Tuple[List[RenderOp], Rect or None]:
+        window = intersect_rects(self._layer_bounds(layer), self.region)
+        window = self._clip_to_mask(layer, window)
+        if rect_is_empty(window):
+            return [], None
+
+        op = RenderOp(OpType.Layer, layer, target=target, window=window, blend_mode=layer.blend_mode,
+                      opacity=layer.opacity, vector_mask=self._vector_mask(layer))
+        return [op], window
+
+    def _compile_adjustment(self, layer: Layer, target: int) -> Tuple[List[RenderOp], Rect or None]:
+        """ Adjustment layers change everything underneath them in the buffer they're composited into, so their window
+        is the whole region, as far as their mask allows.
+        """
+        adjustment = adjustments.build_adjustment(layer.adjustment, self.dtype)
+        window = self._clip_to_mask(layer, self.region)
+        if adjustment is None or rect_is_empty(window):
+            return [], None
+
+        op = RenderOp(OpType.Adjustment, layer, target=target, window=window, blend_mode=layer.blend_mode,
+                      opacity=layer.opacity, adjustment=adjustment, vector_mask=self._vector_mask(layer))
+        return [op], window
+
+    def _compile_fill(self, layer: Layer, target: int) -> Tuple[List[RenderOp], Rect or None]:
+        """ Fill layers cover the whole canvas, as far as their mask allows, whatever their rect. """
+        fill = fills.build_fill(layer.fill_content, layer.rect, self.canvas, self.dtype, self._patterns)
+        window = self._clip_to_mask(layer, self.region)
+        if fill is None or rect_is_empty(window):
+            return [], None
+
+        op = RenderOp(OpType.Layer, layer, target=target, window=window, blend_mode=layer.blend_mode,
+                      opacity=layer.opacity, fill=fill, vector_mask=self._vector_mask(layer))
+        return [op], window
+
+    def _compile_group(self, group: Layer, target: int) -> Tuple[List[RenderOp], Rect or None]:
+        pass_through = group.blend_mode.name == "pass through"
+        unmodified = (group.opacity == 255 and render_utils.active_mask(group) is None
+                      and self._vector_mask(group) is None and not blend_if.uses_blend_if(group))
+
+        # Pass-through groups without opacity or a mask composite their children straight into the parent.
+        if pass_through and unmodified:
+            return self._compile_layers(group.children, target)
+
+        source = target + 1
+        child_ops, window = self._compile_layers(group.children, source)
+        window = self._clip_to_mask(group, window)
+        if rect_is_empty(window):
+            return [], None
+
+        # Normal groups give the same result as their children composited straight into the parent, as long as every
+        #   child is composited with the normal blend mode too, and none of them read the pixels underneath: Blend If
+        #   and pass-through groups would see the parent's pixels instead of the group's own.
+        if group.blend_mode.name == "normal" and unmodified:
+            composited = [op for op in child_ops if op.target == source]
+            passed_through = [op for op in child_ops if op.op_type == OpType.BeginPassThrough and op.source == source]
+            if not passed_through and all(op.blend_mode.name == "normal" and op.op_type != OpType.Adjustment and
+                                          not blend_if.uses_blend_if(op.layer) for op in composited):
+                for op in child_ops:
+                    op.shift_buffers(-1)
+                return child_ops, window
+
+        if pass_through:
+            begin = RenderOp(OpType.BeginPassThrough, group, target=source, source=target, window=window)
+            blend_mode = BlendMode.from_name("normal")
+        else:
+            begin = RenderOp(OpType.BeginGroup, group, target=source, window=window)
+            blend_mode = group.blend_mode
+        end = RenderOp(OpType.EndGroup, group, target=target, source=source, window=window, blend_mode=blend_mode,
+                       opacity=group.opacity, vector_mask=self._vector_mask(group))
+        return [begin] + child_ops + [end], window
+
+    def _cull_occluded_ops(self):
+        """ Walk the ops from the top down. Ops whose whole window is hidden under opaque normal layers are dropped,
+        and ops that are partly hidden have their windows shrunk.
+        """
+        coverage = {0: CoverageMap(self.width, self.height)}
+        group_ends = []
+        kept = []
+
+        i = len(self.ops) - 1
+        while i >= 0:
+            op = self.ops[i]
+            if op.op_type == OpType.EndGroup:
+                window = coverage[op.target].uncovered_bounds(op.window)
+                if window is None:
+                    i = self._group_begin_index(i) - 1
+                    continue
+                op.window = window
+                # Anything hidden in the parent buffer is hidden inside the group, too
+                coverage[op.source] = coverage[op.target].copy()
+                group_ends.append(op)
+            elif op.op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+                op.window = group_ends.pop().window
+                del coverage[op.target]
+            else:
+                window = coverage[op.target].uncovered_bounds(op.window)
+                if window is None:
+                    i -= 1
+                    continue
+                op.window = window
+                if op.op_type == OpType.Layer and op.vector_mask is None and is_occluder(op.layer, op.opacity):
+                    if op.fill is not None:
+                        opaque = op.fill.opaque_pixels(window)
+                    else:
+                        opaque = opaque_pixels(op.layer, window)
+                    coverage[op.target].add_opaque_pixels(opaque, window)
+
+            kept.append(op)
+            i -= 1
+
+        self._ops = list(reversed(kept))
+
+    def _group_end_index(self, begin_index: int) -> int:
+        """ Return the index of the op that ends the group begun at begin_index. """
+        depth = 0
+        for i in range(begin_index, len(self.ops)):
+            if self.ops[i].op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+                depth += 1
+            elif self.ops[i].op_type == OpType.EndGroup:
+                depth -= 1
+                if depth == 0:
+                    return i
+        raise RuntimeError("Render plan has an unmatched BeginGroup op")
+
+    def _group_begin_index(self, end_index: int) -> int:
+        """ Return the index of the op that begins the group ended at end_index. """
+        depth = 0
+        for i in range(end_index, -1, -1):
+            if self.ops[i].op_type == OpType.EndGroup:
+                depth += 1
+            elif self.ops[i].op_type in [OpType.BeginGroup, OpType.BeginPassThrough]:
+                depth -= 1
+                if depth == 0:
+                    return i
+        raise RuntimeError("Render plan has an unmatched EndGroup op")
+
+    def _layer_bounds(self, layer: Layer) -> Rect:
+        """ Finding a layer's content rect decodes its whole transparency channel. When rendering a region, layers that
+        aren't decoded yet use their full rect instead.
+        """
+        alpha = layer.get_channel(CHANNEL_TRANSPARENCY_MASK)
+        if self._region is not None and alpha is not None and not alpha.is_decoded:
+            return layer.rect
+        return layer.content_rect
+
+    def _is_renderable(self, layer: Layer) -> bool:
+        if layer.visible is False or layer.opacity == 0 or layer.is_bounding_section_divider:
+            return False
+        if not layer.is_group and layer.adjustment is None and layer.fill_content is None and \
+                rect_is_empty(layer.rect):
+            return False
+        vector_mask = self._vector_mask(layer)
+        if vector_mask is not None and render_utils.mask_default_color(vector_mask) == 0 and \
+                rect_is_empty(vector_mask.rect):
+            return False
+        if self._region is not None and render_utils.active_mask(layer) is not None:
+            # Checking the mask means decoding all of it
+            mask_channel = layer.get_channel(CHANNEL_USER_LAYER_MASK)
+            if mask_channel is not None and not mask_channel.is_decoded:
+                return True
+        return not _is_fully_masked(layer)
+
+    def _clip_to_mask(self, layer: Layer, window: Rect or None) -> Rect or None:
+        """ Pixels outside a mask's rect use its default color; if that's black, nothing outside the rect is visible.
+        The same goes for the bounding box of a vector mask.
+        """
+        for mask in [render_utils.active_mask(layer), self._vector_mask(layer)]:
+            if window is None or mask is None or render_utils.mask_default_color(mask) != 0:
+                continue
+            window = intersect_rects(window, mask.rect)
+        return window
+
+    def _vector_mask(self, layer: Layer) -> vector_masks.RasterizedVectorMask or None:
+        """ The layer's vector mask, rasterized for the plan's canvas the first time its pixels are needed. """
+        if render_utils.active_vector_mask(layer) is None:
+            return None
+        if id(layer) not in self._vector_masks:
+            self._vector_masks[id(layer)] = vector_masks.RasterizedVectorMask(layer.vector_mask, self.width,
+                                                                              self.height, self.dtype)
+        return self._vector_masks[id(layer)]
+
+
+def _is_fully_masked(layer: Layer) -> bool:
+    mask = render_utils.active_mask(layer)
+    if mask is None or render_utils.mask_default_color(mask) != 0:
+        return False
+    if rect_is_empty(mask.rect):
+        return True
+    if mask.is_inverted:
+        return bool((mask.image_data >= channel_max(mask.image_data.dtype)).all())
+    return not mask.image_data.any()
+
+
+def _fold_adjustments(previous: RenderOp, op: RenderOp) -> bool:
+    """ Fold an adjustment op into the one before it, if they can share a lookup table. That's only the case for
+    unmasked adjustments that replace the colors underneath them outright, over the same window.
+    """
+    def is_plain(adjustment_op: RenderOp) -> bool:
+        layer = adjustment_op.layer
+        return (adjustment_op.op_type == OpType.Adjustment and adjustment_op.blend_mode.name == "normal"
+                and adjustment_op.opacity == 255 and not adjustment_op.has_mask
+                and not blend_if.uses_blend_if(layer))
+
+    if not is_plain(previous) or not is_plain(op) or previous.target != op.target or previous.window != op.window:
+        return False
+    folded = previous.adjustment.then(op.adjustment)
+    if folded is None:
+        return False
+    previous.adjustment = folded
+    return True
+
+
+def _span_attributes(op: RenderOp) -> dict:
+    w = op.window
+    return {
+        "op": op.op_type.name,
+        "blend_mode": op.blend_mode.name if op.blend_mode is not None else "-",
+        "opacity": op.opacity,
+        "window": [w.top, w.left, w.bottom, w.right],
+        "pixels": rect_area(w),
+    }
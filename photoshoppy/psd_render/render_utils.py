@@ -1,10 +1,15 @@
 import numpy as np
 
+from . import blend_luts, tracing
+from .compositing import channel_max, working_dtype
+from .scratch import get_scratch_pool
+from .vector_masks import RasterizedVectorMask
 from photoshoppy.models.blend_mode.model import BlendMode
 from photoshoppy.models.layer.model import Layer
 from photoshoppy.models.layer.layer_mask import LayerMask
+from photoshoppy.models.layer.layer_info.layer_info_blocks.vector_mask import VectorMask
 from photoshoppy.psd_file import PSDFile
-from photoshoppy.utilities.rect import Rect
+from photoshoppy.utilities.rect import Rect, intersect_rects, rect_is_empty, rect_height, rect_width, subtract_rect
 from photoshoppy.utilities.array import crop_array, pad_array
 
 
@@ -18,18 +23,6 @@ def layer_to_screen_space(layer: Layer, psd: PSDFile) -> np.array:
         fill=0)
 
 
-def mask_to_screen_space(layer: Layer, psd: PSDFile) -> np.array:
-    """ Return a Layer's mask in screen space. """
-    if layer.layer_mask is None:
-        raise RuntimeError(f"Layer '{layer.name}' has no layer mask; cannot convert to screen space.")
-    return _image_to_screen_space(
-        image_data=layer.layer_mask.image_data,
-        image_rect=layer.layer_mask.rect,
-        width=psd.width,
-        height=psd.height,
-        fill=layer.layer_mask.default_color)
-
-
 def _image_to_screen_space(image_data: np.array, image_rect: Rect, width: int, height: int, fill: int = 0) -> np.array:
     bbox = Rect(0, 0, height, width)
     cropped_image_data = crop_array(array=image_data, rect=image_rect, bbox=bbox)
@@ -37,73 +30,147 @@ def _image_to_screen_space(image_data: np.array, image_rect: Rect, width: int, h
     return ss_image_data
 
 
-def _get_mask(layer: Layer, psd: PSDFile):
-    if layer.layer_mask is None:
-        return None
-    else:
-        return mask_to_screen_space(layer, psd)
-
-
-def composite_group(group: Layer, psd: PSDFile, bg: np.array or None) -> np.array:
-    transparent_bg = np.zeros((psd.height, psd.width, 4), dtype=np.uint8)
-    if bg is None:
-        bg = transparent_bg
-
-    image_data = transparent_bg
-    for layer in group.children:
-        if layer.visible is False:
-            continue
-
-        if layer.is_group is True:
-            fg_image_data = composite_group(group=layer, psd=psd, bg=image_data)
-        else:
-            fg_image_data = layer_to_screen_space(layer, psd)
-        image_data = composite_image_data(
-            fg=fg_image_data,
-            bg=image_data,
-            blend_mode=layer.blend_mode,
-            mask=_get_mask(layer, psd),
-            opacity=layer.opacity)
+def layer_to_window(layer: Layer, window: Rect) -> np.array:
+    """ Return the part of a Layer's image data that falls inside a screen-space window. """
+    return _image_to_window(image_data=layer.image_data, image_rect=layer.rect, window=window, fill=0)
 
-    return image_data
 
+def layer_planes_to_window(layer: Layer, window: Rect, decode_rows: bool = False) -> np.array:
+    """ Like layer_to_window, but only the pixels inside the window are interleaved, and nothing is cached.
+    If decode_rows is True, channels that haven't been decoded yet only have the window's rows decoded.
+    """
+    overlap = intersect_rects(layer.rect, window)
+    if rect_is_empty(overlap):
+        return np.zeros((rect_height(window), rect_width(window), 4), dtype=working_dtype(layer.depth))
+    planes = layer.read_image_planes(overlap, decode_rows=decode_rows)
+    return _image_to_window(image_data=np.dstack(planes), image_rect=overlap, window=window, fill=0)
 
-def flatten_group(group: Layer, psd: PSDFile, pass_through_bg: None or np.array = None) -> np.array:
-    transparent_bg = np.zeros((psd.height, psd.width, 4), dtype=np.uint8)
-    bg = transparent_bg
 
-    if group.blend_mode.name == "pass through" and pass_through_bg is not None:
-        bg = pass_through_bg
-
-    for layer in group.children:
-        if layer.visible is False:
-            continue
-
-        blend_mode = layer.blend_mode
-        if layer.is_group is True:
-            fg = flatten_group(group=layer, psd=psd, pass_through_bg=bg)
-            if layer.blend_mode.name == "pass through":
-                blend_mode = BlendMode.from_name("normal")
-        else:
-            fg = layer_to_screen_space(layer=layer, psd=psd)
-
-        group_image_data = composite_image_data(
-            fg=fg,
-            bg=bg,
-            blend_mode=blend_mode,
-            mask=_get_mask(layer, psd),
-            opacity=layer.opacity)
-
-        bg = group_image_data
-
-    image_data = bg
+def active_mask(layer: Layer) -> LayerMask or None:
+    """ Return a Layer's mask, or None if it has none or the mask is disabled. """
+    mask = layer.layer_mask
+    if mask is None or mask.is_disabled:
+        return None
+    return mask
 
-    return image_data
 
+def active_vector_mask(layer: Layer) -> VectorMask or None:
+    """ Return a Layer's vector mask, or None if it has none or the vector mask is disabled. """
+    vector_mask = layer.vector_mask
+    if vector_mask is None or vector_mask.is_disabled:
+        return None
+    return vector_mask
+
+
+def mask_default_color(mask: LayerMask) -> int:
+    """ The 8-bit value a mask has outside its rect when blending, after it's inverted. """
+    return 255 - mask.default_color if mask.is_inverted else mask.default_color
+
+
+def mask_to_windows(layer: Layer, window: Rect, decode_rows: bool = False,
+                    vector_mask: RasterizedVectorMask or None = None) -> list:
+    """ Split a screen-space window by a Layer's mask, and return (window, mask) pairs covering the parts of it that
+    the mask doesn't hide completely.
+    Inside the mask's rect, the mask is its pixels in that part of the window. Around the rect, it's the mask's
+    default color as a 0-d array, or None where that lets everything through, so the mask is never padded out to the
+    window. Layers without an enabled mask get the whole window with no mask. Inverted masks are inverted here.
+    If decode_rows is True and the mask hasn't been decoded yet, only the window's rows are decoded.
+    A rasterized vector mask (see vector_masks.RasterizedVectorMask) splits the pieces again, and is multiplied into
+    the layer mask.
+    """
+    pieces = _split_by_mask([(window, None)], active_mask(layer), layer.depth, decode_rows)
+    if vector_mask is not None and not vector_mask.is_disabled:
+        pieces = _split_by_mask(pieces, vector_mask, layer.depth, decode_rows)
+    return pieces
+
+
+def _split_by_mask(pieces: list, mask: LayerMask or RasterizedVectorMask or None, depth: int,
+                   decode_rows: bool) -> list:
+    if mask is None:
+        return pieces
+
+    split = []
+    default_color = mask_default_color(mask)
+    constant = None
+    if default_color not in [0, 255]:
+        dtype = working_dtype(depth)
+        value = mask.default_value
+        constant = np.asarray(channel_max(dtype) - value if mask.is_inverted else value, dtype=dtype)
+
+    for window, window_mask in pieces:
+        overlap = intersect_rects(mask.rect, window)
+        if not rect_is_empty(overlap):
+            if decode_rows:
+                mask_data = mask.read_image_data(overlap)
+            else:
+                mask_data = mask.image_data[overlap.top - mask.rect.top:overlap.bottom - mask.rect.top,
+                                            overlap.left - mask.rect.left:overlap.right - mask.rect.left]
+            if mask.is_inverted:
+                mask_data = channel_max(mask_data.dtype) - mask_data
+            split.append((overlap, _multiply_masks(_crop_mask(window_mask, window, overlap), mask_data)))
+
+        if default_color != 0:
+            split.extend((piece, _multiply_masks(_crop_mask(window_mask, window, piece), constant))
+                         for piece in subtract_rect(window, overlap))
+    return split
+
+
+def _crop_mask(mask: np.array or None, window: Rect, piece: Rect) -> np.array or None:
+    """ Crop a window's mask to a piece of the window. Constant masks stay constant. """
+    if mask is None or mask.ndim == 0:
+        return mask
+    return mask[piece.top - window.top:piece.bottom - window.top, piece.left - window.left:piece.right - window.left]
+
+
+def _multiply_masks(a: np.array or None, b: np.array or None) -> np.array or None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.dtype != np.uint8:
+        return a * b
+    product = a.astype(np.uint16) * b
+    product += 127
+    product //= 255
+    return product.astype(np.uint8)
+
+
+def _image_to_window(image_data: np.array, image_rect: Rect, window: Rect, fill: int = 0) -> np.array:
+    """ Crop image data to a window. Parts of the window the image doesn't cover are set to the fill value.
+    If the image covers the whole window, a view is returned instead of a copy.
+    """
+    overlap = intersect_rects(image_rect, window)
+    src = image_data[overlap.top - image_rect.top:overlap.bottom - image_rect.top,
+                     overlap.left - image_rect.left:overlap.right - image_rect.left]
+    if overlap == window:
+        return src
+
+    shape = (rect_height(window), rect_width(window)) + image_data.shape[2:]
+    window_data = np.full(shape, fill, dtype=image_data.dtype)
+    if not rect_is_empty(overlap):
+        window_data[overlap.top - window.top:overlap.bottom - window.top,
+                    overlap.left - window.left:overlap.right - window.left] = src
+    return window_data
 
 
 def composite_image_data(fg: np.array, bg: np.array, blend_mode: BlendMode, mask: np.array or None,
-                         opacity: float or int) -> np.array:
+                         opacity: float or int, use_lut: bool = False, out: np.array or None = None,
+                         origin: tuple = (0, 0)) -> np.array:
+    """ Blend fg over bg. If use_lut is True, separable blend modes use a lookup table instead of float math.
+    The result is written to out if it's given, which may be bg itself. origin is the canvas position of fg and bg's
+    top left pixel.
+    Outside of a render plan, the blend's temporaries are freed once it's done (see ScratchPool.held).
+    """
     if isinstance(opacity, int):
         opacity = opacity / 255.0
-    return blend_mode.blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=opacity)
+
+    try:
+        if use_lut and fg.dtype == np.uint8:
+            lut = blend_luts.get_lut(blend_mode)
+            if lut is not None:
+                with tracing.span("blend lut"):
+                    return blend_luts.blend_lut(fg=fg, bg=bg, mask=mask, fg_opacity=opacity, lut=lut, out=out)
+
+        return blend_mode.blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=opacity, out=out, origin=origin)
+    finally:
+        get_scratch_pool().release()
@@ -0,0 +1,87 @@
+""" Reusable scratch buffers for blend kernels.
+Every thread has its own ScratchPool. Kernels ask the pool for working arrays instead of allocating them, and the pool
+hands out views of buffers it keeps from one blend to the next. Buffers only grow, so once they're as large as the
+biggest op window in a tile or canvas, blending a layer allocates nothing new.
+"""
+from __future__ import annotations
+
+import contextlib
+import threading
+from typing import Generator
+
+import numpy as np
+
+
+class ScratchPool:
+    def __init__(self):
+        self._buffers = []
+        self._used = 0
+        self._holds = 0
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes held by the pool's buffers. """
+        return sum(buffer.nbytes for buffer in self._buffers)
+
+    def array(self, shape: tuple, dtype: np.dtype = np.float64) -> np.array:
+        """ Return an uninitialized array. It's only valid until the frame it was taken in ends. """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if self._used == len(self._buffers):
+            self._buffers.append(np.empty(0, dtype=np.uint8))
+        buffer = self._buffers[self._used]
+        if buffer.nbytes < nbytes:
+            # Buffers are kept as float64 so that views of them are aligned for any type
+            buffer = np.empty(-(-nbytes // 8), dtype=np.float64).view(np.uint8)
+            self._buffers[self._used] = buffer
+        self._used += 1
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def like(self, array: np.array, dtype: np.dtype or None = None) -> np.array:
+        """ Return an uninitialized array with the same shape as another, and the same type unless one is given. """
+        return self.array(array.shape, array.dtype if dtype is None else dtype)
+
+    @contextlib.contextmanager
+    def frame(self) -> Generator[ScratchPool, None, None]:
+        """ Arrays taken from the pool inside a with block go back to it when the block exits. Frames can be nested.
+        """
+        used = self._used
+        try:
+            yield self
+        finally:
+            self._used = used
+
+    @contextlib.contextmanager
+    def held(self) -> Generator[ScratchPool, None, None]:
+        """ Keep the pool's buffers from one use to the next inside a with block, and free them when the outermost one
+        exits.
+        """
+        self._holds += 1
+        try:
+            yield self
+        finally:
+            self._holds -= 1
+            if self._holds == 0:
+                self.clear()
+
+    def release(self):
+        """ Free the pool's buffers once nothing is using them, unless they're being held. """
+        if self._holds == 0 and self._used == 0:
+            self.clear()
+
+    def clear(self):
+        """ Free the pool's buffers. Arrays taken from it must no longer be in use. """
+        self._buffers = []
+        self._used = 0
+
+
+_local = threading.local()
+
+
+def get_scratch_pool() -> ScratchPool:
+    """ Return the calling thread's scratch pool. """
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = ScratchPool()
+        _local.pool = pool
+    return pool
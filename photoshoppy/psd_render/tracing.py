@@ -0,0 +1,243 @@
+""" Render tracing.
+While a Tracer is active, the renderer records a tree of timed spans: one per group and layer, with children for
+screen-space conversion, mask prep, blending and alpha compositing. With no tracer active, a span costs one check.
+Only the thread that activated the tracer records spans; work done on worker threads isn't traced.
+
+    with Tracer() as tracer:
+        render_psd(psd, "render.png")
+    print(tracer.summary())
+    tracer.write_chrome_trace("render.trace.json")  # Open in chrome://tracing or https://ui.perfetto.dev
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+_active_tracer = None
+
+# tracemalloc.reset_peak is new in Python 3.9; without it, spans only see peaks that are higher than any before them
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+
+class Span:
+    """ A timed section of a render. Times are in seconds, relative to the start of the trace. """
+    def __init__(self, name: str, category: str, start: float, attributes: dict):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = None
+        self.attributes = attributes
+        self.children = []
+        self.peak_bytes = 0
+        self._start_memory = 0
+        self._start_peak = 0
+        self._running_peak = 0
+
+    @property
+    def duration(self) -> float:
+        return 0.0 if self.end is None else self.end - self.start
+
+    @property
+    def self_duration(self) -> float:
+        """ Time spent in this span, but not in its children. """
+        return self.duration - sum(child.duration for child in self.children)
+
+    def iter_spans(self):
+        yield self
+        for child in self.children:
+            yield from child.iter_spans()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "category": self.category,
+            "start": self.start,
+            "duration": self.duration,
+            "peak_bytes": self.peak_bytes,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class Tracer:
+    """ Records spans while active. Use it as a context manager; only one tracer can be active at a time.
+    If track_memory is True, each span records the peak memory allocated while it was open. This uses tracemalloc,
+    which slows rendering down considerably, so timings taken with it are only useful relative to each other. Before
+    Python 3.9, a span's peak is only exact if it's the highest so far; lower peaks fall back to the memory in use when
+    the span and its children opened and closed.
+    """
+    def __init__(self, track_memory: bool = False):
+        self._track_memory = track_memory
+        self._origin = None
+        self._root = Span("trace", "trace", 0.0, {})
+        self._stack = [self._root]
+        self._started_tracemalloc = False
+        self._previous_tracer = None
+        self._thread_id = None
+
+    @property
+    def root(self) -> Span:
+        return self._root
+
+    @property
+    def track_memory(self) -> bool:
+        return self._track_memory
+
+    def __enter__(self) -> Tracer:
+        global _active_tracer
+        if self._track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._origin = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        self._previous_tracer = _active_tracer
+        _active_tracer = self
+        self._open(self._root)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active_tracer
+        while len(self._stack) > 1:
+            self.end_span()
+        self._close(self._root)
+        _active_tracer = self._previous_tracer
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def begin_span(self, name: str, category: str, **attributes) -> Span:
+        """ Open a span as a child of the current one. It must be closed with end_span. """
+        span = Span(name, category, self._now(), attributes)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        self._open(span)
+        return span
+
+    def end_span(self):
+        span = self._stack.pop()
+        self._close(span)
+        parent = self._stack[-1]
+        parent._running_peak = max(parent._running_peak, span._running_peak)
+
+    def to_json(self) -> str:
+        return json.dumps(self._root.to_dict(), indent=2)
+
+    def to_chrome_trace(self) -> str:
+        """ Return the spans in the Chrome trace event format. """
+        events = []
+        for span in self._root.iter_spans():
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": dict(span.attributes, peak_bytes=span.peak_bytes),
+            })
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+
+    def write_json(self, file_path: str):
+        with open(file_path, "w") as f:
+            f.write(self.to_json())
+
+    def write_chrome_trace(self, file_path: str):
+        with open(file_path, "w") as f:
+            f.write(self.to_chrome_trace())
+
+    def summary(self, count: int = 20) -> str:
+        """ Return the slowest spans of each category, by time spent in the span itself. """
+        totals = {}
+        for span in self._root.iter_spans():
+            if span is not self._root:
+                totals[span.category] = totals.get(span.category, 0.0) + span.self_duration
+
+        layers = [span for span in self._root.iter_spans() if span.category in ("layer", "group")]
+        layers.sort(key=lambda s: s.duration, reverse=True)
+
+        lines = [f"Trace: {self._root.duration:.3f} s"]
+        for category, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"    {category:<16} {seconds:>9.3f} s")
+        lines.append("Slowest layers and groups:")
+        for span in layers[:count]:
+            blend_mode = span.attributes.get("blend_mode", "-")
+            pixels = span.attributes.get("pixels", 0)
+            lines.append(f"    {span.name[:32]:<32} {span.category:<6} {blend_mode:<13} {pixels / 1e6:>7.3f} Mpix "
+                         f"{span.duration:>9.3f} s {span.peak_bytes / 2 ** 20:>9.1f} MiB")
+        return "\n".join(lines)
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def _open(self, span: Span):
+        if not self._track_memory:
+            return
+        # Peaks are tracked per span; before resetting tracemalloc's peak, hand it to the span that's already open.
+        current, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is not None:
+            parent = self._stack[-2] if len(self._stack) > 1 else None
+            if parent is not None:
+                parent._running_peak = max(parent._running_peak, peak)
+            _reset_peak()
+            peak = current
+        span._start_memory = current
+        span._start_peak = peak
+        span._running_peak = current
+
+    def _close(self, span: Span):
+        span.end = self._now()
+        if not self._track_memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        # Without reset_peak, the peak only belongs to this span if it was reached while the span was open. Otherwise
+        #   the span's own peak is somewhere below it, and the memory at its ends and its children's peaks are used.
+        if _reset_peak is not None or peak > span._start_peak:
+            span._running_peak = max(span._running_peak, peak)
+        span._running_peak = max(span._running_peak, current)
+        span.peak_bytes = span._running_peak - span._start_memory
+
+
+def active_tracer() -> Tracer or None:
+    """ Return the active tracer, if there is one and it belongs to the current thread. """
+    if _active_tracer is None or _active_tracer._thread_id != threading.get_ident():
+        return None
+    return _active_tracer
+
+
+@contextlib.contextmanager
+def _traced_span(tracer: Tracer, name: str, category: str, attributes: dict):
+    tracer.begin_span(name, category, **attributes)
+    try:
+        yield
+    finally:
+        tracer.end_span()
+
+
+_null_span = contextlib.nullcontext()
+
+
+def span(name: str, category: str or None = None, **attributes):
+    """ Return a context manager that records a span if a tracer is active, and does nothing otherwise. """
+    tracer = active_tracer()
+    if tracer is None:
+        return _null_span
+    return _traced_span(tracer, name, category or name, attributes)
+
+
+def begin_span(name: str, category: str, **attributes):
+    """ Open a span that doesn't fit in a with block, if a tracer is active. """
+    tracer = active_tracer()
+    if tracer is not None:
+        tracer.begin_span(name, category, **attributes)
+
+
+def end_span():
+    tracer = active_tracer()
+    if tracer is not None:
+        tracer.end_span()
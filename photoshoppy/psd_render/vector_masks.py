@@ -0,0 +1,211 @@
+""" Vector masks for render plans.
+A vector mask's subpaths are flattened to polygons, and rasterized to an antialiased coverage mask over the bounding box
+of the path, at the scale being rendered. Pixels outside the bounding box aren't covered by the path, so they're never
+rasterized.
+The rasterizer is a scanline coverage filler, vectorized over edges and scanlines: every pixel row is sampled by
+SCANLINE_SUBSAMPLES scanlines, each edge adds its winding direction to an accumulation row where it crosses a
+scanline, split between the two pixels around the crossing, and a cumulative sum along each scanline gives its
+horizontal coverage. Averaging the scanlines of a row gives the vertical coverage.
+Rasterized masks are cached per vector mask, and so per layer, and scale.
+"""
+from __future__ import annotations
+
+import weakref
+from typing import List
+
+import numpy as np
+
+from .compositing import channel_max
+from photoshoppy.models.layer.layer_info.layer_info_blocks.vector_mask import (
+    Subpath, VectorMask, OPERATION_INTERSECT, OPERATION_SUBTRACT, OPERATION_XOR)
+from photoshoppy.utilities.rect import Rect, rect_height, rect_is_empty, rect_width
+
+
+# Scanlines sampled for every row of pixels
+SCANLINE_SUBSAMPLES = 4
+
+# Maximum distance, in pixels, between a Bezier curve and the polygon it's flattened to
+FLATTEN_TOLERANCE = 0.1
+
+# Rows of pixels rasterized at a time, which bounds the size of the accumulation buffer
+RASTER_BAND_HEIGHT = 256
+
+# Vector mask -> {(width, height, factor, dtype): raster}
+_rasters = weakref.WeakKeyDictionary()
+
+
+class RasterizedVectorMask:
+    """ A vector mask rasterized for a document of width x height pixels, scaled down by a proxy factor. It has the
+    parts of the LayerMask interface that render_utils.mask_to_windows uses. Its rect is the bounding box of the path,
+    and the raster is only computed the first time its pixels are needed.
+    """
+    def __init__(self, vector_mask: VectorMask, width: int, height: int, dtype: np.dtype, factor: int = 1):
+        self._vector_mask = vector_mask
+        self._width = width
+        self._height = height
+        self._dtype = np.dtype(dtype)
+        self._factor = factor
+
+        self._polygons = [flatten_subpath(subpath, width / factor, height / factor)
+                          for subpath in vector_mask.subpaths if len(subpath.knots) > 1]
+        self._rect = _polygon_bounds(self._polygons, Rect(0, 0, -(-height // factor), -(-width // factor)))
+
+    @property
+    def vector_mask(self) -> VectorMask:
+        return self._vector_mask
+
+    @property
+    def rect(self) -> Rect:
+        return self._rect
+
+    @property
+    def default_color(self) -> int:
+        return 0
+
+    @property
+    def default_value(self) -> int or float:
+        return 0
+
+    @property
+    def is_disabled(self) -> bool:
+        return self._vector_mask.is_disabled
+
+    @property
+    def is_inverted(self) -> bool:
+        return self._vector_mask.is_inverted != self._vector_mask.fills_all
+
+    @property
+    def image_data(self) -> np.array:
+        """ The path's coverage inside its rect, in the working type. """
+        rasters = _rasters.setdefault(self._vector_mask, {})
+        key = (self._width, self._height, self._factor, self._dtype.str)
+        raster = rasters.get(key)
+        if raster is None:
+            coverage = rasterize(self._polygons, [subpath.operation for subpath in self._vector_mask.subpaths
+                                                  if len(subpath.knots) > 1], self._rect)
+            if self._dtype == np.uint8:
+                raster = np.around(coverage * channel_max(np.uint8)).astype(np.uint8)
+            else:
+                raster = coverage.astype(self._dtype)
+            raster.flags.writeable = False
+            rasters[key] = raster
+        return raster
+
+    def read_image_data(self, rect: Rect) -> np.array:
+        return self.image_data[rect.top - self._rect.top:rect.bottom - self._rect.top,
+                               rect.left - self._rect.left:rect.right - self._rect.left]
+
+    def scaled(self, factor: int) -> RasterizedVectorMask:
+        return RasterizedVectorMask(self._vector_mask, self._width, self._height, self._dtype,
+                                    factor=self._factor * factor)
+
+
+def flatten_subpath(subpath: Subpath, width: float, height: float) -> np.array:
+    """ Flatten a subpath's Bezier segments to an (N, 2) array of (x, y) pixel coordinates. Open subpaths are closed
+    by a straight line back to their first knot.
+    """
+    knots = subpath.knots
+    scale = np.array([width, height])
+    anchors = np.array([knot.anchor[::-1] for knot in knots]) * scale
+    leaving = np.array([knot.leaving[::-1] for knot in knots]) * scale
+    preceding = np.array([knot.preceding[::-1] for knot in knots]) * scale
+
+    # Segment i runs from knot i to knot i + 1; only closed subpaths curve back to the first knot
+    end = np.roll(np.arange(len(knots)), -1)
+    if not subpath.closed:
+        end = end[:-1]
+    start = np.arange(len(end))
+    p0, p1, p2, p3 = anchors[start], leaving[start], preceding[end], anchors[end]
+
+    # Wang's formula gives enough steps to stay within the tolerance
+    deviation = np.maximum(np.hypot(*(p0 - 2 * p1 + p2).T), np.hypot(*(p1 - 2 * p2 + p3).T))
+    steps = np.clip(np.ceil(np.sqrt(0.75 * deviation / FLATTEN_TOLERANCE)), 1, 1024).astype(np.intp)
+
+    segment = np.repeat(np.arange(len(steps)), steps)
+    t = (np.arange(segment.size) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    t = t[:, None]
+    u = 1 - t
+    points = (u * u * u * p0[segment] + 3 * u * u * t * p1[segment] + 3 * u * t * t * p2[segment] +
+              t * t * t * p3[segment])
+    if not subpath.closed:
+        points = np.concatenate([points, p3[-1:]])
+    return points
+
+
+def rasterize(polygons: List[np.array], operations: List[int], rect: Rect) -> np.array:
+    """ Rasterize polygons to float32 coverage over a rect, combining each one with those before it by its subpath
+    operation. Polygons are filled with the nonzero winding rule.
+    """
+    coverage = np.zeros((rect_height(rect), rect_width(rect)), dtype=np.float32)
+    if rect_is_empty(rect):
+        return coverage
+    for i, (polygon, operation) in enumerate(zip(polygons, operations)):
+        polygon_coverage = _polygon_coverage(polygon, rect)
+        if i == 0 and operation not in [OPERATION_SUBTRACT, OPERATION_INTERSECT]:
+            coverage = polygon_coverage
+        elif operation == OPERATION_XOR:
+            coverage = coverage + polygon_coverage - 2 * coverage * polygon_coverage
+        elif operation == OPERATION_SUBTRACT:
+            coverage *= 1 - polygon_coverage
+        elif operation == OPERATION_INTERSECT:
+            np.minimum(coverage, polygon_coverage, out=coverage)
+        else:
+            np.maximum(coverage, polygon_coverage, out=coverage)
+    return coverage
+
+
+def _polygon_coverage(polygon: np.array, rect: Rect) -> np.array:
+    height, width = rect_height(rect), rect_width(rect)
+    coverage = np.empty((height, width), dtype=np.float32)
+
+    # Edges relative to the rect, without horizontal ones, which never cross a scanline
+    start = polygon - [rect.left, rect.top]
+    end = np.roll(start, -1, axis=0)
+    sloped = start[:, 1] != end[:, 1]
+    start, end = start[sloped], end[sloped]
+    direction = np.where(end[:, 1] > start[:, 1], 1.0, -1.0)
+    top = np.minimum(start[:, 1], end[:, 1])
+    bottom = np.maximum(start[:, 1], end[:, 1])
+    slope = (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+
+    s = SCANLINE_SUBSAMPLES
+    for band_top in range(0, height, RASTER_BAND_HEIGHT):
+        band_bottom = min(band_top + RASTER_BAND_HEIGHT, height)
+        rows = (band_bottom - band_top) * s
+
+        # Scanline y = (row + 0.5) / s crosses edges with top <= y < bottom
+        first = np.clip(np.ceil((top - band_top) * s - 0.5), 0, rows).astype(np.intp)
+        last = np.clip(np.ceil((bottom - band_top) * s - 0.5), 0, rows).astype(np.intp)
+        counts = last - first
+        edge = np.repeat(np.arange(counts.size), counts)
+        row = first[edge] + np.arange(edge.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        y = band_top + (row + 0.5) / s
+        x = np.clip(start[edge, 0] + (y - start[edge, 1]) * slope[edge], 0, width)
+        column = np.floor(x).astype(np.intp)
+        fraction = x - column
+        index = row * (width + 2) + column
+        winding = direction[edge]
+
+        size = rows * (width + 2)
+        accumulation = np.bincount(index, weights=winding * (1 - fraction), minlength=size)
+        accumulation += np.bincount(index + 1, weights=winding * fraction, minlength=size)
+        scanlines = np.cumsum(accumulation.reshape(rows, width + 2), axis=1)[:, :width]
+        np.abs(scanlines, out=scanlines)
+        np.minimum(scanlines, 1, out=scanlines)
+        coverage[band_top:band_bottom] = scanlines.reshape(band_bottom - band_top, s, width).mean(axis=1)
+    return coverage
+
+
+def _polygon_bounds(polygons: List[np.array], canvas: Rect) -> Rect:
+    """ The pixels the polygons touch, inside the canvas. """
+    if not polygons:
+        return Rect(0, 0, 0, 0)
+    points = np.concatenate(polygons)
+    left, top = np.floor(points.min(axis=0)).astype(int)
+    right, bottom = np.ceil(points.max(axis=0)).astype(int)
+    top, left = max(top, canvas.top), max(left, canvas.left)
+    bottom, right = min(bottom, canvas.bottom), min(right, canvas.right)
+    if bottom <= top or right <= left:
+        return Rect(0, 0, 0, 0)
+    return Rect(int(top), int(left), int(bottom), int(right))
@@ -1,30 +1,64 @@
 import struct
+from collections import namedtuple
 from typing import BinaryIO
 
 from .string import read_unicode_string
 
 
-def read_descriptor(file: BinaryIO):
+UnitFloat = namedtuple("UnitFloat", "unit value")
+Class = namedtuple("Class", "name class_id")
+
+
+class Descriptor(dict):
+    """ A descriptor's items, by key. Nested descriptors are Descriptors too, and lists are lists. """
+    def __init__(self, name: str, class_id: str, items: dict):
+        super().__init__(items)
+        self.name = name
+        self.class_id = class_id
+
+
+def read_descriptor(file: BinaryIO) -> Descriptor:
     """ Some layer records use descriptors to store data. """
-    descriptor_data = {}
     name = read_unicode_string(file)
     class_id = read_descriptor_id_string(file)
     num_descriptor_items = struct.unpack('>L', file.read(4))[0]
+    items = {}
     for item in range(num_descriptor_items):
         key = read_descriptor_id_string(file)
-        os_type_key = struct.unpack('>4s', file.read(4))[0]
-        os_type_key = os_type_key.decode('utf-8')
+        items[key] = read_descriptor_value(file)
 
-        # Data type in OSType key maps to
-        item_value_fn_map = {
-            'TEXT': read_descriptor_string,
-            'enum': read_descriptor_enumerated,
-        }
+    return Descriptor(name, class_id, items)
 
-        item_value_fn = item_value_fn_map[os_type_key]
-        item_value = item_value_fn(file)
 
-    return descriptor_data
+def read_descriptor_value(file: BinaryIO):
+    """ Read an item's OSType key, then its value. """
+    os_type_key = struct.unpack('>4s', file.read(4))[0]
+    os_type_key = os_type_key.decode('utf-8')
+
+    # Data type in OSType key maps to
+    item_value_fn_map = {
+        'Objc': read_descriptor,
+        'GlbO': read_descriptor,
+        'VlLs': read_descriptor_list,
+        'doub': read_descriptor_double,
+        'UntF': read_descriptor_unit_float,
+        'UnFl': read_descriptor_unit_floats,
+        'TEXT': read_descriptor_string,
+        'enum': read_descriptor_enumerated,
+        'long': read_descriptor_integer,
+        'comp': read_descriptor_large_integer,
+        'bool': read_descriptor_boolean,
+        'type': read_descriptor_class,
+        'GlbC': read_descriptor_class,
+        'tdta': read_descriptor_raw_data,
+        'alis': read_descriptor_raw_data,
+        'Pth ': read_descriptor_raw_data,
+    }
+
+    item_value_fn = item_value_fn_map.get(os_type_key)
+    if item_value_fn is None:
+        raise NotImplementedError(f"Unsupported descriptor item type: '{os_type_key}'")
+    return item_value_fn(file)
 
 
 def read_descriptor_id_string(file: BinaryIO):
@@ -39,11 +73,55 @@ def read_descriptor_id_string(file: BinaryIO):
 
 
 def read_descriptor_string(file: BinaryIO):
-    return read_unicode_string(file)
+    # Strings end with a null character
+    return read_unicode_string(file).rstrip("\x00")
 
 
 def read_descriptor_enumerated(file: BinaryIO):
-    class_id = read_descriptor_id_string(file)
-    type_id = read_descriptor_id_string(file)
-    enum = read_descriptor_id_string(file)
-    return enum
+    read_descriptor_id_string(file)  # Type ID
+    return read_descriptor_id_string(file)
+
+
+def read_descriptor_list(file: BinaryIO) -> list:
+    count = struct.unpack('>L', file.read(4))[0]
+    return [read_descriptor_value(file) for _ in range(count)]
+
+
+def read_descriptor_double(file: BinaryIO) -> float:
+    return struct.unpack('>d', file.read(8))[0]
+
+
+def read_descriptor_unit_float(file: BinaryIO) -> UnitFloat:
+    """ Units are '#Ang' (degrees), '#Rsl' (density), '#Rlt' (distance), '#Nne' (none), '#Prc' (percent) or '#Pxl'
+    (pixels).
+    """
+    unit = file.read(4).decode('utf-8')
+    return UnitFloat(unit, struct.unpack('>d', file.read(8))[0])
+
+
+def read_descriptor_unit_floats(file: BinaryIO) -> list:
+    unit = file.read(4).decode('utf-8')
+    count = struct.unpack('>L', file.read(4))[0]
+    return [UnitFloat(unit, value) for value in struct.unpack(f'>{count}d', file.read(8 * count))]
+
+
+def read_descriptor_integer(file: BinaryIO) -> int:
+    return struct.unpack('>i', file.read(4))[0]
+
+
+def read_descriptor_large_integer(file: BinaryIO) -> int:
+    return struct.unpack('>q', file.read(8))[0]
+
+
+def read_descriptor_boolean(file: BinaryIO) -> bool:
+    return struct.unpack('>?', file.read(1))[0]
+
+
+def read_descriptor_class(file: BinaryIO) -> Class:
+    name = read_unicode_string(file)
+    return Class(name, read_descriptor_id_string(file))
+
+
+def read_descriptor_raw_data(file: BinaryIO) -> bytes:
+    length = struct.unpack('>L', file.read(4))[0]
+    return file.read(length)
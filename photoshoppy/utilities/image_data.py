@@ -1,5 +1,5 @@
 import struct
-from typing import BinaryIO, List
+from typing import BinaryIO
 
 import numpy as np
 
@@ -12,23 +12,25 @@ COMPRESSION_ZIP_WITHOUT_PREDICTION = 2
 COMPRESSION_ZIP_PREDICTION = 3
 
 
-def get_image_data(file: BinaryIO, compression: int, width: int, height: int, channels: int, depth: int = 8) -> np.ndarray:
-    """ Read image data from a chunk of bytes. Returns a numpy array."""
-    # Convert photoshop color depth to c type
-    ps_to_c_depth = {1: "B", 8: "B", 16: "H", 32: "I"}
-    c_data_type = ps_to_c_depth[depth]
+# Photoshop color depth to the numpy type image data is stored as. 32-bit documents store floats.
+DEPTH_DTYPES = {8: np.dtype(">u1"), 16: np.dtype(">u2"), 32: np.dtype(">f4")}
 
-    # Convert photoshop color depth to numpy data type
-    ps_to_np_depth = {1: np.bool_, 8: np.uint8, 16: np.uint16, 32: np.uint32}
-    np_data_type = ps_to_np_depth[depth]
 
-    # Initialize empty array
-    image_data = np.zeros((height, width, channels), dtype=np_data_type)
+def get_image_data(file: BinaryIO, compression: int, width: int, height: int, channels: int,
+                   depth: int = 8) -> np.ndarray:
+    """ Read image data from a chunk of bytes. Returns a numpy array."""
+    if depth == 1:
+        # Bitmap rows are padded to whole bytes
+        dtype = np.dtype(">u1")
+        row_length = -(-width // 8)
+    else:
+        dtype = DEPTH_DTYPES[depth]
+        row_length = width * dtype.itemsize
 
     if compression == COMPRESSION_RAW:
-        scanlines = _read_raw(file=file, width=width, height=height, channels=channels, data_format=c_data_type)
+        data = _read_raw(file=file, row_length=row_length, height=height, channels=channels)
     elif compression == COMPRESSION_RLE:
-        scanlines = _read_rle(file=file, width=width, height=height, channels=channels, data_format=c_data_type)
+        data = _read_rle(file=file, height=height, channels=channels)
     elif compression == COMPRESSION_ZIP_WITHOUT_PREDICTION:
         raise NotImplementedError("Unsupported compression method: ZIP without prediction")
     elif compression == COMPRESSION_ZIP_PREDICTION:
@@ -36,44 +38,23 @@ def get_image_data(file: BinaryIO, compression: int, width: int, height: int, ch
     else:
         raise NotImplementedError(f"Unknown compression method: {compression}")
 
-    # Write scanlines into image data
-    row = 0
-    channel = 0
-    for i, scanline in enumerate(scanlines):
-        if row >= height:
-            row -= height
-            channel += 1
-        image_data[row, :, channel] = scanline
-        row += 1
-
+    # Channels are stored one after another
+    planes = np.frombuffer(data, dtype=dtype).reshape(channels, height, -1)
+    if depth == 1:
+        planes = np.unpackbits(planes, axis=2)[:, :, :width].astype(np.bool_)
+    image_data = np.moveaxis(planes, 0, 2).astype(planes.dtype.newbyteorder("="), order="C")
     return image_data
 
 
-def _read_raw(file: BinaryIO, width: int, height: int, channels: int, data_format: str) -> List[int or float]:
+def _read_raw(file: BinaryIO, row_length: int, height: int, channels: int) -> bytes:
     """ Raw image data. """
-    scanlines = []
-    for channel in range(channels):
-        for row in range(height):
-            data = file.read(width)
-            scanline = struct.unpack(f'>{width}{data_format}', data)
-            scanlines.append(scanline)
-    return scanlines
+    return file.read(row_length * height * channels)
 
 
-def _read_rle(file: BinaryIO, width: int, height: int, channels: int, data_format: str) -> List[int or float]:
+def _read_rle(file: BinaryIO, height: int, channels: int) -> bytes:
     """ RLE data is stored with the PackBits compression scheme. """
     # First part of RLE image data stores the lengths of each data segment
-    data_lengths = []
-    for channel in range(channels):
-        for row in range(height):
-            length = struct.unpack('>H', file.read(2))[0]
-            data_lengths.append(length)
+    data_lengths = struct.unpack(f'>{height * channels}H', file.read(2 * height * channels))
 
     # Decompress each scanline
-    scanlines = []
-    for length in data_lengths:
-        data = unpack_bits(file.read(length))
-        scanline = struct.unpack(f'>{width}{data_format}', data)
-        scanlines.append(scanline)
-
-    return scanlines
+    return b"".join(unpack_bits(file.read(length)) for length in data_lengths)
@@ -1,24 +1,77 @@
-import struct
+from typing import Tuple
 
 
 def unpack_bits(compressed_data: bytes) -> bytes:
-    uncompressed_data = bytes()
+    return bytes(unpack_bits_with_extent(compressed_data)[0])
+
+
+def unpack_bits_with_extent(compressed_data: bytes) -> Tuple[bytearray, int or None, int or None]:
+    """ Unpack PackBits data. Also returns the range of offsets holding non-zero bytes, as (first, last + 1), which
+    is read from the runs as they're unpacked. The range is (None, None) if every byte is zero.
+    """
+    uncompressed_data = bytearray()
+    first = None
+    last = None
     pos = 0
     while pos < len(compressed_data):
-        header_byte = struct.unpack('b', compressed_data[pos:pos+1])[0]
+        header_byte = compressed_data[pos]
         pos += 1
-        if header_byte == -128:
+        if header_byte == 128:  # -128 as a signed byte
             continue
-        elif header_byte >= 0:
+        elif header_byte < 128:
             data_length = header_byte + 1
-            for x in range(data_length):
-                data = compressed_data[pos:pos+1]
-                pos += 1
-                uncompressed_data += data
+            data = compressed_data[pos:pos + data_length]
+            pos += data_length
+            stripped = data.lstrip(b"\x00")
+            if stripped:
+                start = len(uncompressed_data)
+                if first is None:
+                    first = start + len(data) - len(stripped)
+                last = start + len(data.rstrip(b"\x00"))
+            uncompressed_data += data
         else:
-            data_repeat = 1 - header_byte
-            data = compressed_data[pos:pos+1]
+            data_repeat = 257 - header_byte  # 1 - header_byte as a signed byte
+            data = compressed_data[pos:pos + 1]
             pos += 1
-            for x in range(data_repeat):
-                uncompressed_data += data
-    return uncompressed_data
+            if data != b"\x00":
+                start = len(uncompressed_data)
+                if first is None:
+                    first = start
+                last = start + data_repeat
+            uncompressed_data += data * data_repeat
+    return uncompressed_data, first, last
+
+
+def pack_bits(uncompressed_data: bytes) -> bytes:
+    """ Compress data with the PackBits scheme. Runs of 2 or more equal bytes are stored as repeats, everything else as
+    literals. Neither can be longer than 128 bytes.
+    """
+    compressed_data = bytearray()
+    literal = bytearray()
+
+    def flush_literal():
+        for i in range(0, len(literal), 128):
+            chunk = literal[i:i + 128]
+            compressed_data.append(len(chunk) - 1)
+            compressed_data.extend(chunk)
+        literal.clear()
+
+    pos = 0
+    length = len(uncompressed_data)
+    while pos < length:
+        value = uncompressed_data[pos]
+        run_end = pos + 1
+        while run_end < length and run_end - pos < 128 and uncompressed_data[run_end] == value:
+            run_end += 1
+
+        run_length = run_end - pos
+        if run_length >= 2:
+            flush_literal()
+            compressed_data.append(257 - run_length)  # 1 - run_length as a signed byte
+            compressed_data.append(value)
+        else:
+            literal.append(value)
+        pos = run_end
+
+    flush_literal()
+    return bytes(compressed_data)
@@ -2,3 +2,49 @@ from collections import namedtuple
 
 
 Rect = namedtuple("Rect", "top left bottom right")
+
+
+def rect_width(rect: Rect) -> int:
+    return max(0, rect.right - rect.left)
+
+
+def rect_height(rect: Rect) -> int:
+    return max(0, rect.bottom - rect.top)
+
+
+def rect_area(rect: Rect) -> int:
+    return rect_width(rect) * rect_height(rect)
+
+
+def rect_is_empty(rect: Rect or None) -> bool:
+    return rect is None or rect.right <= rect.left or rect.bottom <= rect.top
+
+
+def intersect_rects(a: Rect, b: Rect) -> Rect:
+    """ Return the overlapping area of two rects. The result may be empty. """
+    return Rect(max(a.top, b.top), max(a.left, b.left), min(a.bottom, b.bottom), min(a.right, b.right))
+
+
+def union_rects(a: Rect or None, b: Rect or None) -> Rect or None:
+    """ Return the bounding box of two rects. Empty rects are ignored. """
+    if rect_is_empty(a):
+        return None if rect_is_empty(b) else b
+    if rect_is_empty(b):
+        return a
+    return Rect(min(a.top, b.top), min(a.left, b.left), max(a.bottom, b.bottom), max(a.right, b.right))
+
+
+def subtract_rect(a: Rect, b: Rect) -> list:
+    """ Split the part of rect a that's outside rect b into up to four non-empty rects: full-width bands above and
+    below b, then the parts to its left and right.
+    """
+    overlap = intersect_rects(a, b)
+    if rect_is_empty(overlap):
+        return [] if rect_is_empty(a) else [a]
+    rects = [
+        Rect(a.top, a.left, overlap.top, a.right),
+        Rect(overlap.bottom, a.left, a.bottom, a.right),
+        Rect(overlap.top, a.left, overlap.bottom, overlap.left),
+        Rect(overlap.top, overlap.right, overlap.bottom, a.right),
+    ]
+    return [rect for rect in rects if not rect_is_empty(rect)]
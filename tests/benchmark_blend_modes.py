@@ -0,0 +1,205 @@
+""" Micro-benchmarks for every blend mode.
+Each blend mode is timed on synthetic canvases of several sizes and alpha / mask / opacity scenarios. Results are
+reported as throughput (Mpix/s) and peak memory, and can be saved as JSON and compared against an earlier run:
+
+    benchmark_blend_modes.py --sizes 256 1024 --output before.json
+    (make changes)
+    benchmark_blend_modes.py --sizes 256 1024 --output after.json --compare before.json --threshold 0.1
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import List
+
+import numpy as np
+
+from photoshoppy.models.blend_mode.model import BlendMode, ALL_BLEND_MODES
+from photoshoppy.psd_render import blend_luts
+from photoshoppy.psd_render.render_utils import composite_image_data
+from photoshoppy.psd_render.scratch import get_scratch_pool
+
+
+THIS_DIR = os.path.dirname(__file__)
+
+SIZES = (256, 512, 1024, 2048, 4096, 8192)
+DEFAULT_SIZES = (256, 1024, 2048)
+ENGINES = ("float", "lut")
+
+
+class Scenario:
+    def __init__(self, name: str, alpha: str, masked: bool, opacity: float):
+        self.name = name
+        self.alpha = alpha
+        self.masked = masked
+        self.opacity = opacity
+
+
+SCENARIOS = (
+    Scenario("opaque", alpha="opaque", masked=False, opacity=1.0),
+    Scenario("opacity", alpha="opaque", masked=False, opacity=0.5),
+    Scenario("masked", alpha="opaque", masked=True, opacity=1.0),
+    Scenario("alpha_random", alpha="random", masked=False, opacity=1.0),
+    Scenario("alpha_sparse", alpha="sparse", masked=False, opacity=1.0),
+    Scenario("alpha_gradient", alpha="gradient", masked=False, opacity=1.0),
+    Scenario("everything", alpha="random", masked=True, opacity=0.7),
+)
+
+
+def make_alpha(kind: str, size: int, rng: np.random.Generator) -> np.array:
+    if kind == "opaque":
+        return np.full((size, size), 255, dtype=np.uint8)
+    elif kind == "random":
+        return rng.integers(0, 256, (size, size), dtype=np.uint8)
+    elif kind == "sparse":
+        # Mostly transparent, like a small element on a big layer
+        alpha = np.zeros((size, size), dtype=np.uint8)
+        alpha[rng.random((size, size)) < 0.1] = 255
+        return alpha
+    elif kind == "gradient":
+        return np.broadcast_to(np.linspace(0, 255, size).astype(np.uint8), (size, size)).copy()
+    raise ValueError(f"Unknown alpha distribution: {kind}")
+
+
+def make_inputs(scenario: Scenario, size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    fg = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    bg = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    fg[:, :, 3] = make_alpha(scenario.alpha, size, rng)
+    bg[:, :, 3] = 255
+    mask = rng.integers(0, 256, (size, size), dtype=np.uint8) if scenario.masked else None
+    return fg, bg, mask
+
+
+def run_one(blend: BlendMode, engine: str, fg: np.array, bg: np.array, mask: np.array or None, opacity: float,
+            repeat: int) -> dict:
+    """ Time one blend. Returns the best time of several runs, and the peak memory allocated by a single run.
+    Memory is measured in a separate run, since tracing allocations slows them down.
+    """
+    use_lut = engine == "lut"
+
+    def blend_once():
+        composite_image_data(fg=fg, bg=bg, blend_mode=blend, mask=mask, opacity=opacity, use_lut=use_lut)
+
+    # Start from an empty scratch pool, so the peak includes the blend's temporaries
+    get_scratch_pool().clear()
+    tracemalloc.start()
+    blend_once()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        blend_once()
+        best = min(best, time.perf_counter() - start)
+
+    pixels = fg.shape[0] * fg.shape[1]
+    return {"seconds": best, "mpix_per_s": pixels / best / 1e6, "peak_bytes": peak}
+
+
+def run(blend_modes: List[BlendMode], sizes: List[int], scenarios: List[Scenario], engines: List[str],
+        repeat: int) -> List[dict]:
+    results = []
+    with np.errstate(all='ignore'):
+        for size in sizes:
+            for scenario in scenarios:
+                fg, bg, mask = make_inputs(scenario, size)
+                for blend in blend_modes:
+                    for engine in engines:
+                        if engine == "lut" and blend.name not in blend_luts.SEPARABLE_BLEND_MODES:
+                            continue
+                        key = {"blend_mode": blend.name, "size": size, "scenario": scenario.name, "engine": engine}
+                        try:
+                            timing = run_one(blend, engine, fg, bg, mask, scenario.opacity, repeat)
+                        except NotImplementedError:
+                            continue
+                        results.append({**key, **timing})
+                        print(f"{blend.name:<14} {engine:<5} {size:>5}^2 {scenario.name:<14} "
+                              f"{timing['mpix_per_s']:>8.2f} Mpix/s  {timing['peak_bytes'] / 2 ** 20:>9.1f} MiB")
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    return result["blend_mode"], result["size"], result["scenario"], result["engine"]
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[dict]:
+    """ Print the change in throughput against a baseline. Returns the results that got slower than the threshold. """
+    baseline = {result_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        change = result["mpix_per_s"] / before["mpix_per_s"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(result)
+            flag = "  REGRESSION"
+        print(f"{result['blend_mode']:<14} {result['engine']:<5} {result['size']:>5}^2 {result['scenario']:<14} "
+              f"{before['mpix_per_s']:>8.2f} -> {result['mpix_per_s']:>8.2f} Mpix/s ({change:+.1%}){flag}")
+    return regressions
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=THIS_DIR).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark every blend mode.")
+    parser.add_argument("blend_modes", nargs="*", help="Blend mode names. Defaults to all of them.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help=f"Canvas sizes (width and height). Up to {SIZES[-1]} is supported.")
+    parser.add_argument("--scenarios", nargs="+", choices=[s.name for s in SCENARIOS],
+                        default=[s.name for s in SCENARIOS])
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Compare results to this JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Fractional slowdown that counts as a regression when comparing.")
+    args = parser.parse_args(args)
+
+    if args.blend_modes:
+        blend_modes = [BlendMode.from_name(name) for name in args.blend_modes]
+    else:
+        blend_modes = list(ALL_BLEND_MODES)
+    scenarios = [s for s in SCENARIOS if s.name in args.scenarios]
+
+    results = run(blend_modes, args.sizes, scenarios, args.engines, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+""" End-to-end benchmark of loading and rendering PSD files.
+Synthetic PSD files are generated in a temporary folder (see synthetic_psd.py), then each stage is timed separately:
+parsing, channel decoding, render_psd, render_layers and render_groups. Everything runs offline:
+
+    benchmark_render.py --presets small medium --output before.json
+    benchmark_render.py --width 4096 --height 4096 --layers 100 --nesting 3 --blend-modes normal multiply
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from benchmark_blend_modes import metadata
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render import render
+from synthetic_psd import generate_psd
+
+
+STAGES = ("parse", "decode", "render_psd", "render_layers", "render_groups")
+
+
+class Preset:
+    def __init__(self, name: str, width: int, height: int, layers: int, nesting: int = 0,
+                 blend_modes: tuple = ("normal",), masks: float = 0.0, compression: str = "rle", depth: int = 8):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.layers = layers
+        self.nesting = nesting
+        self.blend_modes = blend_modes
+        self.masks = masks
+        self.compression = compression
+        self.depth = depth
+
+    def to_dict(self) -> dict:
+        return dict(vars(self), blend_modes=list(self.blend_modes))
+
+
+MIXED_BLEND_MODES = ("normal", "multiply", "screen", "overlay", "soft light", "color dodge")
+
+PRESETS = (
+    Preset("small", width=512, height=512, layers=10),
+    Preset("medium", width=2048, height=2048, layers=30, nesting=2, blend_modes=MIXED_BLEND_MODES, masks=0.2),
+    Preset("large", width=4096, height=4096, layers=100, nesting=3, blend_modes=MIXED_BLEND_MODES, masks=0.2),
+    Preset("raw", width=2048, height=2048, layers=30, nesting=2, blend_modes=MIXED_BLEND_MODES, compression="raw"),
+    Preset("deep", width=1024, height=1024, layers=40, nesting=5, blend_modes=MIXED_BLEND_MODES, masks=0.5),
+)
+DEFAULT_PRESETS = ("small", "medium")
+
+
+def decode_channels(psd: PSDFile):
+    """ Force every channel of a lazily decoded file to be decoded. """
+    for layer in psd.layers:
+        for channel in layer.channels:
+            _ = channel.channel_data
+
+
+def time_stages(file_path: str, output_dir: str) -> dict:
+    """ Time each stage once. Stages run in order, and each one reuses the file parsed by the first. """
+    timings = {}
+
+    def timed(stage: str, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    psd = timed("parse", lambda: PSDFile(file_path, lazy_decode=True))
+    timed("decode", lambda: decode_channels(psd))
+
+    layers_dir = os.path.join(output_dir, "layers")
+    groups_dir = os.path.join(output_dir, "groups")
+    os.makedirs(layers_dir, exist_ok=True)
+    os.makedirs(groups_dir, exist_ok=True)
+    timed("render_psd", lambda: render.render_psd(psd, os.path.join(output_dir, "render.png"), overwrite=True))
+    timed("render_layers", lambda: render.render_layers(psd, layers_dir, overwrite=True))
+    timed("render_groups", lambda: render.render_groups(psd, groups_dir, overwrite=True))
+    return timings
+
+
+def run_preset(preset: Preset, work_dir: str, repeat: int, seed: int) -> dict:
+    file_path = os.path.join(work_dir, f"{preset.name}.psd")
+    generate_psd(file_path, width=preset.width, height=preset.height, layer_count=preset.layers,
+                 nesting_depth=preset.nesting, blend_modes=preset.blend_modes, mask_ratio=preset.masks,
+                 compression=preset.compression, depth=preset.depth, seed=seed)
+    result = {"preset": preset.to_dict(), "file_bytes": os.path.getsize(file_path)}
+
+    best = {}
+    try:
+        with np.errstate(all='ignore'):
+            for _ in range(repeat):
+                timings = time_stages(file_path, os.path.join(work_dir, preset.name))
+                for stage, seconds in timings.items():
+                    best[stage] = min(best.get(stage, float("inf")), seconds)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = best
+    return result
+
+
+def print_result(result: dict):
+    preset = result["preset"]
+    print(f"{preset['name']:<10} {preset['width']}x{preset['height']}, {preset['layers']} layers, "
+          f"nesting {preset['nesting']}, {preset['compression']}, {preset['depth']}-bit, "
+          f"{result['file_bytes'] / 2 ** 20:.1f} MiB")
+    for stage in STAGES:
+        if stage in result["seconds"]:
+            print(f"    {stage:<14} {result['seconds'][stage]:>9.3f} s")
+    if "error" in result:
+        print(f"    failed: {result['error']}")
+
+
+def run(presets: List[Preset], repeat: int, seed: int) -> List[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for preset in presets:
+            result = run_preset(preset, work_dir, repeat, seed)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark loading and rendering synthetic PSD files.")
+    parser.add_argument("--presets", nargs="+", choices=[p.name for p in PRESETS], default=DEFAULT_PRESETS)
+    parser.add_argument("--width", type=int, help="Benchmark a custom file instead of the presets.")
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--layers", type=int, default=10)
+    parser.add_argument("--nesting", type=int, default=0)
+    parser.add_argument("--blend-modes", nargs="+", default=["normal"])
+    parser.add_argument("--masks", type=float, default=0.0)
+    parser.add_argument("--compression", choices=["raw", "rle"], default="rle")
+    parser.add_argument("--depth", type=int, choices=[8, 16, 32], default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args(args)
+
+    if args.width is not None:
+        presets = [Preset("custom", width=args.width, height=args.height or args.width, layers=args.layers,
+                          nesting=args.nesting, blend_modes=tuple(args.blend_modes), masks=args.masks,
+                          compression=args.compression, depth=args.depth)]
+    else:
+        presets = [p for p in PRESETS if p.name in args.presets]
+
+    results = run(presets, args.repeat, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,454 @@
+""" Generate synthetic PSD files for testing and benchmarking.
+The files are written from scratch, so any canvas size, layer count, group nesting depth, blend mode mix, mask ratio,
+compression and bit depth can be produced without Photoshop:
+
+    synthetic_psd.py out.psd --width 4096 --height 4096 --layers 50 --nesting 3 --blend-modes normal multiply screen
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import struct
+import sys
+import zlib
+from collections import namedtuple
+from typing import List, Sequence
+
+import numpy as np
+
+from photoshoppy.models.blend_mode.model import BlendMode
+from photoshoppy.utilities.descriptor import UnitFloat
+from photoshoppy.utilities.packbits import pack_bits
+from photoshoppy.utilities.rect import Rect
+
+
+COMPRESSION_RAW = 0
+COMPRESSION_RLE = 1
+COMPRESSION_ZIP = 2
+COMPRESSION_ZIP_PREDICTION = 3
+COMPRESSION_METHODS = {"raw": COMPRESSION_RAW, "rle": COMPRESSION_RLE, "zip": COMPRESSION_ZIP,
+                       "zip prediction": COMPRESSION_ZIP_PREDICTION}
+
+DIVIDER_OPEN_FOLDER = 1
+DIVIDER_BOUNDING_SECTION = 3
+
+FLAG_HIDDEN = 1 << 1
+
+MASK_FLAG_DISABLED = 1 << 1
+MASK_FLAG_INVERTED = 1 << 2
+
+CHANNEL_ALPHA = -1
+CHANNEL_USER_MASK = -2
+
+COLOR_MODES = {"Grayscale": 1, "Indexed": 2, "RGB": 3, "CMYK": 4, "Lab": 9}
+COLOR_MODE_CHANNELS = {"Grayscale": 1, "Indexed": 1, "RGB": 3, "CMYK": 4, "Lab": 3}
+
+# Descriptor values that don't map to a Python type; UnitFloat values are written as unit floats
+DescriptorObject = namedtuple("DescriptorObject", "class_id items")
+Enumerated = namedtuple("Enumerated", "type_id value")
+
+
+class SyntheticLayer:
+    def __init__(self, name: str, rect: Rect, channels: dict, blend_mode: str = "normal", opacity: int = 255,
+                 visible: bool = True, mask_rect: Rect or None = None, mask: np.array or None = None,
+                 mask_default_color: int = 0, mask_flags: int = 0, blending_ranges: List[tuple] or None = None,
+                 layer_info: List[tuple] or None = None):
+        self.name = name
+        self.rect = rect
+        self.channels = channels  # Channel id -> 2D array
+        self.blend_mode = blend_mode
+        self.opacity = opacity
+        self.visible = visible
+        self.mask_rect = mask_rect
+        self.mask = mask
+        self.mask_default_color = mask_default_color
+        self.mask_flags = mask_flags
+        # (black low, black high, white low, white high) for the gray source and destination, then each channel's
+        self.blending_ranges = blending_ranges
+        self.layer_info = layer_info or []  # (key, data) for additional layer info blocks
+
+
+def adjustment_layer(name: str, key: str, data: bytes = b"", **kwargs) -> SyntheticLayer:
+    """ An adjustment layer: no pixels of its own, and a layer info block with the adjustment's settings. """
+    empty = np.zeros((0, 0), dtype=np.uint8)
+    channels = {CHANNEL_ALPHA: empty, 0: empty, 1: empty, 2: empty}
+    return SyntheticLayer(name, Rect(0, 0, 0, 0), channels, layer_info=[(key, data)], **kwargs)
+
+
+def fill_layer(name: str, key: str, items: dict, **kwargs) -> SyntheticLayer:
+    """ A fill layer: no pixels of its own, and a layer info block with a descriptor of the fill's settings. """
+    return adjustment_layer(name, key, struct.pack(">L", 16) + descriptor("null", items), **kwargs)
+
+
+def descriptor(class_id: str, items: dict) -> bytes:
+    """ Encode a descriptor. Items are bools, ints, floats, strings, lists, UnitFloats, Enumerateds and
+    DescriptorObjects.
+    """
+    data = _unicode_string("") + _descriptor_id(class_id) + struct.pack(">L", len(items))
+    for key, value in items.items():
+        data += _descriptor_id(key) + _descriptor_value(value)
+    return data
+
+
+def pattern_info(patterns: List[tuple]) -> bytes:
+    """ Encode a 'Patt' block from (pattern ID, planes) pairs. Planes are 8-bit red, green, blue and optionally alpha.
+    """
+    data = b""
+    for pattern_id, planes in patterns:
+        height, width = planes[0].shape
+        arrays = b""
+        # 24 channels, a user mask and a sheet mask; the pattern's alpha is stored as the user mask
+        slots = {i: plane for i, plane in enumerate(planes[:3])}
+        if len(planes) > 3:
+            slots[24] = planes[3]
+        for i in range(26):
+            if i not in slots:
+                arrays += struct.pack(">L", 0)
+                continue
+            array = struct.pack(">L4LHB", 8, 0, 0, height, width, 8, COMPRESSION_RAW)
+            array += np.ascontiguousarray(slots[i], dtype=np.uint8).tobytes()
+            arrays += struct.pack(">2L", 1, len(array)) + array
+        array_list = struct.pack(">4LL", 0, 0, height, width, 24) + arrays
+
+        encoded_id = pattern_id.encode("utf-8")
+        pattern = struct.pack(">2L2H", 1, 3, height, width) + _unicode_string("pattern")
+        pattern += struct.pack(">B", len(encoded_id)) + encoded_id
+        pattern += struct.pack(">2L", 3, len(array_list)) + array_list
+        pattern = struct.pack(">L", len(pattern)) + pattern
+        data += pattern + bytes(-len(pattern) % 4)
+    return data
+
+
+def vector_mask_info(subpaths: List[tuple], flags: int = 0, fills_all: bool = False) -> bytes:
+    """ Encode a 'vmsk' block from (closed, operation, knots) subpaths. Knots are (preceding, anchor, leaving) points,
+    as (x, y) fractions of the document's width and height.
+    """
+    data = struct.pack(">2L", 3, flags)
+    data += struct.pack(">2H", 8, int(fills_all)).ljust(26, b"\x00")
+    for closed, operation, knots in subpaths:
+        data += struct.pack(">2Hh", 0 if closed else 3, len(knots), operation).ljust(26, b"\x00")
+        for knot in knots:
+            values = [round(value * (1 << 24)) for x, y in knot for value in (y, x)]
+            data += struct.pack(">H6i", 1 if closed else 4, *values)
+    return data
+
+
+class SyntheticGroup:
+    def __init__(self, name: str, children: List[SyntheticLayer or SyntheticGroup], blend_mode: str = "pass through",
+                 opacity: int = 255, visible: bool = True):
+        self.name = name
+        self.children = children  # Bottom to top
+        self.blend_mode = blend_mode
+        self.opacity = opacity
+        self.visible = visible
+
+
+def generate_psd(file_path: str, width: int = 1024, height: int = 1024, layer_count: int = 10, nesting_depth: int = 0,
+                 group_fanout: int = 2, blend_modes: Sequence[str] = ("normal",),
+                 group_blend_modes: Sequence[str] = ("pass through", "normal"), mask_ratio: float = 0.0,
+                 compression: str = "rle", depth: int = 8, seed: int = 0) -> str:
+    """ Write a PSD file filled with randomly placed layers. Returns the file path. """
+    rng = np.random.default_rng(seed)
+    layers = [_random_layer(f"layer_{i}", width, height, depth, rng, blend_modes, mask_ratio) for i in
+              range(layer_count)]
+    tree = _build_tree(layers, nesting_depth, group_fanout, group_blend_modes, rng, name="group")
+    write_psd(file_path, width, height, tree, depth=depth, compression=compression)
+    return file_path
+
+
+def write_psd(file_path: str, width: int, height: int, layers: List[SyntheticLayer or SyntheticGroup],
+              depth: int = 8, compression: str = "rle", color_mode: str = "RGB", color_mode_data: bytes = b"",
+              merged: List[np.array] or None = None, global_layer_info: List[tuple] or None = None):
+    """ Write a PSD file from a tree of synthetic layers, listed bottom to top. Layer channels must match the color
+    mode. The merged image is left blank unless its planes are given; like Photoshop, it's written with RLE when layers
+    are ZIP compressed. global_layer_info is (key, data) for the document's own additional layer info blocks.
+    """
+    compression_method = COMPRESSION_METHODS[compression]
+    records = _flatten_tree(layers)
+    if merged is None:
+        merged = [np.zeros((height, width), dtype=_dtype(depth))] * COLOR_MODE_CHANNELS[color_mode]
+
+    with open(file_path, "wb") as f:
+        # File header
+        f.write(b"8BPS")
+        f.write(struct.pack(">H", 1))
+        f.write(bytes(6))
+        f.write(struct.pack(">H2LHH", len(merged), height, width, depth, COLOR_MODES[color_mode]))
+
+        # Color mode data and image resources
+        f.write(struct.pack(">L", len(color_mode_data)))
+        f.write(color_mode_data)
+        f.write(struct.pack(">L", 0))
+
+        # Layer and mask information
+        layer_info = _layer_info(records, depth, compression_method)
+        additional_info = b""
+        for key, info in global_layer_info or []:
+            info += bytes(-len(info) % 4)
+            additional_info += b"8BIM" + key.encode("utf-8") + struct.pack(">L", len(info)) + info
+        f.write(struct.pack(">L", len(layer_info) + 4 + 4 + len(additional_info)))
+        f.write(struct.pack(">L", len(layer_info)))
+        f.write(layer_info)
+        f.write(struct.pack(">L", 0))  # Global layer mask info
+        f.write(additional_info)
+
+        # Merged image data
+        merged_compression = min(compression_method, COMPRESSION_RLE)
+        f.write(struct.pack(">H", merged_compression))
+        f.write(_encode_planes(merged, depth, merged_compression))
+
+
+def _dtype(depth: int) -> np.dtype:
+    return {8: np.dtype(">u1"), 16: np.dtype(">u2"), 32: np.dtype(">f4")}[depth]
+
+
+def _random_layer(name: str, width: int, height: int, depth: int, rng: np.random.Generator,
+                  blend_modes: Sequence[str], mask_ratio: float) -> SyntheticLayer:
+    # Layers range from small elements to full bleed, and may hang off the canvas
+    layer_w = int(rng.integers(max(1, width // 8), width + 1))
+    layer_h = int(rng.integers(max(1, height // 8), height + 1))
+    top = int(rng.integers(-layer_h // 4, height - layer_h // 2 + 1))
+    left = int(rng.integers(-layer_w // 4, width - layer_w // 2 + 1))
+    rect = Rect(top, left, top + layer_h, left + layer_w)
+
+    # Smooth color gradients with an elliptical alpha, so RLE has something to compress
+    y = np.linspace(0, 1, layer_h)[:, None]
+    x = np.linspace(0, 1, layer_w)[None, :]
+    color = rng.random((3, 2))
+    channels = {}
+    for channel_id in range(3):
+        start, end = color[channel_id]
+        channels[channel_id] = _quantize(np.broadcast_to(start + (end - start) * (x + y) / 2, (layer_h, layer_w)),
+                                         depth)
+    ellipse = ((x - 0.5) ** 2 + (y - 0.5) ** 2) <= 0.25
+    channels[CHANNEL_ALPHA] = _quantize(ellipse.astype(np.float64), depth)
+
+    mask_rect = None
+    mask = None
+    if rng.random() < mask_ratio:
+        mask_rect = rect
+        mask = _quantize(np.broadcast_to(x, (layer_h, layer_w)), depth)
+
+    return SyntheticLayer(name, rect, channels, blend_mode=str(rng.choice(list(blend_modes))),
+                          opacity=int(rng.choice([255, 255, 255, 200, 128])), mask_rect=mask_rect, mask=mask)
+
+
+def _quantize(values: np.array, depth: int) -> np.array:
+    if depth == 32:
+        return values.astype(np.float32)
+    maximum = (1 << depth) - 1
+    return np.round(values * maximum).astype(np.uint8 if depth == 8 else np.uint16)
+
+
+def _build_tree(layers: List[SyntheticLayer], nesting_depth: int, fanout: int, group_blend_modes: Sequence[str],
+                rng: np.random.Generator, name: str) -> List[SyntheticLayer or SyntheticGroup]:
+    """ Keep a share of the layers at this level, and split the rest between nested groups. """
+    if nesting_depth == 0 or len(layers) < 2:
+        return layers
+
+    direct = len(layers) // (fanout + 1)
+    children = list(layers[:direct])
+    remaining = layers[direct:]
+    for i in range(fanout):
+        share = remaining[i * len(remaining) // fanout:(i + 1) * len(remaining) // fanout]
+        if not share:
+            continue
+        group_name = f"{name}_{i}"
+        group_children = _build_tree(share, nesting_depth - 1, fanout, group_blend_modes, rng, name=group_name)
+        children.append(SyntheticGroup(group_name, group_children, blend_mode=str(rng.choice(list(group_blend_modes)))))
+    return children
+
+
+def _flatten_tree(layers: List[SyntheticLayer or SyntheticGroup]) -> List[tuple]:
+    """ Convert a layer tree to layer records, bottom to top. Groups are stored as a bounding section divider, then
+    their children, then the group itself.
+    """
+    records = []
+    for layer in layers:
+        if isinstance(layer, SyntheticGroup):
+            records.append(("divider", layer))
+            records.extend(_flatten_tree(layer.children))
+            records.append(("group", layer))
+        else:
+            records.append(("layer", layer))
+    return records
+
+
+def _layer_info(records: List[tuple], depth: int, compression: int) -> bytes:
+    record_data = io.BytesIO()
+    channel_data = io.BytesIO()
+    record_data.write(struct.pack(">h", len(records)))
+
+    for kind, layer in records:
+        if kind == "layer":
+            rect = layer.rect
+            planes = dict(layer.channels)
+            if layer.mask is not None:
+                planes[CHANNEL_USER_MASK] = layer.mask
+        else:
+            rect = Rect(0, 0, 0, 0)
+            empty = np.zeros((0, 0), dtype=_dtype(depth))
+            planes = {CHANNEL_ALPHA: empty, 0: empty, 1: empty, 2: empty}
+
+        encoded = {channel_id: struct.pack(">H", compression) + _encode_planes([plane], depth, compression)
+                   for channel_id, plane in planes.items()}
+
+        record_data.write(struct.pack(">4i", *rect))
+        record_data.write(struct.pack(">H", len(encoded)))
+        for channel_id, data in encoded.items():
+            record_data.write(struct.pack(">hL", channel_id, len(data)))
+            channel_data.write(data)
+
+        if kind == "divider":
+            blend_mode = BlendMode.from_name("normal")
+        else:
+            blend_mode = BlendMode.from_name(layer.blend_mode)
+        flags = 0 if layer.visible else FLAG_HIDDEN
+        record_data.write(b"8BIM")
+        record_data.write(blend_mode.key.encode("utf-8"))
+        record_data.write(struct.pack(">BBBB", layer.opacity, 0, flags, 0))
+
+        extra_data = _extra_data(kind, layer)
+        record_data.write(struct.pack(">L", len(extra_data)))
+        record_data.write(extra_data)
+
+    data = record_data.getvalue() + channel_data.getvalue()
+    if len(data) % 2:
+        data += b"\x00"
+    return data
+
+
+def _extra_data(kind: str, layer: SyntheticLayer or SyntheticGroup) -> bytes:
+    data = io.BytesIO()
+
+    # Layer mask data
+    if kind == "layer" and layer.mask is not None:
+        data.write(struct.pack(">L", 20))
+        data.write(struct.pack(">4i", *layer.mask_rect))
+        data.write(struct.pack(">BBH", layer.mask_default_color, layer.mask_flags, 0))
+    else:
+        data.write(struct.pack(">L", 0))
+
+    # Blending ranges; gray plus 3 channels, at their defaults unless the layer has its own
+    blending_ranges = layer.blending_ranges if kind == "layer" else None
+    blending_ranges = blending_ranges or [(0, 0, 255, 255)] * 8
+    data.write(struct.pack(">L", 4 * len(blending_ranges)))
+    for blend_range in blending_ranges:
+        data.write(struct.pack(">4B", *blend_range))
+
+    # Layer name
+    name = "</Layer group>" if kind == "divider" else layer.name
+    data.write(_pascal_string(name, padding=4))
+
+    # Additional layer info
+    if kind == "layer":
+        for key, info in layer.layer_info:
+            if len(info) % 2:
+                info += b"\x00"
+            data.write(b"8BIM" + key.encode("utf-8"))
+            data.write(struct.pack(">L", len(info)))
+            data.write(info)
+
+    # Section divider
+    if kind != "layer":
+        if kind == "group":
+            section = struct.pack(">L", DIVIDER_OPEN_FOLDER) + b"8BIM" + BlendMode.from_name(
+                layer.blend_mode).key.encode("utf-8")
+        else:
+            section = struct.pack(">L", DIVIDER_BOUNDING_SECTION)
+        data.write(b"8BIMlsct")
+        data.write(struct.pack(">L", len(section)))
+        data.write(section)
+
+    return data.getvalue()
+
+
+def _pascal_string(value: str, padding: int) -> bytes:
+    encoded = value.encode("utf-8")[:255]
+    data = struct.pack(">B", len(encoded)) + encoded
+    if len(data) % padding:
+        data += bytes(padding - len(data) % padding)
+    return data
+
+
+def _unicode_string(value: str) -> bytes:
+    return struct.pack(">L", len(value)) + value.encode("utf-16-be")
+
+
+def _descriptor_id(value: str) -> bytes:
+    """ Four character IDs are written with a length of 0. """
+    encoded = value.encode("utf-8")
+    return struct.pack(">L", 0 if len(encoded) == 4 else len(encoded)) + encoded
+
+
+def _descriptor_value(value) -> bytes:
+    if isinstance(value, bool):
+        return b"bool" + struct.pack(">?", value)
+    if isinstance(value, int):
+        return b"long" + struct.pack(">i", value)
+    if isinstance(value, float):
+        return b"doub" + struct.pack(">d", value)
+    if isinstance(value, str):
+        return b"TEXT" + _unicode_string(value + "\x00")
+    if isinstance(value, list):
+        return b"VlLs" + struct.pack(">L", len(value)) + b"".join(_descriptor_value(item) for item in value)
+    if isinstance(value, UnitFloat):
+        return b"UntF" + value.unit.encode("utf-8") + struct.pack(">d", value.value)
+    if isinstance(value, Enumerated):
+        return b"enum" + _descriptor_id(value.type_id) + _descriptor_id(value.value)
+    if isinstance(value, DescriptorObject):
+        return b"Objc" + descriptor(value.class_id, value.items)
+    raise TypeError(f"Can't encode {value!r} in a descriptor")
+
+
+def _encode_planes(planes: List[np.array], depth: int, compression: int) -> bytes:
+    """ Encode channel planes as raw, RLE or ZIP scanlines. RLE byte counts for every row come first. """
+    if compression == COMPRESSION_ZIP:
+        return zlib.compress(b"".join(np.ascontiguousarray(plane, dtype=_dtype(depth)).tobytes() for plane in planes))
+    if compression == COMPRESSION_ZIP_PREDICTION:
+        return zlib.compress(b"".join(_predict(plane, depth) for plane in planes))
+
+    rows = [np.ascontiguousarray(plane, dtype=_dtype(depth))[row].tobytes() for plane in planes
+            for row in range(plane.shape[0])]
+    if compression == COMPRESSION_RAW:
+        return b"".join(rows)
+
+    packed = [pack_bits(row) for row in rows]
+    return struct.pack(f">{len(packed)}H", *[len(row) for row in packed]) + b"".join(packed)
+
+
+def _predict(plane: np.array, depth: int) -> bytes:
+    """ Store each pixel as its difference from the one to its left. 32-bit rows are split into a plane for each byte
+    of the floats, and differenced byte by byte.
+    """
+    if depth == 32:
+        data = np.ascontiguousarray(plane, dtype=_dtype(depth)).view(np.uint8).reshape(*plane.shape, 4)
+        data = data.transpose(0, 2, 1).reshape(plane.shape[0], plane.shape[1] * 4)
+    else:
+        data = np.asarray(plane).astype(_dtype(depth).newbyteorder("="))
+    deltas = np.diff(data, axis=1, prepend=np.zeros((data.shape[0], 1), dtype=data.dtype))
+    return deltas.astype(_dtype(8) if depth == 32 else _dtype(depth)).tobytes()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Generate a synthetic PSD file.")
+    parser.add_argument("file_path")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=10)
+    parser.add_argument("--nesting", type=int, default=0, help="Maximum group nesting depth.")
+    parser.add_argument("--fanout", type=int, default=2, help="Number of groups inside each group.")
+    parser.add_argument("--blend-modes", nargs="+", default=["normal"])
+    parser.add_argument("--masks", type=float, default=0.0, help="Fraction of layers with a layer mask.")
+    parser.add_argument("--compression", choices=list(COMPRESSION_METHODS), default="rle")
+    parser.add_argument("--depth", type=int, choices=[8, 16, 32], default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    generate_psd(args.file_path, width=args.width, height=args.height, layer_count=args.layers,
+                 nesting_depth=args.nesting, group_fanout=args.fanout, blend_modes=args.blend_modes,
+                 mask_ratio=args.masks, compression=args.compression, depth=args.depth, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render_plan import OpType, RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, SyntheticGroup, SyntheticLayer, adjustment_layer, write_psd
+
+
+WIDTH = 96
+HEIGHT = 64
+REGION = Rect(9, 13, 50, 81)
+MASK_RECT = Rect(10, 20, 40, 70)
+DEFAULT_LEVELS = (0, 255, 0, 255, 100)
+
+
+def levels(records: list) -> bytes:
+    records = records + [DEFAULT_LEVELS] * (29 - len(records))
+    return struct.pack(">H", 2) + b"".join(struct.pack(">5H", *record) for record in records)
+
+
+def curves(points: dict) -> bytes:
+    """ Curves for channels 0 (composite) to 3 (blue), each a list of (input, output) points. """
+    data = struct.pack(">BHI", 0, 1, sum(1 << channel for channel in points))
+    for channel in sorted(points):
+        data += struct.pack(">H", len(points[channel]))
+        data += b"".join(struct.pack(">2H", output, point_input) for point_input, output in points[channel])
+    return data
+
+
+def hue_saturation(master: tuple, colorization: tuple or None = None) -> bytes:
+    data = struct.pack(">HBB", 2, colorization is not None, 0) + struct.pack(">3h", *(colorization or (0, 25, 0)))
+    return data + struct.pack(">3h", *master) + bytes(14 * 6)
+
+
+def base_layer(depth: int = 8) -> SyntheticLayer:
+    rng = np.random.default_rng(3)
+    dtype = np.uint8 if depth == 8 else np.uint16
+    maximum = np.iinfo(dtype).max
+    channels = {i: rng.integers(0, maximum + 1, (HEIGHT, WIDTH), dtype=dtype) for i in range(3)}
+    # A ramp through every 8-bit value, and some transparency
+    channels[0][0, :] = np.linspace(0, maximum, WIDTH).astype(dtype)
+    channels[CHANNEL_ALPHA] = np.full((HEIGHT, WIDTH), maximum, dtype=dtype)
+    channels[CHANNEL_ALPHA][HEIGHT // 2:, :WIDTH // 3] = maximum // 3
+    return SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), channels)
+
+
+def render(temp_dir: str, name: str, layers: list, depth: int = 8, **kwargs) -> np.array:
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers, depth=depth)
+    return RenderPlan.from_psd(PSDFile(file_path), **kwargs).execute()
+
+
+def gray(rgb: np.array) -> np.array:
+    r, g, b = [rgb[:, :, i].astype(np.uint32) for i in range(3)]
+    return ((77 * r + 151 * g + 28 * b + 128) >> 8).astype(np.uint8)
+
+
+def reference_levels(values: np.array, record: tuple) -> np.array:
+    input_floor, input_ceiling, output_floor, output_ceiling, gamma = record
+    values = np.clip((values / 255 - input_floor / 255) / ((input_ceiling - input_floor) / 255), 0, 1)
+    return (output_floor + values ** (100 / gamma) * (output_ceiling - output_floor)) / 255
+
+
+def check_luts(temp_dir: str, base: np.array):
+    """ Each adjustment maps the colors underneath it, and leaves their alpha alone. """
+    rgb = base[:, :, :3].astype(np.float64)
+    master, red = (10, 240, 5, 250, 130), (30, 200, 0, 255, 80)
+    level_values = np.empty(rgb.shape)
+    level_values[:, :, 0] = reference_levels(reference_levels(rgb[:, :, 0], red) * 255, master)
+    level_values[:, :, 1:] = reference_levels(rgb[:, :, 1:], master)
+    posterized = np.floor(rgb * 4 / 256) * 255 / 3
+    thresholded = np.repeat(np.where(gray(base) >= 100, 255, 0)[:, :, None], 3, axis=2)
+
+    cases = {
+        "invert": (adjustment_layer("invert", "nvrt"), 255 - rgb),
+        "levels": (adjustment_layer("levels", "levl", levels([master, red])), np.around(level_values * 255)),
+        "posterize": (adjustment_layer("posterize", "post", struct.pack(">2H", 4, 0)), np.around(posterized)),
+        "threshold": (adjustment_layer("threshold", "thrs", struct.pack(">2H", 100, 0)), thresholded),
+    }
+    for name, (layer, expected) in cases.items():
+        image_data = render(temp_dir, name, [base_layer(), layer])
+        if not np.array_equal(image_data[:, :, :3], expected) or not np.array_equal(image_data[:, :, 3], base[:, :, 3]):
+            raise RuntimeError(f"{name} adjustment doesn't match its reference")
+
+
+def check_curves(temp_dir: str):
+    """ Curves pass through their points, and stay monotonic between increasing points. """
+    layer = adjustment_layer("curves", "curv", curves({0: [(0, 0), (128, 160), (255, 255)], 3: [(0, 255), (255, 0)]}))
+    image_data = render(temp_dir, "curves", [base_layer(), layer])
+    base = render(temp_dir, "curves_base", [base_layer()])
+
+    ramp_in, ramp_out = base[0, :, 0], image_data[0, :, 0]
+    for point_input, output in [(0, 0), (255, 255)]:
+        if ramp_out[ramp_in == point_input][0] != output:
+            raise RuntimeError(f"Curve doesn't pass through ({point_input}, {output})")
+    if np.any(np.diff(ramp_out.astype(int)) < 0) or not np.all(ramp_out[(ramp_in > 20) & (ramp_in < 235)] >
+                                                                ramp_in[(ramp_in > 20) & (ramp_in < 235)]):
+        raise RuntimeError("Curve should brighten the ramp monotonically")
+    # Blue is inverted by its own curve, then brightened by the composite curve
+    if not np.all(image_data[:, :, 2][base[:, :, 2] == 0] == 255):
+        raise RuntimeError("Blue curve should map 0 to 255")
+
+
+def check_folding(temp_dir: str, base: np.array):
+    """ Consecutive plain adjustments share one lookup table. Masked ones can't be folded into it. """
+    layers = [base_layer(), adjustment_layer("levels", "levl", levels([(0, 200, 0, 255, 100)])),
+              adjustment_layer("invert", "nvrt"), adjustment_layer("posterize", "post", struct.pack(">2H", 6, 0))]
+    file_path = os.path.join(temp_dir, "folded.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers)
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    if len([op for op in plan.ops if op.op_type == OpType.Adjustment]) != 1:
+        raise RuntimeError("Consecutive adjustments should be folded into one op")
+
+    levelled = np.around(np.clip(base[:, :, :3] / 200, 0, 1) * 255)
+    expected = np.around(np.floor((255 - levelled) * 6 / 256) * 255 / 5)
+    if not np.array_equal(plan.execute()[:, :, :3], expected):
+        raise RuntimeError("Folded adjustments don't match the adjustments applied one at a time")
+
+    mask = np.full((MASK_RECT.bottom - MASK_RECT.top, MASK_RECT.right - MASK_RECT.left), 255, dtype=np.uint8)
+    layers[2] = adjustment_layer("invert", "nvrt", mask_rect=MASK_RECT, mask=mask)
+    write_psd(file_path, WIDTH, HEIGHT, layers)
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    if len([op for op in plan.ops if op.op_type == OpType.Adjustment]) != 3:
+        raise RuntimeError("Masked adjustments shouldn't be folded")
+
+
+def check_masks(temp_dir: str, base: np.array):
+    """ Adjustments are mixed in by their mask and opacity, and can be rendered a region or tile at a time. """
+    rng = np.random.default_rng(9)
+    mask = rng.integers(0, 256, (MASK_RECT.bottom - MASK_RECT.top, MASK_RECT.right - MASK_RECT.left), dtype=np.uint8)
+    layers = [base_layer(), adjustment_layer("invert", "nvrt", opacity=128, mask_rect=MASK_RECT, mask=mask)]
+    image_data = render(temp_dir, "masked", layers)
+
+    weight = np.zeros((HEIGHT, WIDTH))
+    weight[MASK_RECT.top:MASK_RECT.bottom, MASK_RECT.left:MASK_RECT.right] = mask / 255 * 128 / 255
+    rgb = base[:, :, :3].astype(np.float64)
+    expected = np.around(rgb + (255 - 2 * rgb) * weight[:, :, None])
+    if np.abs(image_data[:, :, :3] - expected).max() > 1:
+        raise RuntimeError("Masked adjustment doesn't match its reference")
+
+    file_path = os.path.join(temp_dir, "masked.psd")
+    region_data = RenderPlan.from_psd(PSDFile(file_path, lazy_decode=True), region=REGION).execute(tile_size=16)
+    if not np.array_equal(region_data, image_data[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+        raise RuntimeError("Adjustment rendered for a region doesn't match")
+
+
+def check_groups(temp_dir: str, base: np.array):
+    """ Adjustments inside an isolated group only change the group's own layers. """
+    rect = Rect(16, 24, 48, 72)
+    shape = (rect.bottom - rect.top, rect.right - rect.left)
+    channels = {i: np.full(shape, 40 * (i + 1), dtype=np.uint8) for i in range(3)}
+    channels[CHANNEL_ALPHA] = np.full(shape, 255, dtype=np.uint8)
+    group = SyntheticGroup("group", [SyntheticLayer("inner", rect, channels), adjustment_layer("invert", "nvrt")],
+                           blend_mode="normal")
+    image_data = render(temp_dir, "group", [base_layer(), group])
+
+    expected = base.copy()
+    expected[rect.top:rect.bottom, rect.left:rect.right] = [215, 175, 135, 255]
+    if not np.array_equal(image_data, expected):
+        raise RuntimeError("Adjustment inside a group changed layers outside of it")
+
+
+def check_hue_saturation(temp_dir: str):
+    colors = np.array([[255, 0, 0], [200, 100, 50], [90, 90, 90]], dtype=np.uint8)
+    channels = {i: np.repeat(colors[:, i][None, :], 2, axis=0) for i in range(3)}
+    channels[CHANNEL_ALPHA] = np.full((2, 3), 255, dtype=np.uint8)
+    layer = SyntheticLayer("colors", Rect(0, 0, 2, 3), channels)
+
+    cases = {
+        (120, 0, 0): [[0, 255, 0], [50, 200, 100], [90, 90, 90]],
+        (0, -100, 0): [[128, 128, 128], [125, 125, 125], [90, 90, 90]],
+        (0, 0, 50): [[255, 128, 128], [228, 178, 153], [173, 173, 173]],
+    }
+    for master, expected in cases.items():
+        image_data = render(temp_dir, "hue", [layer, adjustment_layer("hue", "hue2", hue_saturation(master))])
+        if np.abs(image_data[0, :3, :3].astype(int) - expected).max() > 1:
+            raise RuntimeError(f"Hue/saturation {master} gave {image_data[0, :3, :3].tolist()}")
+
+    # Colorizing without saturation leaves every pixel at its gray value
+    layers = [layer, adjustment_layer("colorize", "hue2", hue_saturation((0, 0, 0), colorization=(200, 0, 0)))]
+    image_data = render(temp_dir, "colorize", layers)
+    if image_data[0, :3, :3].tolist() != [[77] * 3, [125] * 3, [90] * 3]:
+        raise RuntimeError(f"Colorizing without saturation gave {image_data[0, :3, :3].tolist()}")
+
+
+def check_16_bit(temp_dir: str):
+    base = render(temp_dir, "16_base", [base_layer(16)], depth=16)
+    image_data = render(temp_dir, "16_invert", [base_layer(16), adjustment_layer("invert", "nvrt")], depth=16)
+    if np.abs(image_data[:, :, :3] - (1 - base[:, :, :3])).max() > 1 / 65535:
+        raise RuntimeError("16-bit invert doesn't match")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base = render(temp_dir, "base", [base_layer()])
+        check_luts(temp_dir, base)
+        check_curves(temp_dir)
+        check_folding(temp_dir, base)
+        check_masks(temp_dir, base)
+        check_groups(temp_dir, base)
+        check_hue_saturation(temp_dir)
+        check_16_bit(temp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
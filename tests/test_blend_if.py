@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.blend_if import uses_blend_if
+from photoshoppy.psd_render.compositing import gray_values
+from photoshoppy.psd_render.render_plan import OpType, RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, SyntheticGroup, SyntheticLayer, write_psd
+
+
+WIDTH = 100
+HEIGHT = 80
+LAYER_RECT = Rect(5, 10, 75, 95)
+MASK_RECT = Rect(20, 0, 60, 60)
+REGION = Rect(12, 7, 66, 83)
+DEFAULT_RANGE = (0, 0, 255, 255)
+
+
+def reference_weight(value: int, black_low: int, black_high: int, white_low: int, white_high: int) -> int:
+    if value < black_low or value > white_high:
+        return 0
+    black = 1 if value >= black_high else (value - black_low) / (black_high - black_low)
+    white = 1 if value <= white_low else (white_high - value) / (white_high - white_low)
+    return int(np.around(min(black, white) * 255))
+
+
+def reference_weights(values: np.array, blend_range: tuple) -> np.array:
+    lut = np.array([reference_weight(v, *blend_range) for v in range(256)], dtype=np.uint16)
+    return lut[values]
+
+
+def gray(rgb: dict) -> np.array:
+    r, g, b = [rgb[i].astype(np.uint32) for i in range(3)]
+    return ((77 * r + 151 * g + 28 * b + 128) >> 8).astype(np.uint8)
+
+
+def make_layers(ranges: list or None, mask: np.array or None = None, mask_rect: Rect or None = None) -> list:
+    rng = np.random.default_rng(7)
+    shape = (LAYER_RECT.bottom - LAYER_RECT.top, LAYER_RECT.right - LAYER_RECT.left)
+    base = {i: rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8) for i in range(3)}
+    base[CHANNEL_ALPHA] = np.full((HEIGHT, WIDTH), 255, dtype=np.uint8)
+    top = {i: rng.integers(0, 256, shape, dtype=np.uint8) for i in range(3)}
+    top[CHANNEL_ALPHA] = rng.integers(0, 256, shape, dtype=np.uint8)
+    return [
+        SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), base),
+        SyntheticLayer("top", LAYER_RECT, top, blend_mode="screen", opacity=220, mask_rect=mask_rect, mask=mask,
+                       blending_ranges=ranges),
+    ]
+
+
+def expected_mask(layers: list, ranges: list, mask: np.array or None) -> np.array:
+    """ The layer-sized mask that hides the same pixels as a layer's blending ranges, and its own mask. """
+    base, top = layers[0].channels, layers[1].channels
+    under = {i: base[i][LAYER_RECT.top:LAYER_RECT.bottom, LAYER_RECT.left:LAYER_RECT.right] for i in range(3)}
+    weights = np.full(top[0].shape, 255, dtype=np.uint16)
+    values = [gray(top), gray(under)] + [plane[i] for i in range(3) for plane in [top, under]]
+    for blend_range, channel_values in zip(ranges, values):
+        if blend_range != DEFAULT_RANGE:
+            weights = (weights * reference_weights(channel_values, blend_range) + 127) // 255
+    if mask is not None:
+        padded = np.zeros(top[0].shape, dtype=np.uint16)
+        padded[MASK_RECT.top - LAYER_RECT.top:MASK_RECT.bottom - LAYER_RECT.top, :MASK_RECT.right - LAYER_RECT.left] =\
+            mask[:, LAYER_RECT.left - MASK_RECT.left:]
+        weights = (weights * padded + 127) // 255
+    return weights.astype(np.uint8)
+
+
+def render(file_path: str, use_luts: bool, region: Rect or None = None) -> np.array:
+    """ Regions are rendered in tiles, so that Blend If sees the underlying pixels a tile at a time. """
+    plan = RenderPlan.from_psd(PSDFile(file_path, lazy_decode=True), use_luts=use_luts, region=region)
+    return plan.execute(tile_size=None if region is None else 16)
+
+
+def check(name: str, temp_dir: str, ranges: list, mask: np.array or None = None):
+    layers = make_layers(ranges, mask, MASK_RECT if mask is not None else None)
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers)
+    expected_path = os.path.join(temp_dir, f"{name}_expected.psd")
+    write_psd(expected_path, WIDTH, HEIGHT, make_layers(None, expected_mask(layers, ranges, mask), LAYER_RECT))
+
+    for use_luts in [False, True]:
+        expected = render(expected_path, use_luts)
+        if not np.array_equal(render(file_path, use_luts), expected):
+            raise RuntimeError(f"{name} render doesn't match its equivalent mask (use_luts={use_luts})")
+        region_data = render(file_path, use_luts, region=REGION)
+        if not np.array_equal(region_data, expected[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+            raise RuntimeError(f"{name} tiled region render doesn't match (use_luts={use_luts})")
+
+
+def check_gray_values():
+    """ Known gray values, which don't depend on how NumPy casts mixed integer types. """
+    colors = np.array([[[255, 255, 255], [255, 0, 0], [0, 255, 0], [0, 0, 255], [200, 100, 50]]], dtype=np.uint8)
+    expected = [255, 77, 150, 28, 125]
+    if gray_values(colors)[0].tolist() != expected:
+        raise RuntimeError(f"8-bit gray values {gray_values(colors)[0].tolist()} should be {expected}")
+    if np.abs(gray_values(colors.astype(np.float32) / 255)[0] * 255 - expected).max() > 0.5:
+        raise RuntimeError("Float gray values don't match the 8-bit ones")
+
+
+def check_group(name: str, temp_dir: str, children: list):
+    """ Children that read the pixels underneath them see the group's own pixels, not the parent's, so their normal
+    group can't be merged into its parent. A multiply layer over the corner pixel keeps the reference group apart.
+    """
+    base = make_layers(None)[0]
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    write_psd(file_path, WIDTH, HEIGHT, [base, SyntheticGroup("group", children, blend_mode="normal")])
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    if not any(op.op_type == OpType.BeginGroup for op in plan.ops):
+        raise RuntimeError(f"{name} group shouldn't be merged into its parent")
+
+    corner = {i: np.full((1, 1), 255, dtype=np.uint8) for i in [0, 1, 2, CHANNEL_ALPHA]}
+    separate = children + [SyntheticLayer("corner", Rect(0, 0, 1, 1), corner, blend_mode="multiply")]
+    expected_path = os.path.join(temp_dir, f"{name}_expected.psd")
+    write_psd(expected_path, WIDTH, HEIGHT, [base, SyntheticGroup("group", separate, blend_mode="normal")])
+    image_data, expected = plan.execute(), render(expected_path, use_luts=False)
+    image_data[0, 0] = expected[0, 0]
+    if not np.array_equal(image_data, expected):
+        raise RuntimeError(f"{name} group doesn't match the same group kept apart from its parent")
+
+
+def main():
+    rng = np.random.default_rng(11)
+    mask = rng.integers(0, 256, (MASK_RECT.bottom - MASK_RECT.top, MASK_RECT.right - MASK_RECT.left), dtype=np.uint8)
+    check_gray_values()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Split sliders on the layer's own gray values
+        check("source_gray", temp_dir, [(30, 90, 170, 240)] + [DEFAULT_RANGE] * 7)
+
+        # Hard cut offs on the underlying red, and the layer's own blue, on top of a mask
+        check("channels", temp_dir, [DEFAULT_RANGE] * 3 + [(0, 0, 140, 140)] + [DEFAULT_RANGE] * 2 +
+              [(60, 60, 255, 255), DEFAULT_RANGE], mask)
+
+        # Every range at once
+        check("all", temp_dir, [(10, 40, 200, 250), (5, 5, 230, 250), (0, 20, 255, 255), (50, 50, 200, 200),
+                                (0, 0, 180, 220), (30, 100, 255, 255), (0, 0, 255, 255), (0, 60, 190, 255)], mask)
+
+        # Blend If on the underlying gray, and a pass-through group with a multiply layer, inside a normal group
+        top = make_layers([DEFAULT_RANGE, (0, 0, 140, 140)] + [DEFAULT_RANGE] * 6)[1]
+        top.blend_mode = "normal"
+        check_group("blend_if_group", temp_dir, [top])
+        multiply = make_layers(None)[1]
+        check_group("pass_through_group", temp_dir, [SyntheticGroup("pass through", [multiply], opacity=200)])
+
+        # Default ranges are skipped
+        file_path = os.path.join(temp_dir, "default.psd")
+        write_psd(file_path, WIDTH, HEIGHT, make_layers(None))
+        if any(uses_blend_if(layer) for layer in PSDFile(file_path).layers):
+            raise RuntimeError("Layers with default blending ranges shouldn't use Blend If")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import sys
+import tracemalloc
+
+import numpy as np
+
+from photoshoppy.models.blend_mode.model import ALL_BLEND_MODES, BlendMode
+from photoshoppy.psd_render import blend_modes
+from photoshoppy.psd_render.compositing import clamp, get_luminosity, get_saturation, set_luminosity, set_saturation
+from photoshoppy.psd_render.render_utils import composite_image_data
+from photoshoppy.psd_render.scratch import ScratchPool, get_scratch_pool
+
+
+SHAPE = (96, 128)
+
+# The blend functions as they were written before they became kernels, one array expression each. Kernels must match
+#   them exactly.
+REFERENCE_COLOR_FUNCTIONS = {
+    "normal": lambda fg, bg: fg,
+    "darken": lambda fg, bg: np.minimum(fg, bg),
+    "multiply": lambda fg, bg: fg * bg,
+    "color burn": lambda fg, bg: np.where(bg == 1, bg, np.where(fg == 0, fg, 1 - clamp((1 - bg) / fg))),
+    "linear burn": lambda fg, bg: np.where(fg + bg < 1, 0, fg + bg - 1),
+    "lighten": lambda fg, bg: np.maximum(fg, bg),
+    "screen": lambda fg, bg: 1 - ((1 - bg) * (1 - fg)),
+    "color dodge": lambda fg, bg: np.where(bg == 0, 0, np.where(fg == 1, 1, clamp(bg / (1 - fg)))),
+    "linear dodge": lambda fg, bg: clamp(fg + bg),
+    "overlay": lambda fg, bg: np.where(bg < 0.5, 2 * fg * bg, 1 - (2 * ((1 - fg) * (1 - bg)))),
+    "soft light": lambda fg, bg: np.where(
+        fg <= 0.5, bg - (1 - 2 * fg) * bg * (1 - bg),
+        np.where(bg <= 0.25, bg + (2 * fg - 1) * ((4 * bg) * (4 * bg + 1) * (bg - 1) + 7 * bg),
+                 bg + (2 * fg - 1) * (np.power(bg, 0.5) - bg))),
+    "hard light": lambda fg, bg: np.where(fg <= 0.5, 2 * fg * bg, 1 - (2 * ((1 - fg) * (1 - bg)))),
+    "vivid light": lambda fg, bg: np.where(
+        fg == 1, fg, np.where(fg == 0, fg, np.where(
+            fg <= 0.5, clamp(1 - clamp((1 - bg) / clamp(2 * fg))), clamp(bg / (1 - clamp(2 * (fg - 0.5))))))),
+    "linear light": lambda fg, bg: np.where(fg <= 0.5, clamp(clamp(2 * fg) + bg - 1),
+                                            clamp(clamp(clamp(2 * (fg - 0.5)) + bg))),
+    "pin light": lambda fg, bg: np.where(fg <= 0.5, clamp(np.minimum(clamp(2 * fg), bg)),
+                                         clamp(np.maximum(clamp(2 * (fg - 0.5)), bg))),
+    "hard mix": lambda fg, bg: np.where(bg == 0, 0, np.where(np.round(fg, 3) + np.round(bg, 3) >= 1, 1, 0)),
+    "difference": lambda fg, bg: np.abs(fg - bg),
+    "exclusion": lambda fg, bg: clamp((fg + bg) - (2 * fg * bg)),
+    "subtract": lambda fg, bg: clamp(bg - fg),
+    "divide": lambda fg, bg: np.where(bg == 0, 0, np.where(fg == 0, 1, clamp(bg / fg))),
+    "darker color": lambda fg, bg: np.where(
+        (np.dot(fg, [0.3, 0.59, 0.11]) < np.dot(bg, [0.3, 0.59, 0.11]))[:, :, None], fg, bg),
+    "lighter color": lambda fg, bg: np.where(
+        (np.dot(fg, [0.3, 0.59, 0.11]) > np.dot(bg, [0.3, 0.59, 0.11]))[:, :, None], fg, bg),
+    "hue": lambda fg, bg: set_luminosity(set_saturation(fg, get_saturation(bg)), get_luminosity(bg)),
+    "saturation": lambda fg, bg: set_luminosity(set_saturation(bg, get_saturation(fg)), get_luminosity(bg)),
+    "color": lambda fg, bg: set_luminosity(fg, get_luminosity(bg)),
+    "luminosity": lambda fg, bg: set_luminosity(bg, get_luminosity(fg)),
+}
+
+# Bytes a warmed-up blend may still allocate, whatever the image size. Numpy's casting buffers account for most of it.
+#   Large enough images are used that a single float64 plane is far bigger.
+MAX_WARM_BYTES = 256 * 1024
+ALLOCATION_SHAPE = (512, 512)
+
+
+def random_images(seed: int, shape: tuple = SHAPE) -> tuple:
+    rng = np.random.default_rng(seed)
+    fg = rng.integers(0, 256, shape + (4,), dtype=np.uint8)
+    bg = rng.integers(0, 256, shape + (4,), dtype=np.uint8)
+    # Plenty of the values the blend modes treat specially
+    fg[::3] = rng.choice([0, 64, 128, 191, 255], fg[::3].shape)
+    bg[::4] = rng.choice([0, 64, 128, 255], bg[::4].shape)
+    # Grays, and pixels with tied channels, for the non-separable modes
+    fg[1::5, :, 1] = fg[1::5, :, 0]
+    fg[2::5, :, :3] = fg[2::5, :, :1]
+    bg[1::6, :, 2] = bg[1::6, :, 1]
+    bg[3::6, :, :3] = bg[3::6, :, 2:3]
+    mask = rng.integers(0, 256, shape, dtype=np.uint8)
+    return fg, bg, mask
+
+
+def check_references(fg: np.array, bg: np.array, mask: np.array):
+    fg_rgb = fg[:, :, :3] / 255
+    bg_rgb = bg[:, :, :3] / 255
+    for name, reference in REFERENCE_COLOR_FUNCTIONS.items():
+        blend_fn = [mode for mode in ALL_BLEND_MODES if mode.name == name][0].blend_fn
+        with np.errstate(all='ignore'):
+            expected = reference(fg_rgb, bg_rgb)
+            color = np.empty(fg_rgb.shape)
+            blend_fn.kernel(fg_rgb, bg_rgb, color, ScratchPool())
+        if not np.array_equal(color, expected, equal_nan=True):
+            raise RuntimeError(f"{name} kernel doesn't match its reference")
+
+        # Writing into bg gives the same result as a new array
+        result = blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=0.7)
+        in_place = bg.copy()
+        blend_fn(fg=fg, bg=in_place, mask=mask, fg_opacity=0.7, out=in_place)
+        if not np.array_equal(result, in_place):
+            raise RuntimeError(f"{name} blended into bg doesn't match a new result")
+
+
+def check_allocations():
+    """ Once the thread's scratch pool has grown, blending allocates almost nothing. """
+    fg, bg, mask = random_images(seed=1, shape=ALLOCATION_SHAPE)
+    out = np.empty_like(bg)
+    for blend_fn in [blend_modes.blend_soft_light, blend_modes.blend_multiply, blend_modes.blend_vivid_light]:
+        blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=0.5, out=out)
+        pool_bytes = get_scratch_pool().nbytes
+
+        tracemalloc.start()
+        with np.errstate(all='ignore'):
+            blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=0.5, out=out)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        if get_scratch_pool().nbytes != pool_bytes:
+            raise RuntimeError("The scratch pool grew on a second blend of the same size")
+        if peak > MAX_WARM_BYTES:
+            raise RuntimeError(f"Blending allocated {peak} bytes after the scratch pool warmed up")
+    get_scratch_pool().clear()
+
+    # Blends outside of a render plan free their temporaries, unless the pool is being held
+    blend = BlendMode.from_name("soft light")
+    composite_image_data(fg=fg, bg=bg, blend_mode=blend, mask=mask, opacity=0.5)
+    if get_scratch_pool().nbytes != 0:
+        raise RuntimeError("composite_image_data kept the scratch pool's buffers")
+    with get_scratch_pool().held():
+        composite_image_data(fg=fg, bg=bg, blend_mode=blend, mask=mask, opacity=0.5)
+        if get_scratch_pool().nbytes == 0:
+            raise RuntimeError("A held scratch pool was freed between blends")
+    if get_scratch_pool().nbytes != 0:
+        raise RuntimeError("A held scratch pool wasn't freed when it was let go")
+
+
+def check_custom_kernel(fg: np.array, bg: np.array, mask: np.array):
+    """ Custom blend modes can be written as kernels, or as functions that return new arrays. """
+    @blend_modes.blend_kernel
+    def average_kernel(fg_rgb: np.array, bg_rgb: np.array, out: np.array, pool: ScratchPool):
+        np.add(fg_rgb, bg_rgb, out=out)
+        out *= 0.5
+
+    @blend_modes.blend
+    def average(fg_rgb: np.array, bg_rgb: np.array) -> np.array:
+        return (fg_rgb + bg_rgb) * 0.5
+
+    expected = average(fg=fg, bg=bg, mask=mask, fg_opacity=0.8)
+    if not np.array_equal(average_kernel(fg=fg, bg=bg, mask=mask, fg_opacity=0.8), expected):
+        raise RuntimeError("Custom kernel doesn't match the same blend mode written as a function")
+
+
+def main():
+    fg, bg, mask = random_images(seed=0)
+    check_references(fg, bg, mask)
+    check_allocations()
+    check_custom_kernel(fg, bg, mask)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
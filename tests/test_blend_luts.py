@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+
+from photoshoppy.models.blend_mode.model import BlendMode
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render import blend_luts, render_utils
+
+
+THIS_DIR = os.path.dirname(__file__)
+PSD_FILE_PATH = os.path.join(THIS_DIR, "psd_files", "lena.psd")
+
+# Lookup tables store the blended color as uint8, so results may be one step away from the float blend functions.
+TOLERANCE = 1
+
+
+def random_rgba(shape, seed: int) -> np.array:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, shape + (4,), dtype=np.uint8)
+
+
+def compare(blend: BlendMode, fg: np.array, bg: np.array, mask: np.array or None, opacity: float) -> int:
+    """ Return the largest difference between the float and lookup-table blends, ignoring transparent pixels. """
+    expected = blend.blend_fn(fg=fg, bg=bg, mask=mask, fg_opacity=opacity)
+    result = blend_luts.blend_lut(fg=fg, bg=bg, mask=mask, fg_opacity=opacity, lut=blend_luts.get_lut(blend))
+
+    diff = np.abs(expected.astype(np.int16) - result.astype(np.int16))
+    visible = expected[:, :, 3] > 0
+    return max(int(diff[:, :, 3].max()), int(diff[:, :, :3][visible].max(initial=0)))
+
+
+def main(names):
+    psd = PSDFile(PSD_FILE_PATH)
+    lena_fg = render_utils.layer_to_screen_space(psd.layer("colors"), psd)
+    lena_bg = render_utils.layer_to_screen_space(psd.layer("lena"), psd)
+    random_fg = random_rgba((256, 256), seed=0)
+    random_bg = random_rgba((256, 256), seed=1)
+    random_mask = random_rgba((256, 256), seed=2)[:, :, 0]
+    opaque_bg = random_bg.copy()
+    opaque_bg[:, :, 3] = 255
+
+    if not len(names):
+        names = blend_luts.SEPARABLE_BLEND_MODES
+
+    failures = []
+    with np.errstate(all='ignore'):
+        for name in names:
+            blend = BlendMode.from_name(name)
+            error = max(
+                compare(blend, lena_fg, lena_bg, mask=None, opacity=1.0),
+                compare(blend, random_fg, random_bg, mask=None, opacity=1.0),
+                compare(blend, random_fg, random_bg, mask=None, opacity=100 / 255),
+                compare(blend, random_fg, random_bg, mask=random_mask, opacity=200 / 255),
+                compare(blend, random_fg, opaque_bg, mask=random_mask, opacity=200 / 255))
+            print(f"{name}: max error {error}")
+            if error > TOLERANCE:
+                failures.append(name)
+
+    if failures:
+        raise RuntimeError(f"Lookup tables don't match the float blend functions: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    """ Validate the lookup-table blend modes against the float blend functions.
+    Given a list of blending mode names as arguments, only validate those.
+    """
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.color_conversion import lab_to_rgb
+from photoshoppy.psd_render.render import render_image_data, render_psd
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, SyntheticLayer, write_psd
+
+
+WIDTH = 96
+HEIGHT = 80
+BAND_HEIGHT = 16
+REGION = Rect(10, 20, 70, 90)
+
+# 8-bit Lab values and the sRGB colors Photoshop shows for them
+LAB_REFERENCES = [
+    ((255, 128, 128), (255, 255, 255)),
+    ((0, 128, 128), (0, 0, 0)),
+    ((138, 209, 198), (255, 0, 0)),
+    ((224, 48, 209), (0, 255, 0)),
+    ((75, 196, 16), (0, 0, 255)),
+]
+MAX_LAB_ERROR = 3
+
+
+def layers(planes_by_layer: list) -> list:
+    rects = [Rect(-8, -8, 60, 70), Rect(20, 30, HEIGHT + 10, WIDTH + 10)]
+    rng = np.random.default_rng(0)
+    result = []
+    for i, (rect, color_planes) in enumerate(zip(rects, planes_by_layer)):
+        channels = dict(enumerate(color_planes))
+        channels[CHANNEL_ALPHA] = rng.integers(0, 256, color_planes[0].shape, dtype=np.uint8)
+        result.append(SyntheticLayer(f"layer_{i}", rect, channels, blend_mode=["normal", "multiply"][i]))
+    return result
+
+
+def random_planes(count: int, rng: np.random.Generator) -> list:
+    shapes = [(68, 78), (70, 76)]
+    return [[rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)] for shape in shapes]
+
+
+def render(file_path: str) -> np.array:
+    return RenderPlan.from_psd(PSDFile(file_path)).execute()
+
+
+def check_streaming(file_path: str, expected: np.array, temp_dir: str):
+    """ Converting one band or region at a time must match converting whole layers. """
+    psd = PSDFile(file_path, lazy_decode=True)
+    band_path = os.path.join(temp_dir, "bands.png")
+    render_psd(psd, band_path, overwrite=True, band_height=BAND_HEIGHT)
+    if not np.array_equal(np.asarray(Image.open(band_path)), expected):
+        raise RuntimeError(f"Band render of {file_path} doesn't match")
+    region = RenderPlan.from_psd(psd, region=REGION).execute(tile_size=32)
+    if not np.array_equal(region, expected[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+        raise RuntimeError(f"Tiled region render of {file_path} doesn't match")
+
+
+def main():
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # CMYK is stored inverted, so the RGB equivalent of each ink is ink * black / 255
+        cmyk = random_planes(4, rng)
+        rgb = [[np.round(p.astype(np.float64) * planes[3] / 255).astype(np.uint8) for p in planes[:3]]
+               for planes in cmyk]
+        cmyk_path = os.path.join(temp_dir, "cmyk.psd")
+        rgb_path = os.path.join(temp_dir, "rgb.psd")
+        write_psd(cmyk_path, WIDTH, HEIGHT, layers(cmyk), color_mode="CMYK")
+        write_psd(rgb_path, WIDTH, HEIGHT, layers(rgb))
+        expected = render(rgb_path)
+        if not np.array_equal(render(cmyk_path), expected):
+            raise RuntimeError("CMYK render doesn't match its RGB equivalent")
+        check_streaming(cmyk_path, expected, temp_dir)
+
+        gray = random_planes(1, rng)
+        gray_path = os.path.join(temp_dir, "gray.psd")
+        write_psd(gray_path, WIDTH, HEIGHT, layers(gray), color_mode="Grayscale")
+        write_psd(rgb_path, WIDTH, HEIGHT, layers([planes * 3 for planes in gray]))
+        if not np.array_equal(render(gray_path), render(rgb_path)):
+            raise RuntimeError("Grayscale render doesn't match its RGB equivalent")
+
+        lab = random_planes(3, rng)
+        lab_path = os.path.join(temp_dir, "lab.psd")
+        write_psd(lab_path, WIDTH, HEIGHT, layers(lab), color_mode="Lab")
+        write_psd(rgb_path, WIDTH, HEIGHT, layers([list(lab_to_rgb(*planes)) for planes in lab]))
+        expected = render(rgb_path)
+        if not np.array_equal(render(lab_path), expected):
+            raise RuntimeError("Lab render doesn't match its RGB equivalent")
+        check_streaming(lab_path, expected, temp_dir)
+
+        for lab_value, expected_rgb in LAB_REFERENCES:
+            converted = [int(c[0]) for c in lab_to_rgb(*[np.array([v], dtype=np.uint8) for v in lab_value])]
+            if max(abs(c - e) for c, e in zip(converted, expected_rgb)) > MAX_LAB_ERROR:
+                raise RuntimeError(f"Lab {lab_value} converted to {converted}; expected about {expected_rgb}")
+
+        # Indexed files can't have layers, but their merged image is expanded through the palette
+        palette = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+        indices = rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8)
+        indexed_path = os.path.join(temp_dir, "indexed.psd")
+        write_psd(indexed_path, WIDTH, HEIGHT, [], color_mode="Indexed", color_mode_data=palette.T.tobytes(),
+                  merged=[indices])
+        image_path = os.path.join(temp_dir, "indexed.png")
+        render_image_data(PSDFile(indexed_path), image_path)
+        if not np.array_equal(np.asarray(Image.open(image_path)), palette[indices]):
+            raise RuntimeError("Indexed image data wasn't expanded through its palette")
+    print("color modes ok")
+
+
+if __name__ == "__main__":
+    main()
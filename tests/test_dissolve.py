@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, SyntheticLayer, generate_psd, write_psd
+
+
+WIDTH = 150
+HEIGHT = 110
+REGION = Rect(17, 23, 96, 131)
+
+
+def check_tiles(temp_dir: str):
+    """ Dissolve gives the same pixels whatever order and size the canvas is rendered in. """
+    file_path = generate_psd(os.path.join(temp_dir, "dissolve.psd"), width=WIDTH, height=HEIGHT, layer_count=8,
+                             nesting_depth=2, blend_modes=("dissolve", "normal", "multiply"), mask_ratio=0.5, seed=4)
+    expected = RenderPlan.from_psd(PSDFile(file_path)).execute()
+    if not np.array_equal(RenderPlan.from_psd(PSDFile(file_path)).execute(), expected):
+        raise RuntimeError("Dissolve isn't deterministic")
+
+    for tile_size in [16, 37]:
+        if not np.array_equal(RenderPlan.from_psd(PSDFile(file_path)).execute(tile_size=tile_size), expected):
+            raise RuntimeError(f"Dissolve rendered in {tile_size}px tiles doesn't match")
+
+    bands = np.concatenate([data for _, data in RenderPlan.from_psd(PSDFile(file_path)).execute_bands(13)])
+    if not np.array_equal(bands, expected):
+        raise RuntimeError("Dissolve rendered in bands doesn't match")
+
+    region_data = RenderPlan.from_psd(PSDFile(file_path, lazy_decode=True), region=REGION).execute(tile_size=16)
+    if not np.array_equal(region_data, expected[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+        raise RuntimeError("Dissolve rendered for a region doesn't match")
+
+
+def check_coverage(temp_dir: str):
+    """ Dissolved pixels are either fully drawn or not drawn at all, in proportion to the layer's alpha. """
+    shape = (HEIGHT, WIDTH)
+    base = {i: np.zeros(shape, dtype=np.uint8) for i in range(3)}
+    base[CHANNEL_ALPHA] = np.full(shape, 255, dtype=np.uint8)
+    top = {i: np.full(shape, 255, dtype=np.uint8) for i in range(3)}
+    top[CHANNEL_ALPHA] = np.full(shape, 128, dtype=np.uint8)
+    layers = [
+        SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), base),
+        SyntheticLayer("top", Rect(0, 0, HEIGHT, WIDTH), top, blend_mode="dissolve", opacity=128),
+    ]
+    file_path = os.path.join(temp_dir, "coverage.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers)
+    image_data = RenderPlan.from_psd(PSDFile(file_path)).execute()
+
+    if not np.all(image_data[:, :, 3] == 255) or not np.all(np.isin(image_data[:, :, :3], [0, 255])):
+        raise RuntimeError("Dissolve should only draw fully opaque pixels")
+    drawn = np.mean(image_data[:, :, 0] == 255)
+    if abs(drawn - 0.25) > 0.02:
+        raise RuntimeError(f"Expected about a quarter of the pixels to be drawn; got {drawn:.3f}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_tiles(temp_dir)
+        check_coverage(temp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import (export, render_groups, render_layers, render_psd, GroupsTarget,
+                                           LayersTarget, PSDTarget)
+from synthetic_psd import generate_psd
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "export")
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+
+
+def main(files: List[str]):
+    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not len(files):
+            nested = generate_psd(os.path.join(temp_dir, "nested.psd"), width=512, height=512, layer_count=24,
+                                  nesting_depth=3, blend_modes=["normal", "multiply", "screen"],
+                                  group_blend_modes=["multiply", "pass through", "normal"], seed=5)
+            files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES] + [nested]
+
+        for file in files:
+            name = os.path.splitext(os.path.basename(file))[0]
+            separate = os.path.join(OUTPUT_DIR, name, "separate")
+            single = os.path.join(OUTPUT_DIR, name, "export")
+
+            psd = PSDFile(file)
+            start = time.perf_counter()
+            os.makedirs(separate)
+            render_psd(psd, os.path.join(separate, "_document.png"))
+            render_layers(psd, separate, skip_hidden_layers=False, render_masks=True)
+            render_groups(psd, separate, skip_hidden_groups=False, render_masks=True)
+            separate_seconds = time.perf_counter() - start
+
+            psd = PSDFile(file)
+            start = time.perf_counter()
+            os.makedirs(single)
+            export(psd, [PSDTarget(os.path.join(single, "_document.png")),
+                         LayersTarget(single, skip_hidden_layers=False, render_masks=True),
+                         GroupsTarget(single, skip_hidden_groups=False, render_masks=True)])
+            export_seconds = time.perf_counter() - start
+            print(f"{name}: separate renders {separate_seconds:.3f} s, export {export_seconds:.3f} s")
+
+            names = sorted(os.listdir(separate))
+            if names != sorted(os.listdir(single)):
+                raise RuntimeError(f"Export of {file} wrote different files than the separate renders")
+            _, mismatch, errors = filecmp.cmpfiles(separate, single, names, shallow=False)
+            if mismatch or errors:
+                raise RuntimeError(f"Export of {file} doesn't match the separate renders: {mismatch + errors}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
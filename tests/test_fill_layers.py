@@ -0,0 +1,207 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.fills import GradientGenerator, PatternGenerator, SolidColorGenerator
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.descriptor import UnitFloat
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import (CHANNEL_ALPHA, DescriptorObject, Enumerated, SyntheticLayer, fill_layer, pattern_info,
+                           write_psd)
+
+
+WIDTH = 90
+HEIGHT = 60
+REGION = Rect(7, 11, 53, 83)
+MASK_RECT = Rect(10, 20, 40, 70)
+
+
+def rgb_color(r: float, g: float, b: float) -> DescriptorObject:
+    return DescriptorObject("RGBC", {"Rd  ": r, "Grn ": g, "Bl  ": b})
+
+
+def solid_color(name: str, rgb: tuple, **kwargs) -> SyntheticLayer:
+    return fill_layer(name, "SoCo", {"Clr ": rgb_color(*rgb)}, **kwargs)
+
+
+def gradient(name: str, gradient_type: str, angle: float, opacities: tuple = (100.0, 100.0),
+             **kwargs) -> SyntheticLayer:
+    color_stops = [DescriptorObject("Clrt", {"Clr ": rgb_color(*rgb), "Type": Enumerated("Clry", "UsrS"),
+                                             "Lctn": location, "Mdpn": 50})
+                   for rgb, location in [((0.0, 0.0, 0.0), 0), ((255.0, 255.0, 255.0), 4096)]]
+    transparency_stops = [DescriptorObject("TrnS", {"Opct": UnitFloat("#Prc", opacity), "Lctn": location, "Mdpn": 50})
+                          for opacity, location in zip(opacities, [0, 4096])]
+    items = {
+        "Angl": UnitFloat("#Ang", angle),
+        "Type": Enumerated("GrdT", gradient_type),
+        "Algn": False,
+        "Scl ": UnitFloat("#Prc", 100.0),
+        "Ofst": DescriptorObject("Pnt ", {"Hrzn": UnitFloat("#Prc", 0.0), "Vrtc": UnitFloat("#Prc", 0.0)}),
+        "Grad": DescriptorObject("Grdn", {"Nm  ": "ramp", "GrdF": Enumerated("GrdF", "CstS"), "Intr": 4096.0,
+                                          "Clrs": color_stops, "Trns": transparency_stops}),
+    }
+    return fill_layer(name, "GdFl", items, **kwargs)
+
+
+def pattern_fill(name: str, pattern_id: str, phase: tuple, **kwargs) -> SyntheticLayer:
+    items = {
+        "Ptrn": DescriptorObject("Ptrn", {"Nm  ": "pattern", "Idnt": pattern_id}),
+        "Algn": True,
+        "phase": DescriptorObject("Pnt ", {"Hrzn": float(phase[0]), "Vrtc": float(phase[1])}),
+    }
+    return fill_layer(name, "PtFl", items, **kwargs)
+
+
+def base_layer() -> SyntheticLayer:
+    rng = np.random.default_rng(5)
+    channels = {i: rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8) for i in range(3)}
+    channels[CHANNEL_ALPHA] = np.full((HEIGHT, WIDTH), 255, dtype=np.uint8)
+    return SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), channels)
+
+
+def constant_layer(rgba: tuple, **kwargs) -> SyntheticLayer:
+    channels = {i: np.full((HEIGHT, WIDTH), value, dtype=np.uint8) for i, value in zip([0, 1, 2, CHANNEL_ALPHA], rgba)}
+    return SyntheticLayer("constant", Rect(0, 0, HEIGHT, WIDTH), channels, **kwargs)
+
+
+def write(temp_dir: str, name: str, layers: list, **kwargs) -> str:
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers, **kwargs)
+    return file_path
+
+
+def check_region(file_path: str, image_data: np.array, name: str):
+    region_data = RenderPlan.from_psd(PSDFile(file_path, lazy_decode=True), region=REGION).execute(tile_size=16)
+    if not np.array_equal(region_data, image_data[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+        raise RuntimeError(f"{name} rendered a tile at a time doesn't match")
+
+
+def check_solid_color(temp_dir: str):
+    """ A solid color fill matches a layer filled with the same color, and is never materialized. """
+    mask = np.random.default_rng(1).integers(0, 256, (MASK_RECT.bottom - MASK_RECT.top,
+                                                      MASK_RECT.right - MASK_RECT.left), dtype=np.uint8)
+    kwargs = dict(blend_mode="multiply", opacity=200, mask_rect=MASK_RECT, mask=mask)
+    file_path = write(temp_dir, "solid", [base_layer(), solid_color("fill", (10.0, 200.0, 30.0), **kwargs)])
+    expected_path = write(temp_dir, "solid_expected", [base_layer(), constant_layer((10, 200, 30, 255), **kwargs)])
+
+    psd = PSDFile(file_path)
+    if psd.layer("fill").fill_content is None:
+        raise RuntimeError("Solid color fill wasn't parsed")
+    plan = RenderPlan.from_psd(psd)
+    fill = [op.fill for op in plan.ops if op.fill is not None][0]
+    if not isinstance(fill, SolidColorGenerator) or fill.render(Rect(0, 0, HEIGHT, WIDTH)).strides[:2] != (0, 0):
+        raise RuntimeError("Solid color should be broadcast from a single pixel")
+
+    image_data = plan.execute()
+    if not np.array_equal(image_data, RenderPlan.from_psd(PSDFile(expected_path)).execute()):
+        raise RuntimeError("Solid color fill doesn't match a layer of the same color")
+    check_region(file_path, image_data, "Solid color fill")
+
+
+def check_occlusion(temp_dir: str):
+    """ Opaque fills hide the layers underneath them. """
+    file_path = write(temp_dir, "occluding", [base_layer(), solid_color("fill", (0.0, 0.0, 255.0))])
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    if [op.layer.name for op in plan.ops] != ["fill"]:
+        raise RuntimeError("An opaque solid color fill should cull the layers underneath it")
+    if not np.array_equal(plan.execute()[0, 0], [0, 0, 255, 255]):
+        raise RuntimeError("Occluding fill rendered the wrong color")
+
+
+def check_gradients(temp_dir: str):
+    # Black to white, left to right, across the canvas
+    file_path = write(temp_dir, "linear", [gradient("linear", "Lnr ", 0.0)])
+    image_data = RenderPlan.from_psd(PSDFile(file_path)).execute()
+    positions = (np.arange(WIDTH) + 0.5) / WIDTH
+    expected = np.around(np.around(positions * 4096) / 4096 * 255)
+    if np.abs(image_data[:, :, 0] - expected[None, :]).max() > 0 or not (image_data[:, :, 3] == 255).all():
+        raise RuntimeError("Linear gradient doesn't match its reference")
+    check_region(file_path, image_data, "Linear gradient")
+
+    # Pointing up, black is at the bottom
+    image_data = RenderPlan.from_psd(PSDFile(write(temp_dir, "up", [gradient("up", "Lnr ", 90.0)]))).execute()
+    if not (np.diff(image_data[:, 0, 0].astype(int)) <= 0).all() or image_data[-1, 0, 0] > image_data[0, 0, 0]:
+        raise RuntimeError("Gradient at 90 degrees should get darker towards the bottom")
+
+    # Radial and diamond gradients are symmetric around the center, and dark in the middle
+    for gradient_type in ["Rdl ", "Dmnd", "Rflc"]:
+        file_path = write(temp_dir, "symmetric", [gradient("symmetric", gradient_type, 0.0)])
+        image_data = RenderPlan.from_psd(PSDFile(file_path)).execute()
+        if not np.array_equal(image_data, image_data[:, ::-1]) or image_data[HEIGHT // 2, WIDTH // 2, 0] > 10:
+            raise RuntimeError(f"'{gradient_type}' gradient should be symmetric, and dark at its center")
+        check_region(file_path, image_data, f"'{gradient_type}' gradient")
+
+    # Transparency stops fade the gradient out
+    file_path = write(temp_dir, "fade", [gradient("fade", "Lnr ", 0.0, opacities=(100.0, 0.0))])
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    if not isinstance(plan.ops[0].fill, GradientGenerator) or plan.ops[0].fill.is_opaque:
+        raise RuntimeError("Gradients with transparency shouldn't be opaque")
+    alpha = plan.execute()[0, :, 3]
+    if alpha[0] < 250 or alpha[-1] > 5 or (np.diff(alpha.astype(int)) > 0).any():
+        raise RuntimeError("Transparency stops should fade the gradient out")
+
+
+def check_patterns(temp_dir: str):
+    """ Patterns repeat from the layer's origin, offset by their phase. """
+    rng = np.random.default_rng(2)
+    planes = [rng.integers(0, 256, (5, 7), dtype=np.uint8) for _ in range(3)]
+    phase = (3, 2)
+    layer = pattern_fill("pattern", "1234-abcd", phase)
+    file_path = write(temp_dir, "pattern", [layer], global_layer_info=[("Patt", pattern_info([("1234-abcd",
+                                                                                                planes)]))])
+    psd = PSDFile(file_path)
+    if "1234-abcd" not in psd.patterns:
+        raise RuntimeError("Pattern wasn't read from the global layer info")
+    plan = RenderPlan.from_psd(psd)
+    if not isinstance(plan.ops[0].fill, PatternGenerator):
+        raise RuntimeError("Pattern fill should be rendered from its pattern")
+    image_data = plan.execute()
+
+    tile = np.dstack(planes + [np.full((5, 7), 255, dtype=np.uint8)])
+    rows = (np.arange(HEIGHT) - phase[1]) % 5
+    columns = (np.arange(WIDTH) - phase[0]) % 7
+    if not np.array_equal(image_data, tile[rows[:, None], columns[None, :]]):
+        raise RuntimeError("Pattern fill doesn't match the tiled pattern")
+    check_region(file_path, image_data, "Pattern fill")
+
+    # Patterns with their own alpha
+    alpha = rng.integers(0, 256, (5, 7), dtype=np.uint8)
+    file_path = write(temp_dir, "pattern_alpha", [pattern_fill("pattern", "id", (0, 0))],
+                      global_layer_info=[("Patt", pattern_info([("id", planes + [alpha])]))])
+    image_data = RenderPlan.from_psd(PSDFile(file_path)).execute()
+    if not np.array_equal(image_data[:, :, 3], alpha[np.arange(HEIGHT)[:, None] % 5, np.arange(WIDTH)[None, :] % 7]):
+        raise RuntimeError("Pattern alpha doesn't match")
+
+    # Missing patterns are skipped
+    file_path = write(temp_dir, "missing", [base_layer(), pattern_fill("pattern", "missing", (0, 0))])
+    if [op.layer.name for op in RenderPlan.from_psd(PSDFile(file_path)).ops] != ["base"]:
+        raise RuntimeError("Pattern fills without a pattern should be skipped")
+
+
+def check_proxy_and_depth(temp_dir: str):
+    layers = [base_layer(), gradient("gradient", "Rdl ", 30.0, blend_mode="screen")]
+    file_path = write(temp_dir, "proxy", layers)
+    proxy_data = RenderPlan.from_psd(PSDFile(file_path)).scaled(0.5).execute()
+    if proxy_data.shape != (HEIGHT // 2, WIDTH // 2, 4):
+        raise RuntimeError(f"Proxy of a fill layer has the wrong shape: {proxy_data.shape}")
+
+    file_path = write(temp_dir, "deep", [solid_color("fill", (0.0, 128.0, 255.0))], depth=16)
+    image_data = RenderPlan.from_psd(PSDFile(file_path)).execute()
+    if image_data.dtype != np.float32 or np.abs(image_data[0, 0] - [0, 128 / 255, 1, 1]).max() > 1e-6:
+        raise RuntimeError("16-bit solid color fill doesn't match")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_solid_color(temp_dir)
+        check_occlusion(temp_dir)
+        check_gradients(temp_dir)
+        check_patterns(temp_dir)
+        check_proxy_and_depth(temp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
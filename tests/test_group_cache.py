@@ -0,0 +1,90 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.group_cache import GroupCache
+from photoshoppy.psd_render.render import GroupsTarget, PSDTarget, export
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.psd_render.tracing import Tracer
+from photoshoppy.utilities.string import clean_file_name
+from synthetic_psd import generate_psd
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "group_cache")
+PSD_FILE_PATH = os.path.join(THIS_DIR, "psd_files", "rings.psd")
+
+
+class _CountingCache:
+    """ Counts the composites a GroupCache keeps, and the most it holds at once. """
+    def __init__(self):
+        self.stored = 0
+        self.most = 0
+        self._put = GroupCache.put
+
+    def __enter__(self):
+        def put(cache: GroupCache, *args):
+            count = len(cache)
+            self._put(cache, *args)
+            self.stored += len(cache) - count
+            self.most = max(self.most, len(cache))
+        GroupCache.put = put
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        GroupCache.put = self._put
+
+
+def main(files: List[str]):
+    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+    os.makedirs(OUTPUT_DIR)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not len(files):
+            # Groups with their own blend modes get their own buffers, so their composites can be reused
+            nested = generate_psd(os.path.join(temp_dir, "nested.psd"), width=512, height=512, layer_count=32,
+                                  nesting_depth=4, blend_modes=["normal", "multiply", "screen"],
+                                  group_blend_modes=["multiply", "screen", "normal"], seed=3)
+            files = [PSD_FILE_PATH, nested]
+
+        for file in files:
+            psd = PSDFile(file)
+            name = os.path.splitext(os.path.basename(file))[0]
+            folder = os.path.join(OUTPUT_DIR, name)
+            os.makedirs(folder)
+
+            start = time.perf_counter()
+            document_path = os.path.join(OUTPUT_DIR, f"{name}.png")
+            with Tracer() as tracer, _CountingCache() as counts:
+                export(psd, [GroupsTarget(folder, skip_hidden_groups=False), PSDTarget(document_path)], overwrite=True)
+            hits = [span for span in tracer.root.iter_spans() if span.category == "group cache"]
+            print(f"{name}: {time.perf_counter() - start:.3f} s, {len(hits)} cached group composites reused, "
+                  f"at most {counts.most} held at once")
+
+            # Composites are only kept for the group and document plans that read them
+            if counts.stored != len(hits):
+                raise RuntimeError(f"{counts.stored} group composites were cached, but only {len(hits)} were reused")
+
+            for group in psd.iter_groups():
+                expected = RenderPlan.from_psd(psd, group=group).execute()
+                image_path = os.path.join(folder, f"{clean_file_name(group.name)}.png")
+                if not np.array_equal(np.asarray(Image.open(image_path)), expected):
+                    raise RuntimeError(f"Cached render of group '{group.name}' in {file} doesn't match")
+
+            if not np.array_equal(np.asarray(Image.open(document_path)), RenderPlan.from_psd(psd).execute()):
+                raise RuntimeError(f"Document exported with its groups from {file} doesn't match")
+
+            if file != PSD_FILE_PATH and not hits:
+                raise RuntimeError(f"No cached group composites were reused for {file}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
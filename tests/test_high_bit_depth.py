@@ -0,0 +1,148 @@
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_psd
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, SyntheticLayer, generate_psd, write_psd
+
+
+WIDTH = 120
+HEIGHT = 90
+BAND_HEIGHT = 16
+BLEND_MODES = ("normal", "multiply", "screen", "overlay", "darken", "difference")
+
+# Deep renders quantized to 8 bits may differ from 8-bit renders by this many steps, since the 8-bit layers are
+# themselves quantized before they're blended
+MAX_8_BIT_DIFFERENCE = 3
+
+
+def generate(file_path: str, depth: int, compression: str = "rle") -> str:
+    return generate_psd(file_path, width=WIDTH, height=HEIGHT, layer_count=8, nesting_depth=2,
+                        blend_modes=BLEND_MODES, mask_ratio=0.5, compression=compression, depth=depth, seed=3)
+
+
+def render(file_path: str) -> np.array:
+    return RenderPlan.from_psd(PSDFile(file_path)).execute()
+
+
+def read_16_bit_png(file_path: str) -> np.array:
+    """ Decode an RGBA PNG written by PNGBandWriter, which only uses the "up" filter. """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    offset = 8
+    idat = b""
+    width = height = None
+    while offset < len(data):
+        length, chunk_type = struct.unpack(">L4s", data[offset:offset + 8])
+        chunk = data[offset + 8:offset + 8 + length]
+        if chunk_type == b"IHDR":
+            width, height, bit_depth = struct.unpack(">2LB", chunk[:9])
+            if bit_depth != 16:
+                raise RuntimeError(f"Expected a 16-bit PNG; got {bit_depth} bits")
+        elif chunk_type == b"IDAT":
+            idat += chunk
+        offset += length + 12
+
+    rows = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, width * 8 + 1)
+    if np.any(rows[:, 0] != 2):
+        raise RuntimeError("Expected every row to use the up filter")
+    rows = np.cumsum(rows[:, 1:], axis=0, dtype=np.uint8)
+    return rows.view(">u2").reshape(height, width, 4).astype(np.uint16)
+
+
+def to_uint16(image_data: np.array) -> np.array:
+    return np.around(np.clip(image_data, 0, 1) * 65535).astype(np.uint16)
+
+
+def check_8_bit_equivalence(temp_dir: str):
+    expected = render(generate(os.path.join(temp_dir, "8.psd"), depth=8))
+    for depth in [16, 32]:
+        image_data = render(generate(os.path.join(temp_dir, f"{depth}.psd"), depth=depth))
+        if image_data.dtype != np.float32:
+            raise RuntimeError(f"{depth}-bit render should be float32; got {image_data.dtype}")
+        quantized = np.around(image_data * 255).astype(np.uint8)
+        difference = np.abs(quantized.astype(np.int16) - expected).max()
+        if difference > MAX_8_BIT_DIFFERENCE:
+            raise RuntimeError(f"{depth}-bit render differs from the 8-bit render by {difference}")
+
+
+def check_compression(temp_dir: str):
+    """ ZIP compressed channels, with and without prediction, must decode to the same pixels as RLE. """
+    for depth in [8, 16, 32]:
+        expected = render(os.path.join(temp_dir, f"{depth}.psd"))
+        for compression in ["raw", "zip", "zip prediction"]:
+            file_path = generate(os.path.join(temp_dir, f"{depth}_{compression}.psd"), depth, compression)
+            if not np.array_equal(render(file_path), expected):
+                raise RuntimeError(f"{depth}-bit {compression} render doesn't match RLE")
+
+            # Only some rows are decoded for a region, but ZIP data has to be decompressed in full to get to them
+            region = Rect(20, 10, 70, 100)
+            psd = PSDFile(file_path, lazy_decode=True)
+            region_data = RenderPlan.from_psd(psd, region=region).execute()
+            if not np.array_equal(region_data, expected[region.top:region.bottom, region.left:region.right]):
+                raise RuntimeError(f"{depth}-bit {compression} region render doesn't match")
+
+
+def check_precision(temp_dir: str):
+    """ A 16-bit gradient keeps more than 256 levels through compositing. """
+    width = 1024
+    gradient = np.broadcast_to(np.round(np.linspace(0, 65535, width)).astype(np.uint16), (4, width))
+    alpha = np.full((4, width), 65535, dtype=np.uint16)
+    layers = [
+        SyntheticLayer("base", Rect(0, 0, 4, width), {0: gradient, 1: gradient, 2: gradient, CHANNEL_ALPHA: alpha}),
+        SyntheticLayer("half", Rect(0, 0, 4, width), {0: alpha, 1: alpha, 2: alpha, CHANNEL_ALPHA: alpha},
+                       blend_mode="multiply", opacity=128),
+    ]
+    file_path = os.path.join(temp_dir, "gradient.psd")
+    write_psd(file_path, width, 4, layers, depth=16)
+    image_data = render(file_path)
+    levels = len(np.unique(image_data[0, :, 0]))
+    if levels <= 256:
+        raise RuntimeError(f"16-bit gradient was quantized to {levels} levels")
+
+
+def check_output(temp_dir: str):
+    psd = PSDFile(os.path.join(temp_dir, "16.psd"))
+    expected = RenderPlan.from_psd(psd).execute()
+
+    npy_path = os.path.join(temp_dir, "16.npy")
+    render_psd(psd, npy_path, overwrite=True)
+    if not np.array_equal(np.load(npy_path), expected):
+        raise RuntimeError("NPY output doesn't match the float render")
+
+    png_path = os.path.join(temp_dir, "16.png")
+    render_psd(psd, png_path, overwrite=True)
+    if not np.array_equal(read_16_bit_png(png_path), to_uint16(expected)):
+        raise RuntimeError("16-bit PNG doesn't match the float render")
+
+    band_path = os.path.join(temp_dir, "16_bands.png")
+    render_psd(PSDFile(os.path.join(temp_dir, "16.psd"), lazy_decode=True), band_path, overwrite=True,
+               band_height=BAND_HEIGHT)
+    if not np.array_equal(read_16_bit_png(band_path), to_uint16(expected)):
+        raise RuntimeError("16-bit PNG written in bands doesn't match the float render")
+
+    try:
+        render_psd(psd, os.path.join(temp_dir, "16.jpg"), overwrite=True)
+    except ValueError:
+        pass
+    else:
+        raise RuntimeError("Writing a 16-bit JPEG should raise ValueError")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_8_bit_equivalence(temp_dir)
+        check_compression(temp_dir)
+        check_precision(temp_dir)
+        check_output(temp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.psd_render.render_utils import mask_to_windows
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, MASK_FLAG_DISABLED, MASK_FLAG_INVERTED, SyntheticLayer, write_psd
+
+
+WIDTH = 100
+HEIGHT = 80
+LAYER_RECT = Rect(-5, 0, 70, 90)
+MASK_RECT = Rect(10, 20, 50, 70)
+REGION = Rect(5, 15, 60, 80)
+
+
+def masked_layers(mask: np.array or None, mask_rect: Rect or None, default_color: int, flags: int) -> list:
+    rng = np.random.default_rng(2)
+    shape = (LAYER_RECT.bottom - LAYER_RECT.top, LAYER_RECT.right - LAYER_RECT.left)
+    base = {i: rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8) for i in range(3)}
+    base[CHANNEL_ALPHA] = np.full((HEIGHT, WIDTH), 255, dtype=np.uint8)
+    top = {i: rng.integers(0, 256, shape, dtype=np.uint8) for i in range(3)}
+    top[CHANNEL_ALPHA] = rng.integers(0, 256, shape, dtype=np.uint8)
+    return [
+        SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), base),
+        SyntheticLayer("top", LAYER_RECT, top, blend_mode="multiply", opacity=200, mask_rect=mask_rect, mask=mask,
+                       mask_default_color=default_color, mask_flags=flags),
+    ]
+
+
+def padded_mask(mask: np.array, default_color: int) -> np.array:
+    """ The mask padded out to the whole canvas with its default color. """
+    padded = np.full((HEIGHT, WIDTH), default_color, dtype=np.uint8)
+    padded[MASK_RECT.top:MASK_RECT.bottom, MASK_RECT.left:MASK_RECT.right] = mask
+    return padded
+
+
+def render(file_path: str, use_luts: bool = False) -> np.array:
+    return RenderPlan.from_psd(PSDFile(file_path), use_luts=use_luts).execute()
+
+
+def check(name: str, temp_dir: str, layers: list, expected_layers: list):
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    expected_path = os.path.join(temp_dir, f"{name}_expected.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers)
+    write_psd(expected_path, WIDTH, HEIGHT, expected_layers)
+
+    for use_luts in [False, True]:
+        expected = render(expected_path, use_luts)
+        if not np.array_equal(render(file_path, use_luts), expected):
+            raise RuntimeError(f"{name} render doesn't match its equivalent (use_luts={use_luts})")
+
+        psd = PSDFile(file_path, lazy_decode=True)
+        region_data = RenderPlan.from_psd(psd, use_luts=use_luts, region=REGION).execute(tile_size=16)
+        if not np.array_equal(region_data, expected[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+            raise RuntimeError(f"{name} tiled region render doesn't match its equivalent (use_luts={use_luts})")
+
+
+def check_windows(temp_dir: str, mask: np.array):
+    """ Masks are never padded past their rect; constant parts of the window are 0-d, or None if opaque. """
+    file_path = os.path.join(temp_dir, "windows.psd")
+    write_psd(file_path, WIDTH, HEIGHT, masked_layers(mask, MASK_RECT, 128, 0))
+    layer = PSDFile(file_path).layers[1]
+    window = Rect(0, 0, HEIGHT, WIDTH)
+    pieces = mask_to_windows(layer, window)
+    if sum((p.bottom - p.top) * (p.right - p.left) for p, _ in pieces) != HEIGHT * WIDTH:
+        raise RuntimeError("Mask pieces don't cover the window")
+    if pieces[0][0] != MASK_RECT or pieces[0][1].shape != mask.shape:
+        raise RuntimeError(f"Expected the mask's pixels for its rect first; got {pieces[0][0]}")
+    if any(m.ndim != 0 for _, m in pieces[1:]):
+        raise RuntimeError("Expected the rest of the window to use a constant mask")
+
+    write_psd(file_path, WIDTH, HEIGHT, masked_layers(mask, MASK_RECT, 255, MASK_FLAG_DISABLED))
+    layer = PSDFile(file_path).layers[1]
+    if mask_to_windows(layer, window) != [(window, None)]:
+        raise RuntimeError("A disabled mask should give the whole window with no mask")
+
+
+def main():
+    rng = np.random.default_rng(5)
+    mask = rng.integers(0, 256, (MASK_RECT.bottom - MASK_RECT.top, MASK_RECT.right - MASK_RECT.left), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_windows(temp_dir, mask)
+
+        # Defaults other than black and white mask the parts of the layer outside the mask's rect by a constant
+        for default_color in [0, 128, 255]:
+            check(f"default_{default_color}", temp_dir, masked_layers(mask, MASK_RECT, default_color, 0),
+                  masked_layers(padded_mask(mask, default_color), Rect(0, 0, HEIGHT, WIDTH), 0, 0))
+
+        # Disabled masks are ignored
+        check("disabled", temp_dir, masked_layers(mask, MASK_RECT, 0, MASK_FLAG_DISABLED),
+              masked_layers(None, None, 0, 0))
+
+        # Inverted masks act like their negative, default color included
+        for default_color in [0, 255]:
+            check(f"inverted_{default_color}", temp_dir, masked_layers(mask, MASK_RECT, default_color,
+                                                                       MASK_FLAG_INVERTED),
+                  masked_layers(255 - mask, MASK_RECT, 255 - default_color, 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
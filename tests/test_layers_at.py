@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import (CHANNEL_ALPHA, MASK_FLAG_DISABLED, MASK_FLAG_INVERTED, SyntheticGroup, SyntheticLayer,
+                           write_psd)
+
+
+WIDTH = 40
+HEIGHT = 30
+MASK_RECT = Rect(5, 5, 15, 15)
+
+
+def opaque_layer(name: str, **kwargs) -> SyntheticLayer:
+    channels = {i: np.full((HEIGHT, WIDTH), 128, dtype=np.uint8) for i in [0, 1, 2, CHANNEL_ALPHA]}
+    return SyntheticLayer(name, Rect(0, 0, HEIGHT, WIDTH), channels, **kwargs)
+
+
+def masked_layer(name: str, default_color: int = 0, flags: int = 0) -> SyntheticLayer:
+    """ A layer masked to its left half inside the mask rect. """
+    mask = np.zeros((MASK_RECT.bottom - MASK_RECT.top, MASK_RECT.right - MASK_RECT.left), dtype=np.uint8)
+    mask[:, :5] = 255
+    return opaque_layer(name, mask_rect=MASK_RECT, mask=mask, mask_default_color=default_color, mask_flags=flags)
+
+
+def names(psd: PSDFile, x: int, y: int) -> list:
+    return [layer.name for layer in psd.layers_at(x, y)]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "layers_at.psd")
+        layers = [
+            opaque_layer("base"),
+            SyntheticGroup("hidden group", [opaque_layer("in hidden group")], visible=False),
+            SyntheticGroup("clear group", [opaque_layer("in clear group")], blend_mode="normal", opacity=0),
+            opaque_layer("clear", opacity=0),
+            masked_layer("masked"),
+            masked_layer("inverted", flags=MASK_FLAG_INVERTED),
+            masked_layer("white outside", default_color=255),
+            masked_layer("disabled", flags=MASK_FLAG_DISABLED),
+        ]
+        write_psd(file_path, WIDTH, HEIGHT, layers)
+        psd = PSDFile(file_path)
+
+        # Inside the mask, on the mask's white side
+        if names(psd, 6, 6) != ["disabled", "white outside", "masked", "base"]:
+            raise RuntimeError(f"Wrong layers on the white side of the masks: {names(psd, 6, 6)}")
+
+        # Inside the mask, on the mask's black side
+        if names(psd, 12, 6) != ["disabled", "inverted", "base"]:
+            raise RuntimeError(f"Wrong layers on the black side of the masks: {names(psd, 12, 6)}")
+
+        # Outside the mask, where the default color applies
+        if names(psd, 30, 20) != ["disabled", "white outside", "inverted", "base"]:
+            raise RuntimeError(f"Wrong layers outside the masks: {names(psd, 30, 20)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import os
+import sys
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_psd
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "memory_limit")
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+
+# Small enough that every test file has to be tiled
+MEMORY_LIMIT = 32 * 2 ** 20
+
+
+def main(files: List[str]):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    if not len(files):
+        files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES]
+
+    for file in files:
+        psd = PSDFile(file)
+        name = os.path.splitext(os.path.basename(file))[0]
+        full_path = os.path.join(OUTPUT_DIR, f"{name}.png")
+        tiled_path = os.path.join(OUTPUT_DIR, f"{name}_tiled.png")
+
+        render_psd(psd, full_path, overwrite=True)
+        stats = render_psd(psd, tiled_path, overwrite=True, memory_limit=MEMORY_LIMIT)
+        print(f"{name}: {stats}")
+
+        if stats.tile_size is None:
+            raise RuntimeError(f"{name} was not tiled under a {MEMORY_LIMIT} byte limit")
+        if stats.peak_bytes > MEMORY_LIMIT:
+            raise RuntimeError(f"{name} used {stats.peak_bytes} bytes; the limit was {MEMORY_LIMIT}")
+        if not np.array_equal(np.asarray(Image.open(full_path)), np.asarray(Image.open(tiled_path))):
+            raise RuntimeError(f"Tiled render of {name} doesn't match the full render")
+
+        try:
+            render_psd(psd, tiled_path, overwrite=True, memory_limit=1)
+        except MemoryError:
+            pass
+        else:
+            raise RuntimeError(f"Rendering {name} with a 1 byte limit should have failed")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,48 @@
+import filecmp
+import os
+import shutil
+import sys
+import time
+from typing import List
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_groups, render_layers
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "parallel_export")
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+MAX_WORKERS = 4
+
+
+def main(files: List[str]):
+    shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+
+    if not len(files):
+        files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES]
+
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        for render, skip_hidden in [(render_layers, "skip_hidden_layers"), (render_groups, "skip_hidden_groups")]:
+            folders = {}
+            for max_workers in [1, MAX_WORKERS]:
+                # Lazy decoding makes the workers decode channels concurrently
+                psd = PSDFile(file, lazy_decode=max_workers > 1)
+                folder = os.path.join(OUTPUT_DIR, name, f"{render.__name__}_{max_workers}")
+                os.makedirs(folder)
+                start = time.perf_counter()
+                render(psd, folder, overwrite=True, render_masks=True, max_workers=max_workers, compression_level=1,
+                       **{skip_hidden: False})
+                print(f"{name} {render.__name__} max_workers={max_workers}: {time.perf_counter() - start:.3f} s")
+                folders[max_workers] = folder
+
+            serial, parallel = folders[1], folders[MAX_WORKERS]
+            match, mismatch, errors = filecmp.cmpfiles(serial, parallel, os.listdir(serial), shallow=False)
+            if mismatch or errors or sorted(os.listdir(serial)) != sorted(os.listdir(parallel)):
+                raise RuntimeError(f"Parallel {render.__name__} of {file} doesn't match the serial export: "
+                                   f"{mismatch + errors}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
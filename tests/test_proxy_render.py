@@ -0,0 +1,47 @@
+import os
+import sys
+from typing import List
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.proxy import PROXY_SCALES, downsample_rgba, scale_factor
+from photoshoppy.psd_render.render_plan import RenderPlan
+
+
+THIS_DIR = os.path.dirname(__file__)
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+
+# Proxies composite box-filtered layers, which isn't the same as box filtering the composite. Edges of layers,
+#   masks and non-linear blend modes drift a little; these bound how far.
+MAX_MEAN_ERROR = 1.0
+MAX_P99_ERROR = 8
+
+
+def main(files: List[str]):
+    if not len(files):
+        files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES]
+
+    for file in files:
+        psd = PSDFile(file)
+        name = os.path.basename(file)
+        plan = RenderPlan.from_psd(psd)
+        full = plan.execute()
+
+        for scale in PROXY_SCALES:
+            factor = scale_factor(scale)
+            proxy = plan.scaled(scale).execute()
+            expected = downsample_rgba(full, plan.canvas, factor)
+            if proxy.shape != expected.shape:
+                raise RuntimeError(f"{name} at 1/{factor}: proxy is {proxy.shape}; expected {expected.shape}")
+
+            error = np.abs(proxy.astype(np.int16) - expected.astype(np.int16))
+            mean, p99 = error.mean(), np.percentile(error, 99)
+            print(f"{name} 1/{factor}: mean error {mean:.3f}, 99th percentile {p99:.0f}")
+            if mean > MAX_MEAN_ERROR or p99 > MAX_P99_ERROR:
+                raise RuntimeError(f"{name} at 1/{factor} drifted too far from the downsampled full render")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,41 @@
+import os
+import sys
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_psd
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "render_bands")
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+BAND_HEIGHT = 64
+
+
+def main(files: List[str]):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    if not len(files):
+        files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES]
+
+    for file in files:
+        psd = PSDFile(file)
+        name = os.path.splitext(os.path.basename(file))[0]
+        full_path = os.path.join(OUTPUT_DIR, f"{name}.png")
+        render_psd(psd, full_path, overwrite=True)
+        expected = np.asarray(Image.open(full_path))
+
+        for ext in ["png", "tif"]:
+            band_path = os.path.join(OUTPUT_DIR, f"{name}_bands.{ext}")
+            print(f"rendering {band_path}")
+            render_psd(psd, band_path, overwrite=True, band_height=BAND_HEIGHT)
+            if not np.array_equal(np.asarray(Image.open(band_path)), expected):
+                raise RuntimeError(f"Band render {band_path} doesn't match the full render")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
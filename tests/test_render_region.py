@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+from typing import List
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_psd
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.rect import Rect
+
+
+THIS_DIR = os.path.dirname(__file__)
+PSD_FILES = ["zig_zags.psd", "rings.psd", "lena.psd"]
+REGIONS = [Rect(0, 0, 64, 64), Rect(100, 150, 180, 390), Rect(-20, -20, 10000, 10000)]
+
+
+def check_plan_arguments(file: str):
+    """ A plan passed to render_psd keeps its own region and use_luts; different ones can't be given with it. """
+    psd = PSDFile(file)
+    plan = RenderPlan.from_psd(psd, region=REGIONS[0])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "region.npy")
+        render_psd(psd, file_path, plan=plan, region=REGIONS[0], use_luts=False)
+        if np.load(file_path).shape != (64, 64, 4):
+            raise RuntimeError(f"Rendering a region's plan gave shape {np.load(file_path).shape}")
+        for kwargs in [dict(region=REGIONS[1]), dict(region=None, use_luts=True)]:
+            try:
+                render_psd(psd, file_path, overwrite=True, plan=plan, **kwargs)
+            except ValueError:
+                continue
+            raise RuntimeError(f"render_psd should reject a plan compiled without {kwargs}")
+
+
+def main(files: List[str]):
+    if not len(files):
+        files = [os.path.join(THIS_DIR, "psd_files", file) for file in PSD_FILES]
+
+    for file in files:
+        name = os.path.basename(file)
+        full = RenderPlan.from_psd(PSDFile(file)).execute()
+
+        for region in REGIONS:
+            psd = PSDFile(file, lazy_decode=True)
+            plan = RenderPlan.from_psd(psd, region=region)
+            image_data = plan.execute()
+
+            r = plan.region
+            if not np.array_equal(image_data, full[r.top:r.bottom, r.left:r.right]):
+                raise RuntimeError(f"{name}: region {tuple(region)} doesn't match the full render")
+
+            decoded = [channel for layer in psd.layers for channel in layer.channels if channel.is_decoded]
+            if decoded:
+                raise RuntimeError(f"{name}: rendering region {tuple(region)} decoded {len(decoded)} whole channels")
+            print(f"{name}: region {tuple(r)} ok")
+
+    check_plan_arguments(files[0])
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
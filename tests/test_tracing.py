@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+from typing import List
+
+import numpy as np
+
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render import render_psd
+from photoshoppy.psd_render import tracing
+from photoshoppy.psd_render.tracing import Tracer
+
+
+THIS_DIR = os.path.dirname(__file__)
+OUTPUT_DIR = os.path.join(THIS_DIR, "renders", "tracing")
+PSD_FILE_PATH = os.path.join(THIS_DIR, "psd_files", "rings.psd")
+
+
+def check_memory_peaks():
+    """ Spans record the memory allocated inside them, with or without tracemalloc.reset_peak. """
+    reset_peak = tracing._reset_peak
+    try:
+        for tracing._reset_peak in [reset_peak, None]:
+            with Tracer(track_memory=True) as tracer:
+                with tracing.span("outer"):
+                    with tracing.span("allocate"):
+                        data = np.ones(8 * 2 ** 20, dtype=np.uint8)
+                        del data
+            peaks = {span.name: span.peak_bytes for span in tracer.root.iter_spans()}
+            if min(peaks["outer"], peaks["allocate"]) < 8 * 2 ** 20 or peaks["trace"] < peaks["outer"]:
+                raise RuntimeError(f"Wrong memory peaks {peaks} (reset_peak={tracing._reset_peak})")
+    finally:
+        tracing._reset_peak = reset_peak
+
+
+def main(files: List[str]):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    check_memory_peaks()
+
+    if not len(files):
+        files = [PSD_FILE_PATH]
+
+    for file in files:
+        psd = PSDFile(file)
+        name = os.path.splitext(os.path.basename(file))[0]
+        with Tracer(track_memory=True) as tracer:
+            render_psd(psd, os.path.join(OUTPUT_DIR, f"{name}.png"), overwrite=True)
+        print(tracer.summary())
+
+        spans = list(tracer.root.iter_spans())
+        layer_spans = [s for s in spans if s.category == "layer"]
+        if not layer_spans:
+            raise RuntimeError(f"No layer spans recorded for {file}")
+        for span in spans:
+            if span.end is None or span.end < span.start:
+                raise RuntimeError(f"Span '{span.name}' was not closed")
+        for span in layer_spans:
+            if not {"screen space", "mask"} <= {child.category for child in span.children}:
+                raise RuntimeError(f"Layer span '{span.name}' is missing its child spans")
+
+        json_path = os.path.join(OUTPUT_DIR, f"{name}.json")
+        trace_path = os.path.join(OUTPUT_DIR, f"{name}.trace.json")
+        tracer.write_json(json_path)
+        tracer.write_chrome_trace(trace_path)
+        with open(trace_path) as f:
+            events = json.load(f)["traceEvents"]
+        if len(events) != len(spans):
+            raise RuntimeError(f"Chrome trace has {len(events)} events; expected {len(spans)}")
+        print(f"wrote {trace_path}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args)
@@ -0,0 +1,190 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from photoshoppy.models.layer.layer_info.layer_info_blocks.vector_mask import (
+    OPERATION_SUBTRACT, OPERATION_UNION, OPERATION_XOR)
+from photoshoppy.psd_file import PSDFile
+from photoshoppy.psd_render.render_plan import RenderPlan
+from photoshoppy.utilities.rect import Rect
+from synthetic_psd import CHANNEL_ALPHA, DescriptorObject, SyntheticLayer, fill_layer, vector_mask_info, write_psd
+
+
+WIDTH = 90
+HEIGHT = 60
+REGION = Rect(7, 11, 53, 83)
+KAPPA = 0.5522847498
+
+
+def point(x: float, y: float) -> tuple:
+    return x / WIDTH, y / HEIGHT
+
+
+def polygon(points: list, operation: int = OPERATION_UNION) -> tuple:
+    """ A closed subpath of straight segments through (x, y) pixel coordinates. """
+    return True, operation, [(point(x, y),) * 3 for x, y in points]
+
+
+def rectangle(left: float, top: float, right: float, bottom: float, operation: int = OPERATION_UNION) -> tuple:
+    return polygon([(left, top), (right, top), (right, bottom), (left, bottom)], operation=operation)
+
+
+def circle(cx: float, cy: float, radius: float) -> tuple:
+    """ A closed subpath of 4 Bezier segments approximating a circle. """
+    handle = radius * KAPPA
+    knots = []
+    for dx, dy in [(1, 0), (0, 1), (-1, 0), (0, -1)]:
+        x, y = cx + dx * radius, cy + dy * radius
+        # Tangent, in the direction the path travels
+        tx, ty = -dy, dx
+        knots.append((point(x - tx * handle, y - ty * handle), point(x, y), point(x + tx * handle, y + ty * handle)))
+    return True, OPERATION_UNION, knots
+
+
+def masked_fill(name: str, subpaths: list, flags: int = 0, **kwargs) -> SyntheticLayer:
+    layer = fill_layer(name, "SoCo", {"Clr ": DescriptorObject("RGBC", {"Rd  ": 255.0, "Grn ": 255.0, "Bl  ": 255.0})},
+                       **kwargs)
+    layer.layer_info.append(("vmsk", vector_mask_info(subpaths, flags=flags)))
+    return layer
+
+
+def base_layer() -> SyntheticLayer:
+    rng = np.random.default_rng(5)
+    channels = {i: rng.integers(0, 256, (HEIGHT, WIDTH), dtype=np.uint8) for i in range(3)}
+    channels[CHANNEL_ALPHA] = np.full((HEIGHT, WIDTH), 255, dtype=np.uint8)
+    return SyntheticLayer("base", Rect(0, 0, HEIGHT, WIDTH), channels)
+
+
+def write(temp_dir: str, name: str, layers: list, **kwargs) -> str:
+    file_path = os.path.join(temp_dir, f"{name}.psd")
+    write_psd(file_path, WIDTH, HEIGHT, layers, **kwargs)
+    return file_path
+
+
+def coverage(temp_dir: str, name: str, subpaths: list, **kwargs) -> np.array:
+    """ The alpha of a white fill layer masked by the subpaths, from 0 to 1. """
+    file_path = write(temp_dir, name, [masked_fill(name, subpaths, **kwargs)])
+    return RenderPlan.from_psd(PSDFile(file_path)).execute()[:, :, 3] / 255
+
+
+def supersampled(inside, samples: int = 16) -> np.array:
+    """ Reference coverage, from a grid of samples in every pixel. """
+    offsets = (np.arange(samples) + 0.5) / samples
+    ys = (np.arange(HEIGHT)[:, None] + offsets[None, :]).ravel()
+    xs = (np.arange(WIDTH)[:, None] + offsets[None, :]).ravel()
+    hits = inside(xs[None, :], ys[:, None])
+    return hits.reshape(HEIGHT, samples, WIDTH, samples).mean(axis=(1, 3))
+
+
+def check_rectangle(temp_dir: str):
+    """ A pixel aligned rectangle matches a layer mask of the same shape. """
+    rect = Rect(10, 20, 40, 70)
+    kwargs = dict(blend_mode="multiply", opacity=200)
+    file_path = write(temp_dir, "rectangle", [base_layer(), masked_fill("fill", [rectangle(20, 10, 70, 40)],
+                                                                         **kwargs)])
+    psd = PSDFile(file_path)
+    vector_mask = psd.layer("fill").vector_mask
+    if vector_mask is None or len(vector_mask.subpaths) != 1 or len(vector_mask.subpaths[0].knots) != 4:
+        raise RuntimeError("Vector mask wasn't parsed")
+
+    mask = np.full((rect.bottom - rect.top, rect.right - rect.left), 255, dtype=np.uint8)
+    channels = {i: np.full((HEIGHT, WIDTH), 255, dtype=np.uint8) for i in [0, 1, 2, CHANNEL_ALPHA]}
+    expected = SyntheticLayer("expected", Rect(0, 0, HEIGHT, WIDTH), channels, mask_rect=rect, mask=mask, **kwargs)
+    expected_path = write(temp_dir, "rectangle_expected", [base_layer(), expected])
+
+    image_data = RenderPlan.from_psd(psd).execute()
+    if not np.array_equal(image_data, RenderPlan.from_psd(PSDFile(expected_path)).execute()):
+        raise RuntimeError("Rectangular vector mask doesn't match a layer mask of the same rectangle")
+
+    region_data = RenderPlan.from_psd(PSDFile(file_path), region=REGION).execute(tile_size=16)
+    if not np.array_equal(region_data, image_data[REGION.top:REGION.bottom, REGION.left:REGION.right]):
+        raise RuntimeError("Vector mask rendered a tile at a time doesn't match")
+
+
+def check_antialiasing(temp_dir: str):
+    """ Coverage of sloped edges and curves is close to a supersampled reference. """
+    corners = [(5.3, 4.7), (80.2, 20.1), (30.6, 55.4)]
+
+    def in_triangle(xs, ys):
+        signs = []
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+            signs.append((x1 - x0) * (ys - y0) - (y1 - y0) * (xs - x0) >= 0)
+        return (signs[0] == signs[1]) & (signs[1] == signs[2])
+
+    triangle = coverage(temp_dir, "triangle", [polygon(corners)])
+    error = np.abs(triangle - supersampled(in_triangle))
+    if error.max() > 0.15 or error.mean() > 0.005:
+        raise RuntimeError(f"Triangle coverage is off by up to {error.max():.3f}, {error.mean():.4f} on average")
+
+    radius = 25.0
+    disk = coverage(temp_dir, "circle", [circle(45.0, 30.0, radius)])
+    if abs(disk.sum() / (np.pi * radius ** 2) - 1) > 0.01:
+        raise RuntimeError(f"Circle's area is {disk.sum():.1f}, instead of {np.pi * radius ** 2:.1f}")
+    if disk[30, 45] != 1 or disk[0, 0] != 0 or not (0 < disk[30, 20] < 1):
+        raise RuntimeError("Circle should be opaque inside, clear outside and partially covered on its edge")
+
+
+def check_operations(temp_dir: str):
+    outer = rectangle(10, 10, 60, 50)
+    inner = (20, 20, 40, 40)
+
+    inverted = coverage(temp_dir, "inverted", [outer], flags=1)
+    if inverted[30, 30] != 0 or inverted[5, 5] != 1:
+        raise RuntimeError("Inverted vector masks should hide the inside of the path")
+
+    subtracted = coverage(temp_dir, "subtract", [outer, rectangle(*inner, operation=OPERATION_SUBTRACT)])
+    if subtracted[30, 30] != 0 or subtracted[15, 15] != 1 or subtracted[5, 5] != 0:
+        raise RuntimeError("Subtracted subpaths should cut holes out of the path")
+
+    xor = coverage(temp_dir, "xor", [outer, rectangle(50, 30, 80, 55, operation=OPERATION_XOR)])
+    if xor[40, 55] != 0 or xor[15, 15] != 1 or xor[52, 70] != 1:
+        raise RuntimeError("Subpaths combined with XOR should hide where they overlap")
+
+
+def check_layer_mask(temp_dir: str):
+    """ Vector masks and layer masks are multiplied together. """
+    rng = np.random.default_rng(3)
+    mask_rect = Rect(5, 5, 45, 55)
+    mask = rng.integers(0, 256, (mask_rect.bottom - mask_rect.top, mask_rect.right - mask_rect.left), dtype=np.uint8)
+    alpha = coverage(temp_dir, "both", [rectangle(20, 10, 70, 40)], mask_rect=mask_rect, mask=mask) * 255
+
+    expected = np.zeros((HEIGHT, WIDTH))
+    expected[10:40, 20:55] = mask[5:35, 15:50]
+    if np.abs(alpha - expected).max() > 1:
+        raise RuntimeError("Vector mask and layer mask should both hide the layer")
+
+
+def check_proxy_and_cache(temp_dir: str):
+    file_path = write(temp_dir, "proxy", [base_layer(), masked_fill("fill", [circle(45.0, 30.0, 20.0)],
+                                                                    blend_mode="screen")])
+    plan = RenderPlan.from_psd(PSDFile(file_path))
+    proxy_data = plan.scaled(0.5).execute()
+    if proxy_data.shape != (HEIGHT // 2, WIDTH // 2, 4):
+        raise RuntimeError(f"Proxy of a vector masked layer has the wrong shape: {proxy_data.shape}")
+    vector_mask = plan.scaled(0.5).ops[-1].vector_mask
+    if vector_mask.rect != Rect(5, 12, 25, 33):
+        raise RuntimeError(f"Proxy vector mask should be rasterized at the proxy's scale, not {vector_mask.rect}")
+
+    # The raster is made once per vector mask and scale
+    vector_mask = plan.ops[-1].vector_mask
+    if vector_mask.image_data is not plan.ops[-1].vector_mask.image_data:
+        raise RuntimeError("Rasterized vector masks should be cached")
+    if vector_mask.image_data is not vector_mask.scaled(1).image_data:
+        raise RuntimeError("Rasterized vector masks should be cached for every plan that uses them")
+    if vector_mask.image_data.shape != (40, 40):
+        raise RuntimeError("Vector masks should only be rasterized inside their bounding box")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        check_rectangle(temp_dir)
+        check_antialiasing(temp_dir)
+        check_operations(temp_dir)
+        check_layer_mask(temp_dir)
+        check_proxy_and_cache(temp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())